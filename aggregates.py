@@ -0,0 +1,88 @@
+"""
+Materialized aggregate tables for the chart queries.
+
+The per-airline, per-route, per-hour and per-day delay counts are stored in summary
+tables (see sql_queries.AGGREGATE_TABLES). The highest flight ID already
+counted is kept in agg_refresh_state, so a refresh only aggregates the
+flights inserted since the previous one and adds them to the stored counts.
+A table added after the others were built would miss the flights already
+counted, so in that case every table is rebuilt.
+"""
+from sqlalchemy import text
+
+from query_registry import QUERIES
+from sql_queries import (AGGREGATE_TABLES, AGGREGATE_REFRESH_QUERIES, QUERY_MAX_FLIGHT_ID,
+                         QUERY_AGG_LAST_FLIGHT_ID, QUERY_AGG_SET_LAST_FLIGHT_ID)
+
+
+def table_names(connection):
+    """
+    Returns the set of table names present in the database
+    """
+    result = connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))
+    return set(result.scalars().all())
+
+
+def create_aggregate_tables(connection):
+    """
+    Creates the aggregate tables if they don't exist yet
+    :return: the names of the tables that were created
+    """
+    existing = table_names(connection)
+    for ddl in AGGREGATE_TABLES.values():
+        connection.execute(text(ddl))
+    return [name for name in AGGREGATE_TABLES if name not in existing]
+
+
+def last_refreshed_flight_id(connection):
+    """
+    Returns the highest flight ID already counted in the aggregate tables (0 if none)
+    """
+    last_id = connection.execute(QUERIES.statement(QUERY_AGG_LAST_FLIGHT_ID)).scalar()
+    return last_id if last_id is not None else 0
+
+
+def aggregates_up_to_date(connection):
+    """
+    Returns whether every aggregate table exists and counts every flight, without writing
+    anything. A read-only database can't create or refresh the tables, so its stored
+    counts are only used when they pass this check.
+    """
+    if not set(AGGREGATE_TABLES) <= table_names(connection):
+        return False
+    max_id = connection.execute(QUERIES.statement(QUERY_MAX_FLIGHT_ID)).scalar() or 0
+    return last_refreshed_flight_id(connection) >= max_id
+
+
+def refresh_aggregates(connection):
+    """
+    Adds the flights inserted since the last refresh to the aggregate tables.
+    The connection has to be inside a transaction (e.g. from engine.begin()),
+    so the counts and the refresh state are updated atomically.
+    :param connection: SQLAlchemy connection
+    :return: the number of flight IDs covered by this refresh (0 if already up to date)
+    """
+    created = create_aggregate_tables(connection)
+
+    last_id = last_refreshed_flight_id(connection)
+    if created and last_id:
+        # A new table next to already filled ones: count every flight again
+        return rebuild_aggregates(connection)
+    max_id = connection.execute(QUERIES.statement(QUERY_MAX_FLIGHT_ID)).scalar() or 0
+    if max_id <= last_id:
+        return 0
+
+    params = {'last_id': last_id, 'max_id': max_id}
+    for query in AGGREGATE_REFRESH_QUERIES.values():
+        connection.execute(QUERIES.statement(query), params)
+    connection.execute(QUERIES.statement(QUERY_AGG_SET_LAST_FLIGHT_ID), params)
+    return max_id - last_id
+
+
+def rebuild_aggregates(connection):
+    """
+    Drops and recomputes every aggregate table from the whole flights table
+    """
+    for name in AGGREGATE_TABLES:
+        connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+    return refresh_aggregates(connection)
@@ -0,0 +1,213 @@
+"""
+Async counterpart of data.FlightData.
+
+AsyncFlightData offers the same getters as coroutines. Each query runs on a
+worker thread against a pooled FlightData, so it doesn't block the event
+loop, and many lookups can be issued at once with asyncio.gather. SQLite
+releases the GIL while it executes a query, so queries on separate pooled
+connections run in parallel. The streaming iter_* methods are async
+generators: each item is read on a worker thread.
+
+Every query pays for a hop to a worker thread and back, so on a machine with
+few cores a sequence of lookups runs slower than with FlightData itself.
+Async pays off when the lookups wait on each other's connections or when
+the event loop has other work to do meanwhile.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import data
+
+# Default maximum number of queries running at the same time
+MAX_CONCURRENCY = 8
+
+
+class AsyncFlightData:
+    """
+    Async Data Access Layer object with the same getters as data.FlightData.
+    At most max_concurrency queries run at once; further calls wait for a free slot.
+    """
+
+    def __init__(self, db_uri, max_concurrency=MAX_CONCURRENCY, **kwargs):
+        """
+        Initialize a pooled FlightData with one connection per concurrent query.
+        Extra keyword arguments are passed on to data.FlightData.
+        """
+        kwargs.setdefault('pool_mode', 'pool')
+        kwargs.setdefault('pool_size', max_concurrency)
+        self._data_manager = data.FlightData(db_uri, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix='flight-data')
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(self, getter, *args, **kwargs):
+        """
+        Runs a FlightData getter on the worker threads, limited by the concurrency semaphore
+        """
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(getter, *args, **kwargs))
+
+    async def _iterate(self, iterate, *args):
+        """
+        Runs a FlightData iter_* method on the worker threads and yields its items as they are read.
+        The iteration holds a concurrency slot (and, while streaming, its pooled connection)
+        until it ends or the async generator is closed.
+        """
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            iterator = iterate(*args)
+            end = object()
+            try:
+                while True:
+                    item = await loop.run_in_executor(self._executor, next, iterator, end)
+                    if item is end:
+                        break
+                    yield item
+            finally:
+                await loop.run_in_executor(self._executor, iterator.close)
+
+    async def get_flight_by_id(self, flight_id):
+        """
+        Async version of FlightData.get_flight_by_id
+        """
+        return await self._run(self._data_manager.get_flight_by_id, flight_id)
+
+    async def get_delayed_flights_by_airport(self, airport_short_code):
+        """
+        Async version of FlightData.get_delayed_flights_by_airport
+        """
+        return await self._run(self._data_manager.get_delayed_flights_by_airport, airport_short_code)
+
+    async def get_delayed_flights_by_airline(self, airline_name):
+        """
+        Async version of FlightData.get_delayed_flights_by_airline
+        """
+        return await self._run(self._data_manager.get_delayed_flights_by_airline, airline_name)
+
+    async def get_flights_by_date(self, day, month, year):
+        """
+        Async version of FlightData.get_flights_by_date
+        """
+        return await self._run(self._data_manager.get_flights_by_date, day, month, year)
+
+    async def get_delayed_flights_by_airport_page(self, airport_short_code, after_id=0, page_size=None):
+        """
+        Async version of FlightData.get_delayed_flights_by_airport_page
+        """
+        return await self._run(self._data_manager.get_delayed_flights_by_airport_page,
+                               airport_short_code, after_id, page_size)
+
+    async def get_flights_by_date_page(self, day, month, year, after_id=0, page_size=None):
+        """
+        Async version of FlightData.get_flights_by_date_page
+        """
+        return await self._run(self._data_manager.get_flights_by_date_page, day, month, year, after_id, page_size)
+
+    def iter_delayed_flights_by_airport_pages(self, airport_short_code, page_size=None):
+        """
+        Async version of FlightData.iter_delayed_flights_by_airport_pages
+        """
+        return self._iterate(self._data_manager.iter_delayed_flights_by_airport_pages,
+                             airport_short_code, page_size)
+
+    def iter_flights_by_date_pages(self, day, month, year, page_size=None):
+        """
+        Async version of FlightData.iter_flights_by_date_pages
+        """
+        return self._iterate(self._data_manager.iter_flights_by_date_pages, day, month, year, page_size)
+
+    async def get_flights_by_ids(self, flight_ids):
+        """
+        Async version of FlightData.get_flights_by_ids
+        """
+        return await self._run(self._data_manager.get_flights_by_ids, flight_ids)
+
+    async def get_delayed_flights_by_airports(self, airport_short_codes):
+        """
+        Async version of FlightData.get_delayed_flights_by_airports
+        """
+        return await self._run(self._data_manager.get_delayed_flights_by_airports, airport_short_codes)
+
+    async def get_flights_by_dates(self, dates):
+        """
+        Async version of FlightData.get_flights_by_dates
+        """
+        return await self._run(self._data_manager.get_flights_by_dates, dates)
+
+    async def get_flights_by_date_range(self, start, end):
+        """
+        Async version of FlightData.get_flights_by_date_range
+        """
+        return await self._run(self._data_manager.get_flights_by_date_range, start, end)
+
+    def iter_flights_by_date_range(self, start, end, batch_size=None):
+        """
+        Async version of FlightData.iter_flights_by_date_range
+        """
+        return self._iterate(self._data_manager.iter_flights_by_date_range, start, end, batch_size)
+
+    def iter_flights_by_date(self, day, month, year, batch_size=None):
+        """
+        Async version of FlightData.iter_flights_by_date
+        """
+        return self._iterate(self._data_manager.iter_flights_by_date, day, month, year, batch_size)
+
+    async def get_delayed_flights_by_day(self, start, end, force_raw=False, columnar=False):
+        """
+        Async version of FlightData.get_delayed_flights_by_day
+        """
+        return await self._run(self._data_manager.get_delayed_flights_by_day, start, end, force_raw, columnar)
+
+    async def get_delayed_and_departed_flights_by_airline(self, force_raw=False, columnar=False):
+        """
+        Async version of FlightData.get_delayed_and_departed_flights_by_airline
+        """
+        return await self._run(self._data_manager.get_delayed_and_departed_flights_by_airline,
+                               force_raw, columnar)
+
+    async def get_delay_and_departure_time(self):
+        """
+        Async version of FlightData.get_delay_and_departure_time
+        """
+        return await self._run(self._data_manager.get_delay_and_departure_time)
+
+    def iter_delay_and_departure_time(self, batch_size=None):
+        """
+        Async version of FlightData.iter_delay_and_departure_time
+        """
+        return self._iterate(self._data_manager.iter_delay_and_departure_time, batch_size)
+
+    async def get_delayed_flights_by_hour(self, force_raw=False, columnar=False):
+        """
+        Async version of FlightData.get_delayed_flights_by_hour
+        """
+        return await self._run(self._data_manager.get_delayed_flights_by_hour, force_raw, columnar)
+
+    async def get_origin_destination_airport_delay(self, force_raw=False, columnar=False):
+        """
+        Async version of FlightData.get_origin_destination_airport_delay
+        """
+        return await self._run(self._data_manager.get_origin_destination_airport_delay,
+                               force_raw, columnar)
+
+    async def get_origin_destination_latitude_longitude(self, force_raw=False, columnar=False):
+        """
+        Async version of FlightData.get_origin_destination_latitude_longitude
+        """
+        return await self._run(self._data_manager.get_origin_destination_latitude_longitude,
+                               force_raw, columnar)
+
+    def close(self):
+        """
+        Waits for the running queries, stops the worker threads and closes the connections
+        """
+        self._executor.shutdown(wait=True)
+        self._data_manager.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
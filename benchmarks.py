@@ -0,0 +1,668 @@
+"""
+Benchmarks for the flight data access layer.
+
+Every benchmark runs against a synthetic flights database, so the real
+flights.sqlite3 is not needed. Run a benchmark from the command line:
+
+    python benchmarks.py pooling --rows 100000 --lookups 5000
+
+The suite times every getter, analytics function and chart at each scale
+and writes machine-readable results:
+
+    python benchmarks.py suite --scales 1M,10M,50M -o results.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import sqlalchemy
+
+import data
+import data_plots
+import main as flights_app
+import sampling
+from async_data import AsyncFlightData
+
+AIRLINES = ['United Air Lines Inc.', 'American Airlines Inc.', 'US Airways Inc.',
+            'Frontier Airlines Inc.', 'JetBlue Airways', 'Skywest Airlines Inc.',
+            'Alaska Airlines Inc.', 'Spirit Air Lines', 'Southwest Airlines Co.',
+            'Delta Air Lines Inc.', 'Atlantic Southeast Airlines', 'Hawaiian Airlines Inc.',
+            'American Eagle Airlines Inc.', 'Virgin America']
+
+# Relative share of the flights of each airline (same order as AIRLINES), and how much more
+# (or less) often than average its flights are delayed
+AIRLINE_SHARES = [0.088, 0.124, 0.034, 0.016, 0.045, 0.101, 0.030, 0.020, 0.218,
+                  0.150, 0.098, 0.013, 0.050, 0.011]
+AIRLINE_DELAY_FACTORS = [1.2, 1.1, 0.9, 1.2, 1.1, 0.9, 0.7, 1.4, 1.1, 0.8, 1.1, 0.5, 1.1, 1.0]
+
+NUM_AIRPORTS = 300
+
+# Airport traffic follows a power law: the airport of rank r gets a share proportional to r ** -AIRPORT_SKEW
+AIRPORT_SKEW = 0.8
+
+# Relative share of the flights scheduled to depart in each hour of the day
+HOURLY_SHARES = [0.002, 0.001, 0.001, 0.001, 0.002, 0.025, 0.068, 0.068, 0.066, 0.062, 0.058, 0.060,
+                 0.062, 0.059, 0.058, 0.060, 0.058, 0.063, 0.060, 0.055, 0.043, 0.032, 0.014, 0.005]
+
+# Fraction of flights that are cancelled (no departure time or delay)
+CANCELLED_SHARE = 0.015
+
+# Number of flights generated and inserted at a time
+GENERATE_BATCH_SIZE = 500000
+
+# Number of calls timed for the suite's getters that return many rows (the point lookups use --lookups)
+SCAN_LOOKUPS = 10
+
+# Batch size of the streamed getters in the suite
+STREAM_BATCH = 10000
+
+# Page size of the paginated getters in the suite
+PAGE_SIZE = 100
+
+# main.py analytics functions timed by the suite
+ANALYTICS_FUNCTIONS = ['delayed_flights_per_airline_chart_data', 'delayed_flights_by_hour_chart_data',
+                       'delay_for_routes_chart_data', 'route_map_chart_data', 'fetch_dashboard_data']
+
+
+def _normalize(weights):
+    """
+    Scales relative weights into probabilities that sum to 1
+    """
+    weights = np.asarray(weights, dtype=float)
+    return weights / weights.sum()
+
+
+def _day_weights(year):
+    """
+    Returns the relative number of flights on each day of the year:
+    busier in summer, quieter on Saturdays.
+    """
+    days = np.arange(np.datetime64(f'{year}-01-01'), np.datetime64(f'{year + 1}-01-01'))
+    day_of_year = np.arange(len(days))
+    weights = 1 + 0.12 * np.cos(2 * np.pi * (day_of_year - 196) / len(days))
+    # numpy weekdays: 0 = Monday ... 5 = Saturday
+    weekday = (days.astype('datetime64[D]').view('int64') - 4) % 7
+    weights[weekday == 5] *= 0.8
+    return days, _normalize(weights)
+
+
+def _generate_flights(rng, first_id, days, airline_ids, airport_codes, airport_shares):
+    """
+    Generates the flights departing on the given days (one per element, sorted), as one
+    list per flights column. The flights have skewed airline, airport and departure hour
+    frequencies, and delays that grow over the day with a long tail.
+    """
+    num_rows = len(days)
+    airline_index = rng.choice(len(airline_ids), num_rows, p=_normalize(AIRLINE_SHARES))
+
+    origin = rng.choice(len(airport_codes), num_rows, p=airport_shares)
+    destination = rng.choice(len(airport_codes), num_rows, p=airport_shares)
+    # A flight never returns to its origin: move it to the next airport
+    same = origin == destination
+    destination[same] = (destination[same] + 1) % len(airport_codes)
+
+    scheduled = rng.choice(24, num_rows, p=_normalize(HOURLY_SHARES)) * 60 + rng.integers(0, 60, num_rows)
+
+    # Delays pile up over the day: later flights are more often delayed
+    delay_probability = np.clip((0.2 + 0.012 * (scheduled // 60)) *
+                                np.take(AIRLINE_DELAY_FACTORS, airline_index), 0, 0.9)
+    delayed = rng.random(num_rows) < delay_probability
+    delay = np.where(delayed,
+                     np.ceil(rng.lognormal(2.8, 1.1, num_rows)),
+                     -rng.integers(0, 11, num_rows)).astype(np.int64)
+    departure = (scheduled + delay) % 1440
+
+    cancelled = rng.random(num_rows) < CANCELLED_SHARE
+    departure_time = np.char.zfill((departure // 60 * 100 + departure % 60).astype(str), 4).astype(object)
+    departure_time[cancelled] = None
+    departure_delay = delay.astype(object)
+    departure_delay[cancelled] = None
+    arrival_delay = (delay + rng.normal(-4, 9, num_rows).astype(np.int64)).astype(object)
+    arrival_delay[cancelled] = None
+    reason = np.where(cancelled, rng.choice(np.array(['A', 'B', 'C']), num_rows), None)
+
+    dates = days.astype(object)
+    nulls = [None] * num_rows
+    return [
+        list(range(first_id, first_id + num_rows)),
+        [date.year for date in dates],
+        [date.month for date in dates],
+        [date.day for date in dates],
+        [date.isoweekday() for date in dates],
+        np.take(airline_ids, airline_index).tolist(),
+        rng.integers(1, 7000, num_rows).tolist(),
+        [f"N{number}" for number in rng.integers(100, 1000, num_rows).tolist()],
+        np.take(airport_codes, origin).tolist(),
+        np.take(airport_codes, destination).tolist(),
+        np.char.zfill((scheduled // 60 * 100 + scheduled % 60).astype(str), 4).tolist(),
+        departure_time.tolist(),
+        departure_delay.tolist(),
+        arrival_delay.tolist(),
+        [0] * num_rows,
+        cancelled.astype(int).tolist(),
+        reason.tolist(),
+        nulls, nulls, nulls, nulls, nulls,
+    ]
+
+
+def generate_flights_db(path, num_rows, seed=42, year=2015):
+    """
+    Creates a synthetic SQLite database at the given path with the same
+    flights, airlines and airports tables used by the application.
+    The data is skewed like real traffic (see _generate_flights), and flight IDs
+    follow the flight dates. Rows are generated and inserted in batches, so
+    databases of tens of millions of flights fit in memory.
+    :param path: database file path (overwritten if it exists)
+    :param num_rows: number of flights to generate
+    :param seed: random seed, so the same arguments always give the same database
+    :param year: year of the flights
+    :return: the path of the database
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+    rng = np.random.default_rng(seed)
+    connection = sqlite3.connect(path)
+    # The file is thrown away if generation fails, so durability is not needed
+    connection.executescript("""
+        PRAGMA journal_mode=OFF;
+        PRAGMA synchronous=OFF;
+        CREATE TABLE airlines (ID INTEGER PRIMARY KEY, AIRLINE TEXT);
+        CREATE TABLE airports (IATA_CODE TEXT, AIRPORT TEXT, CITY TEXT, STATE TEXT,
+                               COUNTRY TEXT, LATITUDE REAL, LONGITUDE REAL);
+        CREATE TABLE flights (ID INTEGER PRIMARY KEY, YEAR INTEGER, MONTH INTEGER, DAY INTEGER,
+                              DAY_OF_WEEK INTEGER, AIRLINE INTEGER, FLIGHT_NUMBER INTEGER,
+                              TAIL_NUMBER TEXT, ORIGIN_AIRPORT TEXT, DESTINATION_AIRPORT TEXT,
+                              SCHEDULED_DEPARTURE TEXT, DEPARTURE_TIME TEXT, DEPARTURE_DELAY,
+                              ARRIVAL_DELAY, DIVERTED INTEGER, CANCELLED INTEGER,
+                              CANCELLATION_REASON TEXT, AIR_SYSTEM_DELAY, SECURITY_DELAY,
+                              AIRLINE_DELAY, LATE_AIRCRAFT_DELAY, WEATHER_DELAY);
+    """)
+
+    airline_ids = list(range(1, len(AIRLINES) + 1))
+    connection.executemany("INSERT INTO airlines VALUES (?, ?)", zip(airline_ids, AIRLINES))
+
+    airport_codes = [chr(65 + i // 676 % 26) + chr(65 + i // 26 % 26) + chr(65 + i % 26)
+                     for i in range(NUM_AIRPORTS)]
+    latitudes = rng.uniform(25, 49, NUM_AIRPORTS).tolist()
+    longitudes = rng.uniform(-124, -67, NUM_AIRPORTS).tolist()
+    connection.executemany("INSERT INTO airports VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           [(code, f"{code} Airport", f"{code} City", 'XX', 'USA', latitude, longitude)
+                            for code, latitude, longitude in zip(airport_codes, latitudes, longitudes)])
+    airport_shares = _normalize(np.arange(1, NUM_AIRPORTS + 1) ** -AIRPORT_SKEW)
+
+    # Number of flights on each day, so the IDs can be handed out in date order
+    days, day_weights = _day_weights(year)
+    day_counts = rng.multinomial(num_rows, day_weights)
+    flight_days = np.repeat(days, day_counts)
+
+    insert = f"INSERT INTO flights VALUES ({', '.join('?' * 22)})"
+    for start in range(0, num_rows, GENERATE_BATCH_SIZE):
+        columns = _generate_flights(rng, start + 1, flight_days[start:start + GENERATE_BATCH_SIZE],
+                                    airline_ids, airport_codes, airport_shares)
+        connection.executemany(insert, zip(*columns))
+    connection.commit()
+    connection.close()
+    return path
+
+
+def _time_calls(func, args_list):
+    """
+    Calls func once per argument tuple in args_list and returns the elapsed seconds
+    """
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return time.perf_counter() - start
+
+
+def benchmark_pooling(db_path, num_rows, num_lookups):
+    """
+    Compares get_flight_by_id point lookups under every FlightData pool mode
+    and prints the mean time per lookup.
+    """
+    rng = random.Random(0)
+    ids = [(rng.randint(1, num_rows),) for _ in range(num_lookups)]
+
+    print(f"{num_lookups} x get_flight_by_id over {num_rows} rows")
+    for pool_mode in data.POOL_MODES:
+        # The result cache is disabled so every lookup reaches the database
+        data_manager = data.FlightData(f"sqlite:///{db_path}", pool_mode=pool_mode, cache_size=0)
+        # Warm up: opens the connection(s) and loads the schema
+        data_manager.get_flight_by_id(1)
+        elapsed = _time_calls(data_manager.get_flight_by_id, ids)
+        data_manager.close()
+        print(f"  {pool_mode:<12} {elapsed:8.3f} s total, {elapsed / num_lookups * 1e6:10.1f} us/lookup")
+
+
+def benchmark_async(db_path, num_lookups, concurrency):
+    """
+    Compares running get_flights_by_date lookups one after the other on FlightData
+    with issuing them all at once through AsyncFlightData, and prints the throughput.
+    """
+    rng = random.Random(0)
+    dates = [(rng.randint(1, 28), rng.randint(1, 12), 2015) for _ in range(num_lookups)]
+
+    print(f"{num_lookups} x get_flights_by_date, concurrency {concurrency}")
+
+    data_manager = data.FlightData(f"sqlite:///{db_path}", pool_mode='pool', cache_size=0)
+    data_manager.get_flights_by_date(*dates[0])
+    elapsed = _time_calls(data_manager.get_flights_by_date, dates)
+    data_manager.close()
+    print(f"  {'sync':<12} {elapsed:8.3f} s total, {num_lookups / elapsed:10.1f} lookups/s")
+
+    async def run_concurrently():
+        async with AsyncFlightData(f"sqlite:///{db_path}", max_concurrency=concurrency,
+                                   cache_size=0) as async_data_manager:
+            await async_data_manager.get_flights_by_date(*dates[0])
+            start = time.perf_counter()
+            await asyncio.gather(*(async_data_manager.get_flights_by_date(*date) for date in dates))
+            return time.perf_counter() - start
+
+    elapsed = asyncio.run(run_concurrently())
+    print(f"  {'async':<12} {elapsed:8.3f} s total, {num_lookups / elapsed:10.1f} lookups/s")
+
+
+def benchmark_batch_lookups(db_path, num_rows, num_lookups):
+    """
+    Compares looking up many keys one by one (one query per key) with the batch
+    getters (one query per chunk of keys), on a fresh connection per query
+    ('null' pool mode) and on one long-lived connection ('persistent'),
+    and prints the time per key.
+    """
+    rng = random.Random(0)
+    ids = [rng.randint(1, num_rows) for _ in range(num_lookups)]
+    dates = [(rng.randint(1, 28), rng.randint(1, 12), 2015) for _ in range(min(num_lookups, 100))]
+
+    print(f"Batch lookups over {num_rows} rows")
+    for pool_mode in ('null', 'persistent'):
+        data_manager = data.FlightData(f"sqlite:///{db_path}", pool_mode=pool_mode, cache_size=0)
+        rows = data_manager._execute_query("SELECT IATA_CODE FROM airports", None)
+        airports = [row['IATA_CODE'] for row in rows]
+        airports = [rng.choice(airports) for _ in range(min(num_lookups, 20))]
+        data_manager.get_flight_by_id(1)
+
+        for name, getter, batch_getter, keys in (
+                ('ids', data_manager.get_flight_by_id, data_manager.get_flights_by_ids, ids),
+                ('airports', data_manager.get_delayed_flights_by_airport,
+                 data_manager.get_delayed_flights_by_airports, airports),
+                ('dates', lambda date: data_manager.get_flights_by_date(*date),
+                 data_manager.get_flights_by_dates, dates)):
+            loop = _time_calls(getter, [(key,) for key in keys])
+            batch = _time_calls(batch_getter, [(keys,)])
+            print(f"  {pool_mode:<12} {len(keys):>6} {name:<9} per key {loop / len(keys) * 1e6:10.1f} us, "
+                  f"batch {batch / len(keys) * 1e6:10.1f} us ({loop / batch:5.1f}x)")
+        data_manager.close()
+
+
+def benchmark_snapshot(db_path, repeats):
+    """
+    Compares running the chart queries (recomputed from the flights table) on the
+    database file with running them on a 'memory' and an 'mmap' snapshot of it,
+    and prints the startup time and the time per query.
+    """
+    print(f"Chart queries on snapshots of {db_path}")
+    for snapshot in (None, 'memory', 'mmap'):
+        start = time.perf_counter()
+        data_manager = data.FlightData(f"sqlite:///{db_path}", cache_size=0, snapshot=snapshot)
+        data_manager.get_flight_by_id(1)
+        startup = time.perf_counter() - start
+
+        getters = (data_manager.get_delayed_and_departed_flights_by_airline,
+                   data_manager.get_origin_destination_airport_delay,
+                   data_manager.get_origin_destination_latitude_longitude,
+                   data_manager.get_delayed_flights_by_hour)
+        elapsed = _time_calls(lambda: [getter(force_raw=True) for getter in getters], [()] * repeats)
+        data_manager.close()
+        print(f"  {snapshot or 'file':<12} startup {startup:8.3f} s, "
+              f"{elapsed / (repeats * len(getters)) * 1e3:10.1f} ms/query")
+
+
+def benchmark_parallel(db_path, repeats):
+    """
+    Compares recomputing the chart queries from the flights table in one query with
+    counting them in 1, 2, 4... worker processes (up to the number of CPUs), checks the
+    results are the same and prints the time per query and the speedup.
+    """
+    max_workers = os.cpu_count()
+    print(f"Chart queries over the flights table of {db_path}, up to {max_workers} workers")
+    serial = None
+    for workers in [None] + [2 ** power for power in range(max_workers.bit_length())]:
+        data_manager = data.FlightData(f"sqlite:///{db_path}", cache_size=0, parallel_workers=workers)
+        getters = (data_manager.get_delayed_and_departed_flights_by_airline,
+                   data_manager.get_origin_destination_airport_delay,
+                   data_manager.get_origin_destination_latitude_longitude,
+                   data_manager.get_delayed_flights_by_hour)
+        # Warm up: starts the worker processes, and checks the results against the serial ones
+        results = [[dict(record) for record in getter(force_raw=True)] for getter in getters]
+        elapsed = _time_calls(lambda: [getter(force_raw=True) for getter in getters], [()] * repeats)
+        data_manager.close()
+
+        per_query = elapsed / (repeats * len(getters))
+        if serial is None:
+            serial = per_query, results
+        same = 'same results' if results == serial[1] else 'DIFFERENT RESULTS'
+        print(f"  {workers or 'serial':<12} {per_query * 1e3:10.1f} ms/query ({serial[0] / per_query:5.2f}x), {same}")
+
+
+def benchmark_sampling(db_path, repeats):
+    """
+    Compares the exact chart queries (recomputed from the flights table) with the sampled
+    ones at several sample fractions, and prints the time per query, the largest error of
+    the airline and hourly delay percentages, and how many of the exact percentages fall
+    inside their confidence intervals.
+    """
+    print(f"Sampled chart queries on {db_path}")
+    # Getters and the group column of their records
+    getters = {'get_delayed_and_departed_flights_by_airline': 'AIRLINE', 'get_delayed_flights_by_hour': 'HOUR_OF_DAY'}
+
+    exact = data.FlightData(f"sqlite:///{db_path}", cache_size=0)
+    exact_results = [getattr(exact, getter)(force_raw=True) for getter in getters]
+    elapsed = _time_calls(lambda: [getattr(exact, getter)(force_raw=True) for getter in getters], [()] * repeats)
+    exact.close()
+    print(f"  {'exact':<12} {elapsed / (repeats * len(getters)) * 1e3:10.1f} ms/query")
+
+    for fraction in (0.001, 0.01, sampling.SAMPLE_MAX_FRACTION):
+        data_manager = data.FlightData(f"sqlite:///{db_path}", cache_size=0, sample_fraction=fraction)
+        # Warm up: draws the sample the first time
+        data_manager.refresh_sample()
+        elapsed = _time_calls(lambda: [getattr(data_manager, getter)() for getter in getters], [()] * repeats)
+
+        errors, covered, groups = [], 0, 0
+        for (getter, group), exact_records in zip(getters.items(), exact_results):
+            estimates = {record[group]: record for record in getattr(data_manager, getter)()}
+            for record in exact_records:
+                estimate = estimates.get(record[group])
+                if estimate is None or not record['num_of_flights']:
+                    continue
+                percentage = record['num_of_delayed_flights'] / record['num_of_flights'] * 100
+                errors.append(abs(estimate['num_of_delayed_flights'] / estimate['num_of_flights'] * 100 - percentage)
+                              if estimate['num_of_flights'] else 100.0)
+                covered += estimate['percentage_delay_low'] <= percentage <= estimate['percentage_delay_high']
+                groups += 1
+        data_manager.close()
+        print(f"  {fraction:<12} {elapsed / (repeats * len(getters)) * 1e3:10.1f} ms/query, "
+              f"max error {max(errors, default=0):5.2f} points, {covered}/{groups} inside the intervals")
+
+
+def _result_size(result):
+    """
+    Returns the number of records (or of values per column) of a result, None if it has no size
+    """
+    if isinstance(result, dict):
+        return len(next(iter(result.values()), ()))
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return None
+
+
+def _consume(iterator):
+    """
+    Reads a streamed result to the end and returns the number of items
+    """
+    return sum(1 for _ in iterator)
+
+
+def _suite_cases(data_manager, num_rows, num_lookups):
+    """
+    Returns the cases of the benchmark suite as (group, name, function, args list) tuples,
+    one per FlightData getter variant, main.py analytics function and data_plots chart.
+    """
+    rng = random.Random(0)
+    rows = data_manager._execute_query("SELECT IATA_CODE FROM airports", None)
+    airports = [row['IATA_CODE'] for row in rows]
+    ids = [(rng.randint(1, num_rows),) for _ in range(num_lookups)]
+    dates = [(rng.randint(1, 28), rng.randint(1, 12), 2015) for _ in range(SCAN_LOOKUPS)]
+    busiest_airport = [(airports[0],)] * SCAN_LOOKUPS
+    random_airports = [(rng.choice(airports),) for _ in range(SCAN_LOOKUPS)]
+    airlines = [(rng.choice(AIRLINES),) for _ in range(SCAN_LOOKUPS)]
+    weeks = [(date(2015, month, day), date(2015, month, day) + timedelta(days=6)) for day, month, _ in dates]
+
+    cases = [
+        ('getter', 'get_flight_by_id', data_manager.get_flight_by_id, ids),
+        ('getter', 'get_delayed_flights_by_airport[busiest]',
+         data_manager.get_delayed_flights_by_airport, busiest_airport),
+        ('getter', 'get_delayed_flights_by_airport[random]',
+         data_manager.get_delayed_flights_by_airport, random_airports),
+        ('getter', 'get_delayed_flights_by_airline', data_manager.get_delayed_flights_by_airline, airlines),
+        ('getter', 'get_flights_by_date', data_manager.get_flights_by_date, dates),
+        ('getter', 'get_delayed_flights_by_airport_page[first]',
+         data_manager.get_delayed_flights_by_airport_page, busiest_airport),
+        ('getter', 'get_delayed_flights_by_airport_page[last]', data_manager.get_delayed_flights_by_airport_page,
+         [(airport, num_rows - PAGE_SIZE) for airport, in busiest_airport]),
+        ('getter', 'get_flights_by_date_page', data_manager.get_flights_by_date_page, dates),
+        ('getter', 'iter_delayed_flights_by_airport_pages',
+         lambda airport: _consume(data_manager.iter_delayed_flights_by_airport_pages(airport, PAGE_SIZE)),
+         random_airports),
+        ('getter', 'iter_flights_by_date_pages',
+         lambda *flight_date: _consume(data_manager.iter_flights_by_date_pages(*flight_date, page_size=PAGE_SIZE)),
+         dates),
+        ('getter', 'get_flights_by_date_range[week]', data_manager.get_flights_by_date_range, weeks),
+        ('getter', 'iter_flights_by_date_range[week]',
+         lambda start, end: _consume(data_manager.iter_flights_by_date_range(start, end, STREAM_BATCH)), weeks),
+        ('getter', 'get_flights_by_ids', data_manager.get_flights_by_ids, [([flight_id for flight_id, in ids],)]),
+        ('getter', 'get_delayed_flights_by_airports', data_manager.get_delayed_flights_by_airports,
+         [([code for code, in random_airports],)]),
+        ('getter', 'get_flights_by_dates', data_manager.get_flights_by_dates, [(dates,)]),
+        ('getter', 'get_delay_and_departure_time', data_manager.get_delay_and_departure_time, [()]),
+        ('getter', 'iter_flights_by_date',
+         lambda *flight_date: _consume(data_manager.iter_flights_by_date(*flight_date)), dates),
+        ('getter', 'iter_delay_and_departure_time',
+         lambda: _consume(data_manager.iter_delay_and_departure_time(batch_size=STREAM_BATCH)), [()]),
+    ]
+
+    # The chart getters: from the flights table, from the aggregate tables, and as columns
+    year = (date(2015, 1, 1), date(2015, 12, 31))
+    for getter, args in (('get_delayed_and_departed_flights_by_airline', ()), ('get_delayed_flights_by_hour', ()),
+                         ('get_origin_destination_airport_delay', ()),
+                         ('get_origin_destination_latitude_longitude', ()), ('get_delayed_flights_by_day', year)):
+        function = getattr(data_manager, getter)
+        cases += [
+            ('getter', f'{getter}[raw]', function, [args + (True, False)]),
+            ('getter', f'{getter}[aggregate]', function, [args + (False, False)]),
+            ('getter', f'{getter}[columnar]', function, [args + (False, True)]),
+        ]
+
+    cases.append(('getter', 'refresh_aggregates[rebuild]', data_manager.refresh_aggregates, [(True,)]))
+
+    for name in ANALYTICS_FUNCTIONS:
+        cases.append(('analytics', name, getattr(flights_app, name), [(data_manager,)]))
+    return cases
+
+
+def _chart_cases(data_manager):
+    """
+    Returns the benchmark suite cases rendering every data_plots chart off-screen to PNG bytes,
+    from the chart data of main.py's analytics functions.
+    """
+    renderer = data_plots.ChartRenderer()
+    charts = [(flights_app.VISUAL_METHODS[visual_type], chart_data)
+              for (_, visual_type), chart_data in zip(flights_app.DASHBOARD_CHARTS,
+                                                      flights_app.fetch_dashboard_data(data_manager))
+              if chart_data is not None]
+
+    cases = [('chart', plot_function.__name__, renderer.render, [(plot_function, chart_data)])
+             for plot_function, chart_data in charts]
+    cases.append(('chart', 'plot_dashboard',
+                  lambda: data_plots.plot_dashboard(charts, io.BytesIO(), format='png'), [()]))
+    return cases
+
+
+def _report_uncovered(cases):
+    """
+    Prints the getters, analytics functions and charts the suite doesn't time,
+    so new ones are noticed
+    """
+    covered = {name.split('[')[0] for _, name, _, _ in cases}
+    public = ([name for name in dir(data.FlightData)
+               if name.startswith(('get_', 'iter_')) and name != 'iter_query'] +
+              [name for name in dir(flights_app) if name.endswith('_chart_data')] +
+              [name for name in dir(data_plots) if name.startswith('plot_')])
+    uncovered = sorted(set(public) - covered)
+    if uncovered:
+        print(f"  not benchmarked: {', '.join(uncovered)}")
+
+
+def _calls_by_query(data_manager, function, args):
+    """
+    Runs a function once and returns the number of statements it ran, by query name
+    """
+    before = data_manager.query_stats()
+    function(*args)
+    after = data_manager.query_stats()
+    return {name: entry['calls'] - before.get(name, {}).get('calls', 0) for name, entry in after.items()
+            if entry['calls'] != before.get(name, {}).get('calls', 0)}
+
+
+def _check_query_names(data_manager, cases):
+    """
+    Runs every getter case twice and prints the ones whose second call is counted under other
+    query names than the first, e.g. a registered query counted as 'adhoc' once the registry
+    has declared its result columns (see query_registry). Has to run before the getters'
+    queries ran anywhere else in the process, so the first call is really their first run.
+    """
+    changed = []
+    for group, name, function, args_list in cases:
+        if group != 'getter' or name.startswith('refresh_'):
+            continue
+        first = _calls_by_query(data_manager, function, args_list[0])
+        second = _calls_by_query(data_manager, function, args_list[0])
+        if first != second:
+            changed.append(f"{name} ({first} then {second})")
+    if changed:
+        print(f"  query names changed on repeated calls: {'; '.join(changed)}")
+    else:
+        print("  query names kept on repeated calls")
+
+
+def benchmark_suite(db_path, num_rows, num_lookups, repeats, skip=()):
+    """
+    Times every FlightData getter, main.py analytics function and data_plots chart
+    on the database, repeats times each, and prints the best time per call.
+    The result cache is disabled so every call reaches the database.
+    Returns one result record (dictionary) per case.
+    """
+    data_manager = data.FlightData(f"sqlite:///{db_path}", cache_size=0)
+    # Builds the aggregate tables, so the first aggregate case doesn't pay for it
+    data_manager.refresh_aggregates()
+
+    cases = _suite_cases(data_manager, num_rows, num_lookups)
+    _check_query_names(data_manager, cases)
+    cases += _chart_cases(data_manager)
+    _report_uncovered(cases)
+
+    print(f"Benchmark suite over {num_rows} rows (best of {repeats})")
+    records = []
+    for group, name, function, args_list in cases:
+        if name in skip or name.split('[')[0] in skip:
+            continue
+
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for args in args_list:
+                result = function(*args)
+            timings.append(time.perf_counter() - start)
+
+        record = {
+            'rows': num_rows,
+            'group': group,
+            'name': name,
+            'calls': len(args_list),
+            'repeats': repeats,
+            'min_s': min(timings),
+            'median_s': statistics.median(timings),
+            'mean_s': statistics.mean(timings),
+            'per_call_s': min(timings) / len(args_list),
+            'result_size': _result_size(result),
+        }
+        records.append(record)
+        print(f"  {group:<10} {name:<58} {record['per_call_s'] * 1e3:12.3f} ms/call")
+
+    data_manager.close()
+    return records
+
+
+def parse_scale(value):
+    """
+    Parses a number of rows such as 100000, 500k, 1M or 10m
+    """
+    multipliers = {'k': 1000, 'm': 1000000}
+    suffix = value[-1:].lower()
+    if suffix in multipliers:
+        return int(float(value[:-1]) * multipliers[suffix])
+    return int(value)
+
+
+def environment_info():
+    """
+    Returns the versions and machine details recorded with the benchmark results
+    """
+    return {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'sqlalchemy': sqlalchemy.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': datetime.now(timezone.utc).isoformat(),
+    }
+
+
+BENCHMARKS = {
+    'pooling': lambda args, db_path, num_rows: benchmark_pooling(db_path, num_rows, args.lookups),
+    'async': lambda args, db_path, num_rows: benchmark_async(db_path, args.lookups, args.concurrency),
+    'batch': lambda args, db_path, num_rows: benchmark_batch_lookups(db_path, num_rows, args.lookups),
+    'snapshot': lambda args, db_path, num_rows: benchmark_snapshot(db_path, args.repeats),
+    'parallel': lambda args, db_path, num_rows: benchmark_parallel(db_path, args.repeats),
+    'sampling': lambda args, db_path, num_rows: benchmark_sampling(db_path, args.repeats),
+    'suite': lambda args, db_path, num_rows: benchmark_suite(db_path, num_rows, args.lookups,
+                                                             args.repeats, args.skip),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flight data benchmarks")
+    parser.add_argument('benchmark', choices=list(BENCHMARKS) + ['all'])
+    parser.add_argument('--rows', type=parse_scale, default=100000, help="number of synthetic flights")
+    parser.add_argument('--scales', type=lambda value: [parse_scale(scale) for scale in value.split(',')],
+                        help="comma-separated numbers of flights to run at, e.g. 1M,10M,50M (overrides --rows)")
+    parser.add_argument('--lookups', type=int, default=5000, help="number of point lookups")
+    parser.add_argument('--concurrency', type=int, default=8, help="concurrent queries (async benchmark)")
+    parser.add_argument('--repeats', type=int, default=3, help="times each suite case (or snapshot, parallel and sampled query) is run")
+    parser.add_argument('--skip', action='append', default=[], metavar='NAME',
+                        help="suite case to leave out, e.g. get_delay_and_departure_time (repeatable)")
+    parser.add_argument('--db', help="reuse (or create) the synthetic database at this path (single scale only)")
+    parser.add_argument('-o', '--output', help="write the suite results to this JSON file")
+    args = parser.parse_args()
+
+    scales = args.scales or [args.rows]
+    names = list(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]
+    results = []
+    for num_rows in scales:
+        db_path = args.db if args.db and len(scales) == 1 else \
+            os.path.join(tempfile.gettempdir(), f"flights_bench_{num_rows}.sqlite3")
+        if not os.path.exists(db_path):
+            print(f"Generating {num_rows} synthetic flights in {db_path}...")
+            generate_flights_db(db_path, num_rows)
+
+        for name in names:
+            results.extend(BENCHMARKS[name](args, db_path, num_rows) or [])
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'environment': environment_info(), 'results': results}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,130 @@
-from sqlalchemy import create_engine
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import aggregates
+import bulk_loader
+import index_advisor
+import instrumentation
+import parallel_aggregates
+import sampling
+import snapshots
+from query_cache import QueryCache, MISS, DEFAULT_MAX_BYTES, make_key
+from query_registry import QUERIES, STATEMENT_CACHE_SIZE
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
 from sql_queries import *
 
+# Connection handling modes supported by FlightData.
+# 'persistent' keeps one long-lived connection open for the lifetime of the object,
+# 'pool' keeps a sized pool of connections (pre-pinged and recycled),
+# 'null' opens a fresh connection for every query (the original behaviour).
+POOL_MODES = ('persistent', 'pool', 'null')
+
+# PRAGMAs applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'mmap_size': 268435456,  # 256 MB
+    'cache_size': -65536,  # negative value is in KiB -> 64 MB
+    'temp_store': 'MEMORY',
+}
+
+# Number of records fetched from the cursor at a time when streaming a result
+STREAM_BATCH_SIZE = 10000
+
+# Default number of records per page of the paginated getters
+PAGE_SIZE = 50
+
+# Flight ID ranges each worker process counts when a chart query runs in parallel.
+# More ranges than workers even out ranges that hold more flights than others
+PARALLEL_TASKS_PER_WORKER = 2
+
+# Most bound variables in one batch lookup query (SQLite's limit before version 3.32).
+# Keys beyond that are looked up in further queries
+BATCH_MAX_VARIABLES = 999
+
+# Column dtypes of the columnar (NumPy) results, per query.
+# Columns that are not listed are returned as object arrays
+AIRLINE_DELAY_DTYPES = {
+    'AIRLINE': object,
+    'num_of_delayed_flights': np.int64,
+    'num_of_flights': np.int64,
+}
+ROUTE_DELAY_DTYPES = {
+    'ORIGIN_AIRPORT': object,
+    'DESTINATION_AIRPORT': object,
+    'percentage_delay': np.int64,
+    'num_of_flights': np.int64,
+}
+ROUTE_LAT_LONG_DTYPES = {
+    'origin_airport': object,
+    'origin_latitude': np.float64,
+    'origin_longitude': np.float64,
+    'destination_airport': object,
+    'destination_latitude': np.float64,
+    'destination_longitude': np.float64,
+    'percentage_delay': np.int64,
+}
+HOURLY_DELAY_DTYPES = {
+    'HOUR_OF_DAY': np.int64,
+    'num_of_delayed_flights': np.int64,
+    'num_of_flights': np.int64,
+}
+DAILY_DELAY_DTYPES = {
+    'FLIGHT_DATE': np.int64,
+    'num_of_delayed_flights': np.int64,
+    'num_of_flights': np.int64,
+}
+# Columns the sampled chart queries add to every record (see sampling.estimate_records)
+ESTIMATE_DTYPES = {
+    'percentage_delay_low': np.float64,
+    'percentage_delay_high': np.float64,
+    'sampled_flights': np.int64,
+}
+QUERY_DTYPES = {
+    QUERY_BY_DELAYED_AND_DEPARTED_FLIGHTS: AIRLINE_DELAY_DTYPES,
+    QUERY_AGG_DELAYED_AND_DEPARTED_FLIGHTS: AIRLINE_DELAY_DTYPES,
+    QUERY_BY_ORIGIN_DESTINATION_DELAY: ROUTE_DELAY_DTYPES,
+    QUERY_AGG_ORIGIN_DESTINATION_DELAY: ROUTE_DELAY_DTYPES,
+    QUERY_AIRPORT_ORIGIN_DESTINATION_LAT_LONG: ROUTE_LAT_LONG_DTYPES,
+    QUERY_AGG_AIRPORT_ORIGIN_DESTINATION_LAT_LONG: ROUTE_LAT_LONG_DTYPES,
+    QUERY_DELAYED_FLIGHTS_BY_HOUR: HOURLY_DELAY_DTYPES,
+    QUERY_AGG_DELAYED_FLIGHTS_BY_HOUR: HOURLY_DELAY_DTYPES,
+    QUERY_DELAYED_FLIGHTS_BY_DAY: DAILY_DELAY_DTYPES,
+    QUERY_AGG_DELAYED_FLIGHTS_BY_DAY: DAILY_DELAY_DTYPES,
+}
+
+# Cache time to live (seconds) per query. The aggregate queries rarely change between calls
+CACHE_TTLS = {
+    QUERY_AGG_DELAYED_AND_DEPARTED_FLIGHTS: 600,
+    QUERY_AGG_ORIGIN_DESTINATION_DELAY: 600,
+    QUERY_AGG_AIRPORT_ORIGIN_DESTINATION_LAT_LONG: 600,
+    QUERY_BY_DELAYED_AND_DEPARTED_FLIGHTS: 600,
+    QUERY_BY_ORIGIN_DESTINATION_DELAY: 600,
+    QUERY_AIRPORT_ORIGIN_DESTINATION_LAT_LONG: 600,
+    QUERY_AGG_DELAYED_FLIGHTS_BY_HOUR: 600,
+    QUERY_DELAYED_FLIGHTS_BY_HOUR: 600,
+    QUERY_AGG_DELAYED_FLIGHTS_BY_DAY: 600,
+    QUERY_DELAYED_FLIGHTS_BY_DAY: 600,
+}
+
+
+def date_key(date):
+    """
+    Returns the integer date key (see sql_queries.FLIGHT_DATE_KEY) of a date, e.g. 20150301
+    """
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+def records_to_columns(records, dtypes):
+    """
+    Returns records as a dictionary of column name -> NumPy array, one per column of dtypes
+    """
+    return {column: np.array([record[column] for record in records], dtype=dtype)
+            for column, dtype in dtypes.items()}
+
 
 class FlightData:
     """
@@ -10,34 +134,472 @@ class FlightData:
     until the object is destroyed.
     """
 
-    def __init__(self, db_uri):
+    def __init__(self, db_uri, pool_mode='persistent', pool_size=5, pool_recycle=3600, pragmas=None,
+                 use_aggregates=True, cache_size=256, cache_ttl=60, cache_bytes=DEFAULT_MAX_BYTES, instrument=True,
+                 slow_query_threshold=instrumentation.SLOW_QUERY_THRESHOLD, page_size=PAGE_SIZE,
+                 snapshot=None, query_stats=None, parallel_workers=None, sample_fraction=None,
+                 sample_confidence=sampling.DEFAULT_CONFIDENCE, raise_errors=False):
+        """
+        Initialize a new engine using the given database URI.
+        pool_mode selects how connections are handled (see POOL_MODES).
+        pool_size and pool_recycle (seconds) only apply to the 'pool' mode.
+        pragmas overrides the SQLite PRAGMAs applied on connect (None uses SQLITE_PRAGMAS).
+        use_aggregates answers the chart queries from the materialized aggregate tables.
+        cache_size is the number of query results kept in the result cache (0 disables it),
+        cache_ttl their default time to live in seconds (see CACHE_TTLS for per-query values),
+        cache_bytes the most (estimated) bytes they hold: larger results aren't cached.
+        instrument times every statement run on the engine (see instrumentation.QueryStats),
+        logging the ones slower than slow_query_threshold seconds. query_stats reports to an
+        existing QueryStats instead (e.g. one shared by several databases).
+        page_size is the default number of records per page of the paginated getters.
+        snapshot runs the queries on a read-only snapshot of the database file (see snapshots):
+        'memory' copies it into memory at startup, 'mmap' maps the whole file. A 'memory'
+        snapshot is a single connection, so it always runs in 'persistent' mode.
+        parallel_workers counts the chart queries run over the flights table in that many
+        worker processes, each over a range of flight IDs of the database file (see
+        parallel_aggregates). None runs them in this process.
+        sample_fraction answers the chart queries approximately, from that fraction of the
+        flights drawn from a stored random sample (see sampling), with sample_confidence
+        intervals around every delay percentage. A smaller fraction answers faster but with
+        wider intervals. None (or force_raw) answers them exactly.
+        On a read-only database (an 'mmap' snapshot, or a URI with mode=ro or immutable=1)
+        the aggregate tables and the sample are never created or refreshed: the stored ones
+        are used if they cover every flight, otherwise the chart queries are answered exactly.
+        raise_errors raises the errors of the queries to the caller instead of printing them and
+        returning an empty result, e.g. for headless use where stdout carries the results.
+        """
+        if pool_mode not in POOL_MODES:
+            raise ValueError(f"Unknown pool mode '{pool_mode}', expected one of {POOL_MODES}")
+        if snapshot is not None and snapshot not in snapshots.SNAPSHOT_MODES:
+            raise ValueError(f"Unknown snapshot mode '{snapshot}', expected one of {snapshots.SNAPSHOT_MODES}")
+        if parallel_workers and snapshot == 'memory':
+            raise ValueError("The worker processes read the database file, they can't count a 'memory' snapshot")
+
+        self._pool_mode = pool_mode
+        self._pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+        self._use_aggregates = use_aggregates
+        self._raise_errors = raise_errors
+        self._page_size = page_size
+        self._connection = None
+        self._lock = threading.RLock()
+        self._cache = QueryCache(cache_size, cache_ttl, CACHE_TTLS, cache_bytes) if cache_size else None
+        self._sample_fraction = None
+        if sample_fraction is not None:
+            self._sample_key_limit, self._sample_fraction = sampling.sample_key_limit(sample_fraction)
+            self._sample_z = sampling.confidence_z(sample_confidence)
+        self._aggregator = None
+        if parallel_workers:
+            self._database_path = snapshots.database_path(db_uri)
+            self._aggregator = parallel_aggregates.ParallelAggregator(parallel_workers)
+
+        # Every connection keeps the registered queries prepared (see query_registry)
+        connect_args = {'cached_statements': STATEMENT_CACHE_SIZE}
+
+        self._read_only = snapshot == 'mmap' or snapshots.is_read_only_uri(db_uri)
+        self._snapshot = None
+        engine_args = {}
+        if snapshot == 'memory':
+            # The StaticPool hands out the one connection to the in-memory copy
+            memory_connection, self._snapshot = snapshots.load_memory_snapshot(
+                snapshots.database_path(db_uri), check_same_thread=False, **connect_args)
+            db_uri = 'sqlite://'
+            pool_mode = self._pool_mode = 'persistent'
+            engine_args['creator'] = lambda: memory_connection
+        elif snapshot == 'mmap':
+            path = snapshots.database_path(db_uri)
+            self._snapshot = snapshots.warm_up(path)
+            db_uri = snapshots.mmap_snapshot_uri(path)
+            # Map the whole file
+            self._pragmas = {**self._pragmas,
+                             'mmap_size': max(self._pragmas.get('mmap_size', 0), self._snapshot['bytes'])}
+
+        if pool_mode == 'persistent':
+            self._engine = create_engine(db_uri, poolclass=StaticPool,
+                                         connect_args={**connect_args, 'check_same_thread': False}, **engine_args)
+        elif pool_mode == 'pool':
+            self._engine = create_engine(db_uri, poolclass=QueuePool, pool_size=pool_size,
+                                         pool_pre_ping=True, pool_recycle=pool_recycle,
+                                         connect_args={**connect_args, 'check_same_thread': False})
+        else:
+            self._engine = create_engine(db_uri, poolclass=NullPool, connect_args=connect_args)
+
+        if self._engine.dialect.name == 'sqlite':
+            event.listen(self._engine, 'connect', self._apply_pragmas)
+
+        if query_stats is not None:
+            self._stats = query_stats
+        else:
+            self._stats = instrumentation.QueryStats(slow_query_threshold) if instrument else None
+        if self._stats is not None:
+            self._stats.attach(self._engine)
+
+    def _apply_pragmas(self, dbapi_connection, connection_record):
         """
-        Initialize a new engine using the given database URI
+        Engine 'connect' event handler. Applies the configured PRAGMAs
+        to every new SQLite DBAPI connection.
         """
-        self._engine = create_engine(db_uri)
+        cursor = dbapi_connection.cursor()
+        for name, value in self._pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
 
-    def _execute_query(self, query, params):
+    def _get_connection(self):
+        """
+        Returns the long-lived connection used in 'persistent' mode,
+        opening it on first use.
+        """
+        if self._connection is None or self._connection.closed:
+            self._connection = self._engine.connect()
+        return self._connection
+
+    @contextmanager
+    def _connect(self):
+        """
+        Context manager that provides a connection to run queries on.
+        In 'persistent' mode this is the shared long-lived connection,
+        held under the lock since it can't be used by two threads at once.
+        """
+        if self._pool_mode == 'persistent':
+            with self._lock:
+                yield self._get_connection()
+        else:
+            with self._engine.connect() as connection:
+                yield connection
+
+    def _execute_query(self, query, params, use_cache=True, columnar=False):
         """
         Execute an SQL query with the params provided in a dictionary,
         and returns a list of records (dictionary-like objects).
+        The query runs in its compiled form from the query registry (see query_registry).
+        With columnar=True, returns a dictionary of column name -> NumPy array instead
+        (typed as declared in QUERY_DTYPES).
+        If an exception was raised, print the error, and return an empty list
+        (or raise it with raise_errors).
+        Results go through the result cache (unless use_cache is False),
+        and are then returned in immutable form (see query_cache.freeze_result).
+        """
+        if use_cache and self._cache is not None:
+            key = make_key(query, params, 'columnar' if columnar else None)
+            result = self._cache.get(key)
+            if result is MISS:
+                result = self._cache_result(key, self._execute_query(query, params, False, columnar))
+            return result
+
+        try:
+            with self._connect() as connection:
+                result = QUERIES.execute(connection, query, params)
+                start = time.perf_counter()
+                if columnar:
+                    rows = self._fetch_columns(result, QUERY_DTYPES.get(query, {}))
+                else:
+                    rows = result.mappings().fetchall()
+                if self._stats is not None:
+                    self._record_fetch(query, rows, time.perf_counter() - start)
+                return rows
+        except Exception as e:
+            if self._raise_errors:
+                raise
+            print("Error:", e)
+            return {}
+
+    def _record_fetch(self, query, rows, seconds):
+        """
+        Reports the rows, estimated bytes and fetch time of a query result to the query statistics
+        """
+        if isinstance(rows, dict):
+            num_rows = len(next(iter(rows.values()), ()))
+            num_bytes = instrumentation.estimate_column_bytes(rows)
+        else:
+            num_rows = len(rows)
+            num_bytes = instrumentation.estimate_bytes(rows)
+        self._stats.record_fetch(query, num_rows, num_bytes, seconds)
+
+    def _cache_result(self, key, result):
+        """
+        Stores a query result in the result cache and returns its immutable version.
+        Errors ({}) are not cached.
+        """
+        if self._cache is None or (isinstance(result, dict) and not result):
+            return result
+        return self._cache.set(key, result)
+
+    @staticmethod
+    def _fetch_columns(result, dtypes):
+        """
+        Reads a query result straight from the DBAPI cursor into one NumPy array per column,
+        using the given dtypes (object for the columns not listed). No record object is
+        created per row: the cursor's tuples are transposed and converted chunk by chunk.
+        """
+        columns = list(result.keys())
+        column_dtypes = [dtypes.get(name, object) for name in columns]
+
+        chunks = []
+        while True:
+            rows = result.cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            chunks.append([np.array(values, dtype=dtype) for values, dtype in zip(zip(*rows), column_dtypes)])
+        result.close()
+
+        if not chunks:
+            arrays = [np.array([], dtype=dtype) for dtype in column_dtypes]
+        elif len(chunks) == 1:
+            arrays = chunks[0]
+        else:
+            arrays = [np.concatenate(parts) for parts in zip(*chunks)]
+        return dict(zip(columns, arrays))
+
+    def iter_query(self, query, params=None, batch_size=None):
+        """
+        Execute an SQL query with the params provided in a dictionary, and yields
+        the records one by one as they are read from the cursor (or lists of up to
+        batch_size records if batch_size is given), so the whole result is never
+        held in memory. Streamed results don't go through the result cache.
+        If an exception was raised, print the error, and stop (or raise it with raise_errors).
+        In 'persistent' mode the shared connection is held until the iteration ends.
+        """
+        try:
+            with self._connect() as connection:
+                # Statement options rather than connection options, which SQLAlchemy 2.x
+                # would keep on the shared connection
+                result = QUERIES.execute(connection, query, params, stream_results=True,
+                                         max_row_buffer=STREAM_BATCH_SIZE).mappings()
+                start = time.perf_counter()
+                num_rows = 0
+                try:
+                    if batch_size:
+                        for batch in result.partitions(batch_size):
+                            num_rows += len(batch)
+                            yield batch
+                    else:
+                        for row in result:
+                            num_rows += 1
+                            yield row
+                finally:
+                    # Only the row count is known; the bytes of a stream are not estimated
+                    if self._stats is not None:
+                        self._stats.record_fetch(query, num_rows, 0, time.perf_counter() - start)
+        except Exception as e:
+            if self._raise_errors:
+                raise
+            print("Error:", e)
+
+    def ensure_indexes(self, measure=True):
+        """
+        Runs the index advisor: explains every registered query, creates the missing
+        indexes and returns the report (see index_advisor.ensure_indexes).
+        """
+        with self._lock, self._engine.begin() as connection:
+            return index_advisor.ensure_indexes(connection, measure)
+
+    def refresh_aggregates(self, rebuild=False):
+        """
+        Brings the aggregate tables up to date with the flights table.
+        With rebuild=True the tables are recomputed from scratch.
+        Returns the number of flight IDs aggregated, or None if the refresh failed.
+        A read-only database is only checked: 0 if its stored tables count every flight, else None.
+        """
+        if self._read_only:
+            with self._connect() as connection:
+                if not rebuild and aggregates.aggregates_up_to_date(connection):
+                    return 0
+            print("Error: the aggregate tables are missing or out of date and the database is read-only")
+            return None
+        try:
+            with self._lock, self._engine.begin() as connection:
+                if rebuild:
+                    return aggregates.rebuild_aggregates(connection)
+                return aggregates.refresh_aggregates(connection)
+        except Exception as e:
+            print("Error:", e)
+            return None
+
+    def refresh_sample(self, rebuild=False):
+        """
+        Samples the flights added since the last refresh into the sample table.
+        With rebuild=True a new sample is drawn from scratch.
+        Returns the number of flight IDs covered, or None if the refresh failed.
+        A read-only database is only checked: 0 if its stored sample covers every flight, else None.
+        """
+        if self._read_only:
+            with self._connect() as connection:
+                if not rebuild and sampling.sample_up_to_date(connection):
+                    return 0
+            print("Error: the sample is missing or out of date and the database is read-only")
+            return None
+        try:
+            with self._lock, self._engine.begin() as connection:
+                if rebuild:
+                    return sampling.rebuild_sample(connection)
+                return sampling.refresh_sample(connection)
+        except Exception as e:
+            print("Error:", e)
+            return None
+
+    def load_flights(self, path, file_format=None, chunk_size=bulk_loader.CHUNK_SIZE, defer_indexes=None,
+                     reject_path=None, progress=None):
+        """
+        Bulk loads the flights of a CSV or Parquet file (see bulk_loader.load_flights)
+        and drops the cached results, so the next queries see the new flights.
+        The aggregate tables catch up on their next (incremental) refresh.
+        Returns the load report, or None if the load failed.
+        A snapshot is read-only, so nothing is loaded into it.
+        """
+        if self._snapshot is not None:
+            print("Error: can't load flights into a read-only snapshot")
+            return None
+
+        try:
+            with self._connect() as connection:
+                return bulk_loader.load_flights(connection, path, file_format, chunk_size, defer_indexes,
+                                                reject_path, progress)
+        except Exception as e:
+            print("Error:", e)
+            return None
+        finally:
+            self.invalidate_cache()
+
+    def snapshot_info(self):
+        """
+        Returns the snapshot report (mode, seconds to load and bytes held or mapped),
+        or None if the queries run on the database itself
+        """
+        return self._snapshot
+
+    def invalidate_cache(self, query=None):
+        """
+        Drops the cached results of a query, or every cached result if query is None
+        """
+        if self._cache is not None:
+            self._cache.invalidate(query)
+
+    def cache_stats(self):
+        """
+        Returns the result cache counters (hits, misses, evictions, entries, bytes, ...), or None if disabled
+        """
+        return self._cache.stats() if self._cache is not None else None
+
+    def query_stats(self):
+        """
+        Returns the per-query timing statistics (see instrumentation.QueryStats.snapshot),
+        or None if instrumentation is disabled
+        """
+        return self._stats.snapshot() if self._stats is not None else None
+
+    def slow_queries(self):
+        """
+        Returns the slow-query log (statement, params, time and query plan of each slow query)
+        """
+        return self._stats.slow_queries() if self._stats is not None else []
+
+    def dump_query_stats(self, format='json'):
+        """
+        Returns the query statistics as a JSON document or, with format='prometheus',
+        in the Prometheus text format. Returns None if instrumentation is disabled.
+        """
+        if self._stats is None:
+            return None
+        if format == 'prometheus':
+            return self._stats.to_prometheus()
+        return self._stats.to_json()
+
+    def _execute_aggregate_query(self, aggregate_query, raw_query, force_raw, columnar=False, params=None):
+        """
+        Runs a chart query from the aggregate tables, refreshing them first with any new flights.
+        Runs the raw query over the flights table instead if force_raw is set, aggregates are
+        disabled, or the aggregate tables can't be refreshed (e.g. a read-only database without them).
+        A forced raw recompute bypasses the result cache.
+        In the sampled mode (see sample_fraction) the result is estimated from the sample instead.
+        """
+        if force_raw:
+            return self._execute_raw_query(raw_query, params, use_cache=False, columnar=columnar)
+
+        if self._sample_fraction is not None:
+            result = self._execute_sampled_query(raw_query, params, columnar)
+            if result is not None:
+                return result
+
+        if self._use_aggregates:
+            # A cached result is served without checking the aggregate tables for new flights
+            key = make_key(aggregate_query, params, 'columnar' if columnar else None)
+            if self._cache is not None:
+                result = self._cache.get(key)
+                if result is not MISS:
+                    return result
+
+            if self.refresh_aggregates() is not None:
+                result = self._execute_query(aggregate_query, params, use_cache=False, columnar=columnar)
+                return self._cache_result(key, result)
+            # Don't retry (and print the error) on every call
+            self._use_aggregates = False
+        return self._execute_raw_query(raw_query, params, columnar=columnar)
+
+    def _execute_sampled_query(self, query, params, columnar):
+        """
+        Estimates a chart query from the sample (see sampling.estimate_records).
+        Returns None if the sample can't be refreshed (e.g. a read-only database without one),
+        after which the chart queries are answered exactly.
+        """
+        key = make_key(query, params, ('sampled', self._sample_fraction, self._sample_z, columnar))
+        if self._cache is not None:
+            result = self._cache.get(key)
+            if result is not MISS:
+                return result
+
+        name = parallel_aggregates.PARALLEL_QUERIES[query][0]
+        rows = self.get_sample_counts(name, params)
+        if rows is None:
+            return None
+        records = sampling.estimate_records(query, parallel_aggregates.merge_counts([rows]),
+                                            self._sample_fraction, self._sample_z)
+        result = records_to_columns(records, {**QUERY_DTYPES[query], **ESTIMATE_DTYPES}) if columnar else records
+        return self._cache_result(key, result)
+
+    def _execute_raw_query(self, query, params, use_cache=True, columnar=False):
+        """
+        Runs a chart query over the flights table: in the worker processes if parallel_workers
+        is set, otherwise as one query (see _execute_query).
+        """
+        if self._aggregator is None:
+            return self._execute_query(query, params, use_cache, columnar)
+
+        key = make_key(query, params, 'columnar' if columnar else None)
+        if use_cache and self._cache is not None:
+            result = self._cache.get(key)
+            if result is not MISS:
+                return result
+
+        result = self._execute_parallel_query(query, params)
+        if columnar and not isinstance(result, dict):
+            result = records_to_columns(result, QUERY_DTYPES[query])
+        return self._cache_result(key, result) if use_cache else result
+
+    def _execute_parallel_query(self, query, params):
+        """
+        Splits the flight IDs into ranges (PARALLEL_TASKS_PER_WORKER per worker) and counts a
+        chart query over each range in the worker processes (see parallel_aggregates).
+        The summed counts give the same records as the serial query.
         If an exception was raised, print the error, and return an empty list.
         """
-        if params is not None:
-            try:
-                with self._engine.connect() as connection:
-                    result = connection.execute(query, params)
-                    return result.fetchall()
-            except Exception as e:
-                print("Error:", e)
-                return {}
+        ranges = self.get_flight_ranges()
+        if ranges is None:
+            return {}
+        tasks = []
+        if ranges['first_id'] is not None:
+            id_ranges = parallel_aggregates.split_id_range(ranges['first_id'], ranges['last_id'],
+                                                           self._aggregator.workers * PARALLEL_TASKS_PER_WORKER)
+            tasks = [(self._database_path, after_id, last_id) for after_id, last_id in id_ranges]
 
+        name = parallel_aggregates.PARALLEL_QUERIES[query][0]
         try:
-            with self._engine.connect() as connection:
-                result = connection.execute(query)
-                return result.fetchall()
+            start = time.perf_counter()
+            counts = self._aggregator.count(name, tasks, params)
+            if self._stats is not None:
+                self._stats.record_execute(f'parallel_{name}', time.perf_counter() - start)
         except Exception as e:
             print("Error:", e)
             return {}
+        return parallel_aggregates.build_records(query, counts)
 
     def get_flight_by_id(self, flight_id):
         """
@@ -75,12 +637,187 @@ class FlightData:
         }
         return self._execute_query(QUERY_FLIGHT_BY_DATE, params)
 
-    def get_delayed_and_departed_flights_by_airline(self):
+    def _execute_batch_query(self, template, keys, row_key):
+        """
+        Looks up many keys with a batch query template (see sql_queries.BATCH_QUERIES),
+        one query per chunk of keys instead of one per key.
+        :param template: query with a {keys} placeholder
+        :param keys: list of keys, each a single value or a tuple of values
+        :param row_key: function returning the key of a result record
+        :return: dictionary of key -> list of records, with every key (in the given order,
+                 duplicates removed) and an empty list for the keys nothing matched.
+                 An empty dictionary if a query failed.
+        """
+        grouped = {key: [] for key in keys}
+        keys = list(grouped)
+        if not keys:
+            return grouped
+
+        width = len(keys[0]) if isinstance(keys[0], tuple) else 1
+        chunk_size = BATCH_MAX_VARIABLES // width
+        for start in range(0, len(keys), chunk_size):
+            params = {}
+            placeholders = []
+            for i, key in enumerate(keys[start:start + chunk_size]):
+                values = key if isinstance(key, tuple) else (key,)
+                names = [f"k{i}_{j}" for j in range(width)]
+                params.update(zip(names, values))
+                placeholder = ', '.join(':' + name for name in names)
+                placeholders.append(f"({placeholder})" if isinstance(key, tuple) else placeholder)
+
+            # Every chunk is a different query, so they don't go through the result cache
+            results = self._execute_query(template.format(keys=', '.join(placeholders)), params,
+                                          use_cache=False)
+            if isinstance(results, dict):
+                return {}
+            for result in results:
+                grouped[row_key(result)].append(result)
+        return grouped
+
+    def get_flights_by_ids(self, flight_ids):
+        """
+        Searches for the flight details of many flight IDs at once.
+        Returns a dictionary of flight ID -> list with the flight's record (empty if not found).
+        """
+        return self._execute_batch_query(QUERY_FLIGHTS_BY_IDS, flight_ids, lambda result: result['FLIGHT_ID'])
+
+    def get_delayed_flights_by_airports(self, airport_short_codes):
+        """
+        Searches for the flight details of many airport IATA (3-letter) codes at once.
+        Returns a dictionary of IATA code -> list of records.
+        """
+        return self._execute_batch_query(QUERY_FLIGHTS_BY_AIRPORTS, airport_short_codes,
+                                         lambda result: result['ORIGIN_AIRPORT'])
+
+    def get_flights_by_dates(self, dates):
+        """
+        Searches for the flight details of many dates at once.
+        :param dates: list of (day, month, year) tuples
+        Returns a dictionary of (day, month, year) -> list of records.
+        """
+        return self._execute_batch_query(QUERY_FLIGHTS_BY_DATES, [tuple(date) for date in dates],
+                                         lambda result: (result['DAY'], result['MONTH'], result['YEAR']))
+
+    def _execute_page_query(self, query, params, after_id, page_size):
+        """
+        Runs a keyset-paginated query: returns the next page_size records (the default
+        page size if None) with a flight ID above after_id, in ID order.
+        """
+        params = {**params, 'after_id': after_id, 'page_size': page_size or self._page_size}
+        return self._execute_query(query, params)
+
+    def _iter_pages(self, query, params, page_size):
+        """
+        Yields the pages of a keyset-paginated query one at a time. Each page is only
+        queried when the previous one has been consumed, starting after its last flight ID.
+        """
+        page_size = page_size or self._page_size
+        after_id = 0
+        while True:
+            page = self._execute_page_query(query, params, after_id, page_size)
+            # An error ({}) or no more flights
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            after_id = page[-1]['FLIGHT_ID']
+
+    def get_delayed_flights_by_airport_page(self, airport_short_code, after_id=0, page_size=None):
+        """
+        Searches for one page of flight details using airport IATA (3-letter) code:
+        the first page_size flights with an ID above after_id, in ID order.
+        Pass the FLIGHT_ID of the last record as after_id to get the next page.
+        """
+        return self._execute_page_query(QUERY_FLIGHT_BY_AIRPORT_PAGE, {'IATA': airport_short_code},
+                                        after_id, page_size)
+
+    def get_flights_by_date_page(self, day, month, year, after_id=0, page_size=None):
+        """
+        Searches for one page of flight details using date (day, month and year):
+        the first page_size flights with an ID above after_id, in ID order.
+        Pass the FLIGHT_ID of the last record as after_id to get the next page.
+        """
+        params = {
+            'day': day,
+            'month': month,
+            'year': year
+        }
+        return self._execute_page_query(QUERY_FLIGHT_BY_DATE_PAGE, params, after_id, page_size)
+
+    def iter_delayed_flights_by_airport_pages(self, airport_short_code, page_size=None):
+        """
+        Yields the flight details for an airport IATA (3-letter) code page by page,
+        each page fetched only when it's requested.
+        """
+        return self._iter_pages(QUERY_FLIGHT_BY_AIRPORT_PAGE, {'IATA': airport_short_code}, page_size)
+
+    def iter_flights_by_date_pages(self, day, month, year, page_size=None):
+        """
+        Yields the flight details for a date (day, month and year) page by page,
+        each page fetched only when it's requested.
+        """
+        params = {
+            'day': day,
+            'month': month,
+            'year': year
+        }
+        return self._iter_pages(QUERY_FLIGHT_BY_DATE_PAGE, params, page_size)
+
+    def get_flight_ranges(self):
+        """
+        Returns the lowest and highest flight ID and date key, as a record with first_id, last_id,
+        first_date and last_date (all None if there are no flights), or None if the query failed.
+        """
+        result = self._execute_query(QUERY_FLIGHT_RANGES, None, use_cache=False)
+        return result[0] if result else None
+
+    def get_delay_counts(self, name, params=None):
+        """
+        Returns the delayed and total flight counts per group of a chart query from the aggregate
+        tables (see sql_queries.AGGREGATE_COUNT_QUERIES), refreshing them first, as a list of
+        (group..., delayed, total) tuples. Counts of several databases add up (see parallel_aggregates).
+        Returns None if aggregates are disabled or the aggregate tables can't be refreshed.
+        """
+        if not self._use_aggregates:
+            return None
+        if self.refresh_aggregates() is None:
+            # Don't retry (and print the error) on every call
+            self._use_aggregates = False
+            return None
+        result = self._execute_query(AGGREGATE_COUNT_QUERIES[name], params, use_cache=False)
+        if isinstance(result, dict):
+            return None
+        return [tuple(row.values()) for row in result]
+
+    def get_sample_counts(self, name, params=None):
+        """
+        Returns the delayed and total sampled flight counts per group of a chart query
+        (see sql_queries.SAMPLE_COUNT_QUERIES), refreshing the sample first, as a list of
+        (group..., delayed, total) tuples. Counts of samples of several databases add up.
+        Returns None if the sampled mode is off or the sample can't be refreshed.
+        """
+        if self._sample_fraction is None:
+            return None
+        if self.refresh_sample() is None:
+            # Don't retry (and print the error) on every call
+            self._sample_fraction = None
+            return None
+        params = {**(params or {}), 'key_limit': self._sample_key_limit}
+        result = self._execute_query(SAMPLE_COUNT_QUERIES[name], params, use_cache=False)
+        if isinstance(result, dict):
+            return None
+        return [tuple(row.values()) for row in result]
+
+    def get_delayed_and_departed_flights_by_airline(self, force_raw=False, columnar=False):
         """
         Searches for delayed and departed flight details.
         If the flight was found, returns a list with a single record.
+        force_raw recomputes the result from the flights table instead of the aggregate tables.
+        columnar returns a dictionary of NumPy arrays (one per column) instead of records.
         """
-        return self._execute_query(QUERY_BY_DELAYED_AND_DEPARTED_FLIGHTS, params=None)
+        return self._execute_aggregate_query(QUERY_AGG_DELAYED_AND_DEPARTED_FLIGHTS,
+                                             QUERY_BY_DELAYED_AND_DEPARTED_FLIGHTS, force_raw, columnar)
 
     def get_delay_and_departure_time(self):
         """
@@ -89,22 +826,96 @@ class FlightData:
         """
         return self._execute_query(QUERY_FLIGHT_BY_DELAY_AND_DEPARTURE_TIME, params=None)
 
-    def get_origin_destination_airport_delay(self):
+    def get_delayed_flights_by_hour(self, force_raw=False, columnar=False):
+        """
+        Counts the delayed flights and all flights for each hour of the day (from the
+        departure time), so the result has one record per hour whatever the table size.
+        force_raw recomputes the result from the flights table instead of the aggregate tables.
+        columnar returns a dictionary of NumPy arrays (one per column) instead of records.
+        """
+        return self._execute_aggregate_query(QUERY_AGG_DELAYED_FLIGHTS_BY_HOUR,
+                                             QUERY_DELAYED_FLIGHTS_BY_HOUR, force_raw, columnar)
+
+    def get_flights_by_date_range(self, start, end):
+        """
+        Searches for flight details from the start date to the end date (datetime.date,
+        both included), with one index range scan over the flights' date keys.
+        """
+        params = {'start': date_key(start), 'end': date_key(end)}
+        return self._execute_query(QUERY_FLIGHTS_BY_DATE_RANGE, params)
+
+    def iter_flights_by_date_range(self, start, end, batch_size=None):
+        """
+        Streams the flight details from the start date to the end date (both included).
+        Yields records one by one, or lists of up to batch_size records.
+        """
+        params = {'start': date_key(start), 'end': date_key(end)}
+        return self.iter_query(QUERY_FLIGHTS_BY_DATE_RANGE, params, batch_size)
+
+    def get_delayed_flights_by_day(self, start, end, force_raw=False, columnar=False):
+        """
+        Counts the delayed flights and all flights of each day from the start date to the
+        end date (both included). Days are returned as date keys (e.g. 20150301), in order.
+        force_raw recomputes the result from the flights table instead of the aggregate tables.
+        columnar returns a dictionary of NumPy arrays (one per column) instead of records.
+        """
+        params = {'start': date_key(start), 'end': date_key(end)}
+        return self._execute_aggregate_query(QUERY_AGG_DELAYED_FLIGHTS_BY_DAY, QUERY_DELAYED_FLIGHTS_BY_DAY,
+                                             force_raw, columnar, params)
+
+    def iter_flights_by_date(self, day, month, year, batch_size=None):
+        """
+        Streams the flight details for a date (day, month and year).
+        Yields records one by one, or lists of up to batch_size records.
+        """
+        params = {
+            'day': day,
+            'month': month,
+            'year': year
+        }
+        return self.iter_query(QUERY_FLIGHT_BY_DATE, params, batch_size)
+
+    def iter_delay_and_departure_time(self, batch_size=None):
+        """
+        Streams the flight delay and departure time of every flight.
+        Yields records one by one, or lists of up to batch_size records.
+        """
+        return self.iter_query(QUERY_FLIGHT_BY_DELAY_AND_DEPARTURE_TIME, batch_size=batch_size)
+
+    def get_origin_destination_airport_delay(self, force_raw=False, columnar=False):
         """
         Searches for flight origin and destination airports including flight delays.
         If the flight was found, returns a list with a single record.
+        force_raw recomputes the result from the flights table instead of the aggregate tables.
+        columnar returns a dictionary of NumPy arrays (one per column) instead of records.
         """
-        return self._execute_query(QUERY_BY_ORIGIN_DESTINATION_DELAY, params=None)
+        return self._execute_aggregate_query(QUERY_AGG_ORIGIN_DESTINATION_DELAY,
+                                             QUERY_BY_ORIGIN_DESTINATION_DELAY, force_raw, columnar)
 
-    def get_origin_destination_latitude_longitude(self):
+    def get_origin_destination_latitude_longitude(self, force_raw=False, columnar=False):
         """
         Searches for flight origin and destination airports including their coordinates
         If the flight was found, returns a list with a single record.
+        force_raw recomputes the result from the flights table instead of the aggregate tables.
+        columnar returns a dictionary of NumPy arrays (one per column) instead of records.
+        """
+        return self._execute_aggregate_query(QUERY_AGG_AIRPORT_ORIGIN_DESTINATION_LAT_LONG,
+                                             QUERY_AIRPORT_ORIGIN_DESTINATION_LAT_LONG, force_raw, columnar)
+
+    def close(self):
         """
-        return self._execute_query(QUERY_AIRPORT_ORIGIN_DESTINATION_LAT_LONG, params=None)
+        Closes the long-lived connection (if any) and disposes of the engine's pool
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self._engine.dispose()
+        if self._aggregator is not None:
+            self._aggregator.close()
 
     def __del__(self):
         """
         Closes the connection to the databse when the object is about to be destroyed
         """
-        self._engine.dispose()
+        if hasattr(self, '_engine'):
+            self.close()
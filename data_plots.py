@@ -1,169 +1,229 @@
+import io
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
+from matplotlib import colormaps
 from matplotlib import pyplot as plt
 from matplotlib.cm import ScalarMappable
+from matplotlib.collections import LineCollection
 from matplotlib.colors import Normalize
+from matplotlib.figure import Figure
+
+from map_assets import load_map_tile
+from route_matrix import RouteMatrix
+
+# Figure size (inches) of each chart when it's drawn on its own figure
+FIGURE_SIZES = {
+    'plot_bar_chart': (10, 6),
+    'plot_bar_chart_with_colorbar': (10, 6),
+    'plot_heat_map': (10, 7),
+    'plot_route_map': (8, 4),
+}
+
+# Number of busiest airports drawn on the heat map by default (None draws every airport),
+# and the most airport labels shown on each axis
+HEAT_MAP_TOP_AIRPORTS = None
+HEAT_MAP_MAX_LABELS = 60
 
+# Number of randomly sampled routes drawn on the route map by default (None draws all of them)
+ROUTE_MAP_SAMPLE_SIZE = 50
 
-def plot_bar_chart(args):
+# Colormaps, looked up once and shared by every chart
+VIRIDIS = colormaps['viridis']
+PLASMA = colormaps['plasma']
+
+
+def _new_axes(ax, figsize, output=None):
+    """
+    Returns the axes to draw on: the given one, or the axes of a new figure
+    of the given size if ax is None. When the chart goes to an output instead of
+    the screen, the figure is created off-screen (not managed by pyplot), so it
+    needs no display and is freed as soon as it's saved.
+    """
+    if ax is not None:
+        return ax
+    if output is not None:
+        return Figure(figsize=figsize).subplots()
+    fig, ax = plt.subplots(figsize=figsize)
+    return ax
+
+
+def _show(ax, own_figure, output=None, format=None, tight_layout=True):
+    """
+    Shows the figure to the user, or saves it to the output (a file path or a binary
+    file-like object such as io.BytesIO) in the given format ('png', 'svg', ...;
+    None follows the file extension). Does nothing if the chart was drawn on axes
+    owned by the caller.
+    """
+    if not own_figure:
+        return
+    if tight_layout:
+        # Ensures that no label is cut off and displays everything nicely
+        ax.figure.tight_layout()
+    if output is None:
+        plt.show()
+    else:
+        ax.figure.savefig(output, format=format)
+
+
+def plot_bar_chart(args, ax=None, output=None, format=None):
     """
     plots a bar chart showing percentage of delay per airline and shows it to the user
     :param args: airline, percentage of delayed flights per airline
+    :param ax: axes to draw on. If None, the chart is drawn on a new figure and shown
+    :param output: file path or binary file-like object to save the new figure to, instead of showing it
+    :param format: image format of the output ('png', 'svg', ...), None follows the file extension
     :return: None
     """
     # Unpack args
     airline, percentage_of_delayed_flights = args
 
     # Sets the plot size window
-    plt.figure(figsize=(10, 6))
+    own_figure = ax is None
+    ax = _new_axes(ax, FIGURE_SIZES['plot_bar_chart'], output)
 
     # create bar chart
-    plt.bar(airline, percentage_of_delayed_flights, color='#2596be')
+    ax.bar(airline, percentage_of_delayed_flights, color='#2596be')
 
     # Set y-axis ticks interval to range from 0 to max-num + 5.
     # Set regular intervals of 5. Bold font and font size of 9
-    plt.yticks(range(0, int(max(percentage_of_delayed_flights)) + 5, 5), fontsize=9, weight='bold')
+    ax.set_yticks(range(0, int(max(percentage_of_delayed_flights)) + 5, 5))
+    ax.tick_params(axis='y', labelsize=9)
+    for label in ax.get_yticklabels():
+        label.set_weight('bold')
 
     # Get the range of all the x-label,
     # align labels to the right of the bar chart
     # Rotate the x-axis labels at a 30-degree angle
-    plt.xticks(range(len(airline)), airline, rotation=30, ha='right', fontsize=9, weight='bold')
+    ax.set_xticks(range(len(airline)))
+    ax.set_xticklabels(airline, rotation=30, ha='right', fontsize=9, weight='bold')
 
     # Add labels and title
-    plt.xlabel('Airline', fontsize=14, weight='bold')
-    plt.ylabel('Percentage of Delayed Flights', weight='bold')
-    plt.title('Percentage of Delayed Flights by Airline', weight='bold')
-
-    # Ensures that no label is cut off and displays everything nicely
-    plt.tight_layout()
+    ax.set_xlabel('Airline', fontsize=14, weight='bold')
+    ax.set_ylabel('Percentage of Delayed Flights', weight='bold')
+    ax.set_title('Percentage of Delayed Flights by Airline', weight='bold')
 
     # Show the plot
-    plt.show()
+    _show(ax, own_figure, output, format)
 
 
-def plot_bar_chart_with_colorbar(args):
+def plot_bar_chart_with_colorbar(args, ax=None, output=None, format=None):
     """
      plots a bar chart with color bar on the side of percentage delay for every hour of the day.
      shows the plot to the user
-    :param args: departure delay (in minutes), departure time (in hours)
+    :param args: hours of the day, number of delayed flights and total number of flights in each hour
+    :param ax: axes to draw on. If None, the chart is drawn on a new figure and shown
+    :param output: file path or binary file-like object to save the new figure to, instead of showing it
+    :param format: image format of the output ('png', 'svg', ...), None follows the file extension
     :return: None
     """
-    # Flight data_db: (departure_delay in minutes; departure_time in hours)
-    departure_delay, departure_time = args
-
-    flight_data = {
-        'DEPARTURE_DELAY': departure_delay,
-        'HOUR_OF_DAY': departure_time
-    }
+    # Flight data_db: (hour of the day; delayed flights and all flights in that hour)
+    hours, delayed_flights, flights = args
 
-    # Convert the flight data_db to a pandas DataFrame (df)
-    df = pd.DataFrame(flight_data)
+    # Calculate the percentage of delayed flights per hour of the day, sorted by hour.
+    # E.g Hour 15 had 30% delayed flights, Hour 5 had 10%, Hour 8 had 25%, etc..
+    percentage_delayed_per_hour = pd.Series(np.asarray(delayed_flights) / np.asarray(flights) * 100,
+                                            index=hours).sort_index()
 
-    # Get counts for number of delays per hour of the day.
-    # E.g Hour 15 had 5 delays, Hour 5 had 3 delays, Hour 8 had 15 delays, etc..
-    # Sort the index. The index here is the hours in which the delay occurred.
-    delayed_flights_per_hour = df['HOUR_OF_DAY'].value_counts().sort_index()
-
-    # Calculate the total number of flights by summing up the counts of delay per hour of the day.
-    total_flights = delayed_flights_per_hour.sum()
-
-    # Calculate the percentage of delayed flights per hour of the day
-    percentage_delayed_per_hour = (delayed_flights_per_hour / total_flights) * 100
+    # Scale the colors to the highest percentage
+    norm = Normalize(vmin=0, vmax=percentage_delayed_per_hour.max())
 
     # Create a colormap for the bar chart
-    colormap = plt.cm.viridis
+    colormap = VIRIDIS
 
     # Create the figure and axes for the bar chart
-    fig, ax = plt.subplots(figsize=(10, 6))
+    own_figure = ax is None
+    ax = _new_axes(ax, FIGURE_SIZES['plot_bar_chart_with_colorbar'], output)
 
     # Create the bar chart
     bars = ax.bar(percentage_delayed_per_hour.index, percentage_delayed_per_hour.values,
-                  color=colormap(percentage_delayed_per_hour.values / 10))
+                  color=colormap(norm(percentage_delayed_per_hour.values)))
 
     # Create the legend colorbar using the ScalarMappable object
-    sm = plt.cm.ScalarMappable(cmap=colormap, norm=plt.Normalize(vmin=0, vmax=10))
+    sm = ScalarMappable(cmap=colormap, norm=norm)
     sm.set_array(percentage_delayed_per_hour.values)  # Set the array to map the colors correctly
-    cbar = plt.colorbar(sm, ax=ax)
+    cbar = ax.figure.colorbar(sm, ax=ax)
     cbar.set_label('Percentage Delayed')  # Label for the colorbar
 
     # Set x-axis ticks interval to range from 1 to 25.
-    plt.xticks(range(0, 25))
+    ax.set_xticks(range(0, 25))
 
     # Add labels and title
-    plt.xlabel('Hour of the Day')
-    plt.ylabel('Percentage Delayed')
-    plt.title('Percentage of Delayed Flights per Hour of the Day')
+    ax.set_xlabel('Hour of the Day')
+    ax.set_ylabel('Percentage Delayed')
+    ax.set_title('Percentage of Delayed Flights per Hour of the Day')
 
     # Show the plot
-    plt.tight_layout()
-    plt.show()
+    _show(ax, own_figure, output, format)
 
 
-def plot_heat_map(args):
+def plot_heat_map(args, ax=None, output=None, format=None, top_k=HEAT_MAP_TOP_AIRPORTS):
     """
-     plots the percentage of delay for each route on a heat map. Displays it to the user
+     plots the percentage of delay for each route on a heat map. Displays it to the user.
+     Every route is used: the routes are kept as a sparse route matrix (see route_matrix)
+     and a dense grid is only built for the airports that are drawn.
     :param args: origin airport, destination airport, percentage of delay for routes
+                 and, optionally, number of flights for routes (used to rank airports by traffic)
+    :param ax: axes to draw on. If None, the chart is drawn on a new figure and shown
+    :param output: file path or binary file-like object to save the new figure to, instead of showing it
+    :param format: image format of the output ('png', 'svg', ...), None follows the file extension
+    :param top_k: only draw the routes between the top_k busiest airports, or None to draw every airport
     :return: None
     """
     # Unpacking the args
-    origin_airport, destination_airport, percentage_of_delay_for_routes = args
-
-    data = {
-        'origin': origin_airport,
-        'destination': destination_airport,
-        'percentage_delay': percentage_of_delay_for_routes,
-    }
+    origin_airport, destination_airport, percentage_of_delay_for_routes = args[:3]
+    flights_per_route = args[3] if len(args) > 3 else None
 
-    # Convert data_db to a pandas dataframe (df)
-    df = pd.DataFrame(data)
+    # Integer-encode the airports and keep one coordinate per route.
+    # Airports are sorted by code, origin is the row and destination the column.
+    routes = RouteMatrix.from_routes(origin_airport, destination_airport,
+                                     percentage_of_delay_for_routes, flights_per_route).top_airports(top_k)
 
-    # Randomly sample 500 data_db points.
-    # Random_state is set at 42 to maintain a constant random selection each time
-    sampled_df = df.sample(n=500, random_state=42)
+    # Build the 2D array for the drawn airports. Routes without flights are 0
+    percentage_delay_array = routes.to_dense(fill=0.0)
 
-    # Create a pivot table to convert the sampled data_db into a 2D array.
-    # This makes origin the index, destination the column and percentage delay the data.
-    # Thus making it easier to make comparison and plot the heat map
-    heatmap_data = pd.pivot_table(sampled_df, values='percentage_delay', index='origin', columns='destination')
-
-    # Convert the pivot table to a 2D numpy array
-    percentage_delay_array = heatmap_data.to_numpy()
-
-    # Replace nan values with 0 on both axes
-    np.nan_to_num(percentage_delay_array, nan=0.0, copy=False)
-
-    fig, ax = plt.subplots(figsize=(10, 7))
+    own_figure = ax is None
+    ax = _new_axes(ax, FIGURE_SIZES['plot_heat_map'], output)
 
     # Use a diverging color map for better visibility
     # Color can be found here https://matplotlib.org/stable/tutorials/colors/colormaps.html
-    cmap = 'plasma'
+    cmap = PLASMA
 
     # Plots the heat map
     # Set the aspect ratio to 'equal'
-    im = ax.imshow(percentage_delay_array, cmap=cmap, aspect='equal')
+    im = ax.imshow(percentage_delay_array, cmap=cmap, aspect='equal', interpolation='nearest')
 
     # Adding color bar legend to the Heatmap
     cbar = ax.figure.colorbar(im, ax=ax, shrink=0.7)
 
-    # Setting the axis tick values and labels
-    ax.set_yticks(np.arange(len(heatmap_data.index)))
-    ax.set_xticks(np.arange(len(heatmap_data.columns)))
+    # Setting the axis tick values and labels.
+    # With too many airports to read the labels, only some of them are shown
+    step = max(1, len(routes.airports) // HEAT_MAP_MAX_LABELS)
+    ticks = np.arange(0, len(routes.airports), step)
+    ax.set_yticks(ticks)
+    ax.set_xticks(ticks)
 
-    ax.set_yticklabels(heatmap_data.index, rotation=0, fontsize=8)
-    ax.set_xticklabels(heatmap_data.columns, rotation=90, fontsize=8)
+    ax.set_yticklabels(routes.airports[ticks], rotation=0, fontsize=8)
+    ax.set_xticklabels(routes.airports[ticks], rotation=90, fontsize=8)
 
     ax.set_title("Percentage of delayed on a heatmap of routes (Origin <-> Destination)")
 
     # show chart
-    plt.tight_layout()
-    plt.show()
+    _show(ax, own_figure, output, format)
 
 
-def plot_route_map(args):
+def plot_route_map(args, ax=None, output=None, format=None, sample_size=ROUTE_MAP_SAMPLE_SIZE):
     """
     Plots the flight routes on a map image with .png format. The the percentage delay is represented
     with intensity colours on the route lines that connects origin and destination airports.
+    All the routes are drawn as a single line collection and all the airports as a single scatter,
+    so drawing every route costs about the same as drawing a sample.
     :param args: origin airport and coordinate, destination airport and coordinate, percentage delay
+    :param ax: axes to draw on. If None, the chart is drawn on a new figure and shown
+    :param output: file path or binary file-like object to save the new figure to, instead of showing it
+    :param format: image format of the output ('png', 'svg', ...), None follows the file extension
+    :param sample_size: number of randomly sampled routes to draw, or None to draw all of them
     :return:
     """
     # Unpacking the args
@@ -182,18 +242,28 @@ def plot_route_map(args):
     # Convert data_db to a pandas dataframe (df)
     df = pd.DataFrame(data)
 
-    # Randomly sample 50 data_db points
-    sampled_df = df.sample(n=50, random_state=42)
+    # Randomly sample the routes to draw (all of them if sample_size is None)
+    # Random_state is set at 42 to maintain a constant random selection each time
+    if sample_size is not None and sample_size < len(df):
+        df = df.sample(n=sample_size, random_state=42)
 
-    # define map extent. Give map extent an allowance of 0.5 to display plot nicely
-    map_extent = [sampled_df.origin_longitude.min() - 0.5, sampled_df.origin_longitude.max() + 0.5,
-                  sampled_df.origin_latitude.min() - 0.5, sampled_df.origin_latitude.max() + 0.5]
+    origin_longitude = df['origin_longitude'].to_numpy(dtype=float)
+    origin_latitude = df['origin_latitude'].to_numpy(dtype=float)
+    destination_longitude = df['destination_longitude'].to_numpy(dtype=float)
+    destination_latitude = df['destination_latitude'].to_numpy(dtype=float)
+    route_delay = df['percentage_delay'].to_numpy(dtype=float)
 
-    # read the map image
-    img_map = plt.imread('map.png')
+    # define map extent. Give map extent an allowance of 0.5 to display plot nicely
+    map_extent = [origin_longitude.min() - 0.5, origin_longitude.max() + 0.5,
+                  origin_latitude.min() - 0.5, origin_latitude.max() + 0.5]
 
     # Create the plot and set the figure size
-    fig, ax = plt.subplots(figsize=(8, 4))
+    own_figure = ax is None
+    ax = _new_axes(ax, FIGURE_SIZES['plot_route_map'], output)
+
+    # Get the map image (decoded once, then cached), no larger than the figure in pixels
+    width, height = ax.figure.get_size_inches() * ax.figure.dpi
+    img_map = load_map_tile(max_width=width, max_height=height)
 
     # Setting limits for the plot
     ax.set_xlim(map_extent[0], map_extent[1])
@@ -203,32 +273,125 @@ def plot_route_map(args):
     ax.imshow(img_map, extent=map_extent, aspect='equal')
 
     # Normalize the percentage_delay values to fit within the colormap range (0 to 1)
-    norm = Normalize(vmin=sampled_df['percentage_delay'].min(), vmax=sampled_df['percentage_delay'].max())
-    sampled_df['normalized_percentage_delay'] = norm(sampled_df['percentage_delay'])
+    # and get the color of every route in a single colormap call
+    norm = Normalize(vmin=route_delay.min(), vmax=route_delay.max())
+    cmap = VIRIDIS
+    colors = cmap(norm(route_delay))
 
-    # Color range that is used to display the intensity
-    cmap = 'viridis'
+    # Draw lines connecting the origin and destination airports.
+    # segments has one [[origin lon, origin lat], [destination lon, destination lat]] entry per route
+    segments = np.stack([np.column_stack([origin_longitude, origin_latitude]),
+                         np.column_stack([destination_longitude, destination_latitude])], axis=1)
+    ax.add_collection(LineCollection(segments, colors=colors, linewidths=1.5))
 
     # Plot the airports as points with different shades of color intensity based on average delay
-    for _, row in sampled_df.iterrows():
-        color = plt.get_cmap(cmap)(row['normalized_percentage_delay'])
-        ax.plot([row['origin_longitude'], row['destination_longitude']],
-                [row['origin_latitude'], row['destination_latitude']], 'o', markersize=4, color=color)
-
-    # Draw lines connecting the origin and destination airports
-    for _, row in sampled_df.iterrows():
-        color = plt.get_cmap(cmap)(row['normalized_percentage_delay'])
-        ax.plot([row['origin_longitude'], row['destination_longitude']],[row['origin_latitude'], row['destination_latitude']], '-', color=color)
+    ax.scatter(np.concatenate([origin_longitude, destination_longitude]),
+               np.concatenate([origin_latitude, destination_latitude]),
+               s=16, c=np.concatenate([colors, colors]), zorder=3)
 
     # Create ScalarMappable to add color bar
     sm = ScalarMappable(cmap=cmap, norm=norm)
     sm.set_array([])  # Set empty array to correctly map the colors
 
     # Add color bar. Set color bar orientation and aspect including padding
-    cbar = plt.colorbar(sm, ax=ax, orientation='horizontal', shrink=0.3, aspect=30, pad=0.1)
+    cbar = ax.figure.colorbar(sm, ax=ax, orientation='horizontal', shrink=0.3, aspect=30, pad=0.1)
     cbar.set_label('Percentage Delay')
     cbar.ax.tick_params(length=0)
 
     # Show the plot
-    plt.title('Percentage of Delayed Flights per Route (Both Directions Average)')
-    plt.show()
\ No newline at end of file
+    ax.set_title('Percentage of Delayed Flights per Route (Both Directions Average)')
+    _show(ax, own_figure, output, format, tight_layout=False)
+
+
+def plot_dashboard(charts, output=None, format=None):
+    """
+    Plots several charts as panels of one figure, two panels per row.
+    Shows the figure to the user, or saves it to the output if one is given.
+    :param charts: list of (plot function, args) pairs, e.g. [(plot_bar_chart, (airline, percentage)), ...]
+    :param output: file path or binary file-like object to save the figure to, or None to show it
+    :param format: image format of the output ('png', 'svg', ...), None follows the file extension
+    :return: None
+    """
+    rows = (len(charts) + 1) // 2
+    if output is None:
+        fig, axes = plt.subplots(rows, 2, figsize=(20, 7 * rows), squeeze=False)
+    else:
+        fig = Figure(figsize=(20, 7 * rows))
+        axes = fig.subplots(rows, 2, squeeze=False)
+
+    for (plot_function, args), ax in zip(charts, axes.flat):
+        plot_function(args, ax=ax)
+
+    # Hide the unused panel when the number of charts is odd
+    for ax in axes.flat[len(charts):]:
+        ax.set_visible(False)
+
+    fig.tight_layout()
+    if output is None:
+        plt.show()
+    else:
+        fig.savefig(output, format=format)
+
+
+class ChartRenderer:
+    """
+    Renders charts off-screen to image files or bytes, one after the other,
+    reusing the same figure for every chart instead of creating a new one each time.
+    """
+
+    def __init__(self):
+        self._figure = Figure()
+
+    def render(self, plot_function, args, output=None, format='png'):
+        """
+        Renders one chart with a plot function of this module (e.g. plot_bar_chart).
+        :param output: file path or binary file-like object, or None to return the image as bytes
+        :param format: image format ('png', 'svg', ...), None follows the file extension
+        :return: the image bytes if output is None, otherwise the output
+        """
+        buffer = io.BytesIO() if output is None else None
+
+        # Clear the previous chart, including its colorbars
+        self._figure.clear()
+        # A functools.partial of a plot function (e.g. with a sample_size) has the size of the function
+        self._figure.set_size_inches(FIGURE_SIZES[getattr(plot_function, 'func', plot_function).__name__])
+        plot_function(args, ax=self._figure.add_subplot())
+        self._figure.tight_layout()
+        self._figure.savefig(output if buffer is None else buffer, format=format)
+        self._figure.clear()
+
+        return buffer.getvalue() if buffer is not None else output
+
+
+# The renderer of the current (worker) process, created on first use
+_process_renderer = None
+
+
+def _render_job(job):
+    """
+    Renders one (plot function, args, output, format) job with the current process's renderer
+    """
+    global _process_renderer
+    if _process_renderer is None:
+        _process_renderer = ChartRenderer()
+    plot_function, args, output, format = job
+    return _process_renderer.render(plot_function, args, output, format)
+
+
+def render_charts(jobs, processes=None, format='png'):
+    """
+    Renders many charts off-screen in one go.
+    :param jobs: list of (plot function, args, output) tuples, where output is a file path
+                 or None to get the image back as bytes
+    :param processes: number of worker processes to render in parallel (None or 1 renders
+                      in this process). Each worker reuses one figure for all its charts.
+    :param format: image format of every chart ('png', 'svg', ...)
+    :return: list with the output (file path or bytes) of each job, in order
+    """
+    jobs = [(plot_function, args, output, format) for plot_function, args, output in jobs]
+
+    if not processes or processes == 1:
+        return [_render_job(job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_render_job, jobs))
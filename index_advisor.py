@@ -0,0 +1,145 @@
+"""
+Index advisor for the flights database.
+
+Runs EXPLAIN QUERY PLAN on every registered query, reports the full table
+scans and the queries that don't use the index meant for them, creates the
+missing indexes and times each query before and after.
+"""
+import time
+
+from sqlalchemy import text
+
+from query_registry import QUERIES, compile_query
+from sql_queries import REGISTERED_QUERIES, FLIGHT_INDEXES
+
+# Sample parameters used to explain and time the parameterised queries
+EXPLAIN_PARAMS = {
+    'flight_by_id': {'id': 1},
+    'flight_by_airport': {'IATA': 'LAX'},
+    'flight_by_date': {'day': 1, 'month': 1, 'year': 2015},
+    'flight_by_airline': {'airline': 'Delta Air Lines Inc.'},
+    'flight_by_airport_page': {'IATA': 'LAX', 'after_id': 0, 'page_size': 100},
+    'flight_by_date_page': {'day': 1, 'month': 1, 'year': 2015, 'after_id': 0, 'page_size': 100},
+    'flights_by_date_range': {'start': 20150101, 'end': 20150107},
+    'delayed_flights_by_day': {'start': 20150101, 'end': 20150131},
+}
+
+# Index each query has to be searched with once it exists. A plan can avoid a full SCAN
+# and still read every flight (e.g. once per airline through another index), so these
+# queries are checked for their index rather than for scans
+EXPECTED_INDEXES = {
+    'flights_by_date_range': 'idx_flights_date_key',
+    'delayed_flights_by_day': 'idx_flights_date_key',
+}
+
+
+def explain_query_plan(connection, query, params=None):
+    """
+    Runs EXPLAIN QUERY PLAN for a query on the given connection.
+    :param connection: SQLAlchemy connection
+    :param query: SQL query string
+    :param params: query parameters (dictionary) or None
+    :return: list of plan step descriptions, e.g. ['SCAN flights', 'SEARCH airlines USING ...']
+    """
+    result = connection.execute(compile_query("EXPLAIN QUERY PLAN " + query), params or {})
+    return [row['detail'] for row in result.mappings().fetchall()]
+
+
+def find_full_scans(plan):
+    """
+    Returns the plan steps that read a whole table.
+    A scan of a covering index is not reported since it never touches the table rows.
+    """
+    return [step for step in plan
+            if step.startswith('SCAN') and 'COVERING INDEX' not in step]
+
+
+def find_unused_indexes(name, plan, present):
+    """
+    Returns the expected index of a query (see EXPECTED_INDEXES) if it exists but the plan doesn't use it
+    """
+    index = EXPECTED_INDEXES.get(name)
+    if index is None or index not in present or any(f"INDEX {index} " in step for step in plan):
+        return []
+    return [index]
+
+
+def time_query(connection, query, params=None):
+    """
+    Runs the query to completion and returns the elapsed time in seconds
+    """
+    start = time.perf_counter()
+    connection.execute(QUERIES.statement(query), params or {}).fetchall()
+    return time.perf_counter() - start
+
+
+def existing_indexes(connection):
+    """
+    Returns the set of index names already present in the database
+    """
+    result = connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))
+    return set(result.scalars().all())
+
+
+def analyze_queries(connection, measure=True):
+    """
+    Explains (and optionally times) every registered query.
+    :return: dictionary of query name -> {'plan', 'full_scans', 'unused_indexes', 'seconds'}
+    """
+    present = existing_indexes(connection)
+    analysis = {}
+    for name, query in REGISTERED_QUERIES.items():
+        params = EXPLAIN_PARAMS.get(name)
+        plan = explain_query_plan(connection, query, params)
+        analysis[name] = {
+            'plan': plan,
+            'full_scans': find_full_scans(plan),
+            'unused_indexes': find_unused_indexes(name, plan, present),
+            'seconds': time_query(connection, query, params) if measure else None,
+        }
+    return analysis
+
+
+def ensure_indexes(connection, measure=True):
+    """
+    Creates every missing index in FLIGHT_INDEXES and refreshes the planner statistics.
+    The connection has to be inside a transaction (e.g. from engine.begin()).
+    :param connection: SQLAlchemy connection
+    :param measure: time every registered query before and after creating the indexes
+    :return: report dictionary with the created indexes and, per query, the analysis before and after
+    """
+    before = analyze_queries(connection, measure)
+
+    present = existing_indexes(connection)
+    created = [name for name in FLIGHT_INDEXES if name not in present]
+    for name in created:
+        connection.execute(text(FLIGHT_INDEXES[name]))
+    if created:
+        connection.execute(text("ANALYZE"))
+
+    after = analyze_queries(connection, measure)
+
+    return {
+        'created_indexes': created,
+        'queries': {name: {'before': before[name], 'after': after[name]} for name in REGISTERED_QUERIES},
+    }
+
+
+def print_index_report(report):
+    """
+    Prints the report returned by ensure_indexes to the screen
+    """
+    created = report['created_indexes']
+    print(f"Created {len(created)} indexes: {', '.join(created) if created else '-'}")
+
+    for name, analysis in report['queries'].items():
+        before, after = analysis['before'], analysis['after']
+        print(f"\n{name}")
+        for step in before['full_scans']:
+            print(f"  full scan before: {step}")
+        for step in after['full_scans']:
+            print(f"  full scan after:  {step}")
+        for index in after['unused_indexes']:
+            print(f"  not using {index}: {'; '.join(after['plan'])}")
+        if before['seconds'] is not None:
+            print(f"  time: {before['seconds'] * 1000:.1f} ms -> {after['seconds'] * 1000:.1f} ms")
@@ -0,0 +1,247 @@
+"""
+Query timing instrumentation and slow-query log.
+
+QueryStats hooks into a SQLAlchemy engine's cursor events, so every statement
+run on the engine is timed, including ad-hoc ones. Statements are named after
+their entry in sql_queries (see QUERY_NAMES and QUERY_PREFIXES), matched on the
+SQL they were compiled from (see query_registry); other statements are named
+'adhoc'. Per name it keeps the call count, a histogram of execution times and,
+when reported by the caller, the time spent fetching, the rows returned and an
+estimate of the bytes fetched. Statements slower than the threshold are kept in
+a slow-query log together with their params and EXPLAIN QUERY PLAN.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+
+from sql_queries import REGISTERED_QUERIES, AGGREGATE_QUERIES, SAMPLE_QUERIES, BATCH_QUERIES
+
+# Query name of each known SQL statement
+QUERY_NAMES = {query: name for name, query in
+               {**REGISTERED_QUERIES, **AGGREGATE_QUERIES, **SAMPLE_QUERIES}.items()}
+
+# Query name of the statements built from each batch query template, by the text before the keys
+QUERY_PREFIXES = [(template[:template.index('{keys}')], name) for name, template in BATCH_QUERIES.items()]
+
+# Upper bounds (seconds) of the execution time histogram buckets
+HISTOGRAM_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, float('inf'))
+
+# Default execution time (seconds) above which a statement goes to the slow-query log
+SLOW_QUERY_THRESHOLD = 1.0
+
+# Number of entries kept in the slow-query log
+SLOW_QUERY_LOG_SIZE = 100
+
+# Number of rows measured to estimate the bytes of a result
+BYTES_SAMPLE_ROWS = 100
+
+logger = logging.getLogger(__name__)
+
+
+def query_name(statement):
+    """
+    Returns the name of an SQL statement, 'adhoc' if it's not a known query
+    """
+    name = QUERY_NAMES.get(statement)
+    if name is not None:
+        return name
+    return next((name for prefix, name in QUERY_PREFIXES if statement.startswith(prefix)), 'adhoc')
+
+
+def statement_text(invoked_statement, statement):
+    """
+    Returns the SQL a statement was compiled from, before the bind params were rendered
+    for the driver: the text of a text() construct, also once it's wrapped with its
+    declared columns (a TextualSelect, see query_registry). Other statements fall back
+    to the SQL sent to the driver.
+    """
+    invoked_statement = getattr(invoked_statement, 'element', invoked_statement)
+    return getattr(invoked_statement, 'text', statement)
+
+
+def _value_size(value):
+    """
+    Returns the approximate size in bytes of a fetched value
+    """
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 8
+
+
+def estimate_bytes(rows):
+    """
+    Estimates the bytes of a list of records (mappings), measuring only the first BYTES_SAMPLE_ROWS
+    """
+    if not rows:
+        return 0
+    sample = rows[:BYTES_SAMPLE_ROWS]
+    sample_bytes = sum(_value_size(value) for row in sample for value in row.values())
+    return sample_bytes * len(rows) // len(sample)
+
+
+def estimate_column_bytes(columns):
+    """
+    Estimates the bytes of a columnar result (dictionary of NumPy arrays).
+    Typed arrays count their buffer size, object arrays are estimated like records
+    """
+    num_bytes = 0
+    for values in columns.values():
+        if values.dtype == object:
+            sample = values[:BYTES_SAMPLE_ROWS]
+            if len(sample):
+                num_bytes += sum(_value_size(value) for value in sample) * len(values) // len(sample)
+        else:
+            num_bytes += values.nbytes
+    return num_bytes
+
+
+def _new_entry():
+    return {
+        'calls': 0,
+        'execute_seconds': 0.0,
+        'histogram': [0] * len(HISTOGRAM_BUCKETS),
+        'fetch_seconds': 0.0,
+        'rows': 0,
+        'bytes': 0,
+    }
+
+
+class QueryStats:
+    """
+    Per-query timing statistics and slow-query log, fed by engine events.
+    """
+
+    def __init__(self, slow_query_threshold=SLOW_QUERY_THRESHOLD):
+        """
+        :param slow_query_threshold: execution time (seconds) above which a statement is logged
+        """
+        self.slow_query_threshold = slow_query_threshold
+        self._stats = {}
+        self._slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self._lock = threading.Lock()
+
+    def attach(self, engine):
+        """
+        Starts timing every statement executed on the engine
+        """
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - context._query_start
+        name = query_name(statement_text(context.invoked_statement, statement))
+        self.record_execute(name, seconds)
+
+        if seconds >= self.slow_query_threshold:
+            self._log_slow_query(cursor, name, statement, parameters, seconds)
+
+    def record_execute(self, name, seconds):
+        """
+        Records one execution of the named query
+        """
+        bucket = next(i for i, bound in enumerate(HISTOGRAM_BUCKETS) if seconds <= bound)
+        with self._lock:
+            entry = self._stats.setdefault(name, _new_entry())
+            entry['calls'] += 1
+            entry['execute_seconds'] += seconds
+            entry['histogram'][bucket] += 1
+
+    def record_fetch(self, statement, rows, num_bytes, seconds):
+        """
+        Records the rows, bytes and time of fetching the result of a statement
+        """
+        with self._lock:
+            entry = self._stats.setdefault(query_name(statement), _new_entry())
+            entry['rows'] += rows
+            entry['bytes'] += num_bytes
+            entry['fetch_seconds'] += seconds
+
+    def _log_slow_query(self, cursor, name, statement, parameters, seconds):
+        """
+        Adds a statement to the slow-query log, with its query plan if it's a SELECT
+        """
+        plan = None
+        if statement.lstrip().upper().startswith('SELECT'):
+            try:
+                # A separate DBAPI cursor, so the statement's own result is left untouched
+                plan = [row[-1] for row in
+                        cursor.connection.execute("EXPLAIN QUERY PLAN " + statement, parameters)]
+            except Exception as e:
+                plan = [f"unavailable: {e}"]
+
+        entry = {
+            'query': name,
+            'seconds': seconds,
+            'statement': statement.strip(),
+            'params': parameters if isinstance(parameters, dict) else list(parameters or ()),
+            'plan': plan,
+            'time': time.time(),
+        }
+        with self._lock:
+            self._slow_queries.append(entry)
+        logger.info("Slow query %s (%.3f s): %s", name, seconds, parameters)
+
+    def slow_queries(self):
+        """
+        Returns the slow-query log entries, oldest first
+        """
+        with self._lock:
+            return list(self._slow_queries)
+
+    def snapshot(self):
+        """
+        Returns the statistics as a dictionary of query name -> counters
+        """
+        with self._lock:
+            return {name: {**entry, 'histogram': dict(zip(map(str, HISTOGRAM_BUCKETS), entry['histogram']))}
+                    for name, entry in self._stats.items()}
+
+    def reset(self):
+        """
+        Clears the statistics and the slow-query log
+        """
+        with self._lock:
+            self._stats.clear()
+            self._slow_queries.clear()
+
+    def to_json(self):
+        """
+        Returns the statistics and the slow-query log as a JSON document
+        """
+        return json.dumps({'queries': self.snapshot(), 'slow_queries': self.slow_queries()},
+                          indent=2, default=str)
+
+    def to_prometheus(self):
+        """
+        Returns the statistics in the Prometheus text exposition format
+        """
+        with self._lock:
+            stats = {name: dict(entry, histogram=list(entry['histogram'])) for name, entry in self._stats.items()}
+
+        lines = ['# HELP flight_query_duration_seconds Query execution time.',
+                 '# TYPE flight_query_duration_seconds histogram']
+        for name, entry in stats.items():
+            cumulative = 0
+            for bound, count in zip(HISTOGRAM_BUCKETS, entry['histogram']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'flight_query_duration_seconds_bucket{{query="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'flight_query_duration_seconds_sum{{query="{name}"}} {entry["execute_seconds"]}')
+            lines.append(f'flight_query_duration_seconds_count{{query="{name}"}} {entry["calls"]}')
+
+        for metric, key, help_text in (('flight_query_fetch_seconds_total', 'fetch_seconds', 'Result fetch time.'),
+                                       ('flight_query_rows_total', 'rows', 'Rows returned.'),
+                                       ('flight_query_bytes_total', 'bytes', 'Estimated bytes fetched.')):
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} counter')
+            for name, entry in stats.items():
+                lines.append(f'{metric}{{query="{name}"}} {entry[key]}')
+
+        return '\n'.join(lines) + '\n'
@@ -1,11 +1,48 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
+from itertools import islice
 import sqlalchemy
 import data
+import instrumentation
+import partitions
+import sampling
+import snapshots
+from bulk_loader import CHUNK_SIZE, print_progress
+from index_advisor import print_index_report
 from data_plots import *
 
 SQLITE_URI = 'sqlite:///flights.sqlite3'
 IATA_LENGTH = 3
 
+# Batch operation kinds and the data manager getter each one runs
+BATCH_OPERATIONS = {
+    'id': 'get_flight_by_id',
+    'date': 'get_flights_by_date',
+    'airline': 'get_delayed_flights_by_airline',
+    'airport': 'get_delayed_flights_by_airport',
+    'range': 'get_flights_by_date_range',
+}
+
+# Batch getter that looks up many keys at once, for the getters that have one
+BATCHED_GETTERS = {
+    'get_flight_by_id': 'get_flights_by_ids',
+    'get_flights_by_date': 'get_flights_by_dates',
+    'get_delayed_flights_by_airport': 'get_delayed_flights_by_airports',
+}
+
+# Number of batch operations read before their lookups are run, grouped by kind
+BATCH_WINDOW = 1000
+
+# Columns written for every result of a batch operation (the ones print_results shows)
+BATCH_RESULT_COLUMNS = ['ID', 'ORIGIN_AIRPORT', 'DESTINATION_AIRPORT', 'AIRLINE', 'DELAY']
+
 
 def delayed_flights_by_airline(data_manager):
     """
@@ -21,8 +58,8 @@ def delayed_flights_by_airline(data_manager):
 def delayed_flights_by_airport(data_manager):
     """
     Asks the user for a textual IATA 3-letter airport code (loops until input is valid).
-    Then runs the query using the data_db object method "get_delayed_flights_by_airport".
-    When results are back, calls "print_results" to show them to on the screen.
+    Then runs the query using the data_db object method "iter_delayed_flights_by_airport_pages".
+    Calls "print_paged_results" to show them on the screen, one page at a time.
     """
     valid = False
     while not valid:
@@ -30,8 +67,7 @@ def delayed_flights_by_airport(data_manager):
         # Valide input
         if airport_input.isalpha() and len(airport_input) == IATA_LENGTH:
             valid = True
-    results = data_manager.get_delayed_flights_by_airport(airport_input)
-    print_results(results)
+    print_paged_results(data_manager.iter_delayed_flights_by_airport_pages(airport_input))
 
 
 def flight_by_id(data_manager):
@@ -55,8 +91,8 @@ def flight_by_id(data_manager):
 def flights_by_date(data_manager):
     """
     Asks the user for date input (and loops until it's valid),
-    Then runs the query using the data_db object method "get_flights_by_date".
-    When results are back, calls "print_results" to show them to on the screen.
+    Then runs the query using the data_db object method "iter_flights_by_date_pages".
+    Calls "print_paged_results" to show them on the screen, one page at a time.
     """
     valid = False
     while not valid:
@@ -67,8 +103,87 @@ def flights_by_date(data_manager):
             print("Try again...", e)
         else:
             valid = True
-    results = data_manager.get_flights_by_date(date.day, date.month, date.year)
-    print_results(results)
+    print_paged_results(data_manager.iter_flights_by_date_pages(date.day, date.month, date.year))
+
+
+def delayed_flights_per_airline_chart_data(data_manager):
+    """
+    Gets the delayed flights by airline and calculates the percentage the of delay.
+    Returns the chart data (airline, percentage of delayed flights),
+    or None if the results couldn't be read.
+    """
+    # Get flight data as columns (NumPy arrays)
+    flights_data = data_manager.get_delayed_and_departed_flights_by_airline(columnar=True)
+
+    try:
+        percentage_of_delayed_flights = (flights_data['num_of_delayed_flights'] /
+                                         flights_data['num_of_flights']) * 100
+        airline = flights_data['AIRLINE']
+
+    except (KeyError, ValueError, sqlalchemy.exc.SQLAlchemyError) as e:
+        print("Error showing results: ", e)
+        return None
+    return airline, percentage_of_delayed_flights
+
+
+def delayed_flights_by_hour_chart_data(data_manager):
+    """
+    Gets the number of delayed flights and the total number of flights for each hour
+    of the day, counted in the database. Returns the chart data
+    (hours, delayed flights, flights), or None if the results couldn't be read.
+    """
+    # Gets the per-hour flight counts as columns (NumPy arrays)
+    flights_data = data_manager.get_delayed_flights_by_hour(columnar=True)
+
+    try:
+        hours = flights_data['HOUR_OF_DAY']
+        delayed_flights = flights_data['num_of_delayed_flights']
+        flights = flights_data['num_of_flights']
+
+    except (KeyError, ValueError, sqlalchemy.exc.SQLAlchemyError) as e:
+        print("Error showing results: ", e)
+        return None
+    return hours, delayed_flights, flights
+
+
+def delay_for_routes_chart_data(data_manager):
+    """
+    Gets the origin airport, destination airport, percentage delay and number of flights
+    for each flight route. Returns the chart data (origin airports, destination airports,
+    percentage delay, number of flights), or None if the results couldn't be read.
+    """
+    # Gets flight data as columns (NumPy arrays)
+    flights_data = data_manager.get_origin_destination_airport_delay(columnar=True)
+
+    try:
+        origin_airport = flights_data['ORIGIN_AIRPORT']
+        destination_airport = flights_data['DESTINATION_AIRPORT']
+        percent_delay_per_route = flights_data['percentage_delay']
+        flights_per_route = flights_data['num_of_flights']
+
+    except (KeyError, ValueError, sqlalchemy.exc.SQLAlchemyError) as e:
+        print("Error showing results: ", e)
+        return None
+    return origin_airport, destination_airport, percent_delay_per_route, flights_per_route
+
+
+def route_map_chart_data(data_manager):
+    """
+    Gets the origin airport and origin airport coordinate as well as destination airport
+    and destination airport coordinate and finally the percentage delay per route.
+    Returns the chart data as a tuple of those columns, or None if the results couldn't be read.
+    """
+    # Gets Flight data as columns (NumPy arrays, coordinates already typed as floats)
+    flights_data = data_manager.get_origin_destination_latitude_longitude(columnar=True)
+
+    try:
+        return tuple(flights_data[name] for name in ('origin_airport', 'origin_longitude', 'origin_latitude',
+                                                     'destination_airport', 'destination_longitude',
+                                                     'destination_latitude', 'percentage_delay'))
+
+    except (KeyError, ValueError, sqlalchemy.exc.SQLAlchemyError) as e:
+        print("Error showing results: ", e)
+        return None
 
 
 def percentage_of_delayed_flights_per_airline(data_manager):
@@ -78,49 +193,24 @@ def percentage_of_delayed_flights_per_airline(data_manager):
     the results to the visualize data result function to display the chart plot
     to the user. The visual_type is also specified.
     """
-    # Get flight data
-    flights_data = data_manager.get_delayed_and_departed_flights_by_airline()
-
-    percentage_of_delayed_flights = []
-    airline = []
-
-    for flight_data in flights_data:
-        try:
-            percentage_of_delayed_flights.append(
-                (flight_data['num_of_delayed_flights'] / flight_data['num_of_flights']) * 100)
-            airline.append(flight_data['AIRLINE'])
-
-        except (ValueError, sqlalchemy.exc.SQLAlchemyError) as e:
-            print("Error showing results: ", e)
-            return
-    # visualize the result
-    visualize_data_result(airline, percentage_of_delayed_flights, visual_type='bar_chart')
+    chart_data = delayed_flights_per_airline_chart_data(data_manager)
+    if chart_data is not None:
+        # visualize the result
+        visualize_data_result(*chart_data, visual_type='bar_chart')
 
 
 def percentage_of_delayed_flights_by_hour_of_day(data_manager):
     """
-    When selected by the user. This function gets the delay and departure time for each flight.
+    When selected by the user. This function gets the number of delayed flights and
+    the total number of flights for each hour of the day, counted in the database.
     This data will be used to calculate the percentage of delayed flights for each hour of the day.
     If no exception errors, it parses the results to the visualize data result function
     to display the chart plot to the user. The visual_type is also specified.
     """
-    # Gets flight details
-    flights_data = data_manager.get_delay_and_departure_time()
-
-    departure_delay = []
-    departure_time = []
-
-    for flight_data in flights_data:
-        try:
-            departure_delay.append(flight_data['DELAY'])
-            departure_time.append(int(flight_data['DEPARTURE_TIME'][:2]))
-
-        except (ValueError, sqlalchemy.exc.SQLAlchemyError) as e:
-            print("Error showing results: ", e)
-            return
-
-    # Visualize the data
-    visualize_data_result(departure_delay, departure_time, visual_type='bar_chart_with_colorbar')
+    chart_data = delayed_flights_by_hour_chart_data(data_manager)
+    if chart_data is not None:
+        # Visualize the data
+        visualize_data_result(*chart_data, visual_type='bar_chart_with_colorbar')
 
 
 def percentage_of_delay_for_routes(data_manager):
@@ -130,76 +220,90 @@ def percentage_of_delay_for_routes(data_manager):
     If no exception errors, it parses the results to the visualize data result function
     to display the chart plot to the user. The visual_type is also specified.
     """
-    # Gets flight data
-    flights_data = data_manager.get_origin_destination_airport_delay()
+    chart_data = delay_for_routes_chart_data(data_manager)
+    if chart_data is not None:
+        # Visualize data
+        visualize_data_result(*chart_data, visual_type='heat_map')
 
-    origin_airport = []
-    destination_airport = []
-    percent_delay_per_route = []
 
-    for flight_data in flights_data:
-        try:
-            origin_airport.append(flight_data['ORIGIN_AIRPORT'])
-            destination_airport.append(flight_data['DESTINATION_AIRPORT'])
-            percent_delay_per_route.append(flight_data['percentage_delay'])
+def route_map_sample_size(value):
+    """
+    Parses a number of routes to draw on the route map: a positive integer, or 'all' (None)
+    """
+    if value.strip().lower() == 'all':
+        return None
+    sample_size = int(value)
+    if sample_size <= 0:
+        raise ValueError(f"The number of routes has to be positive, not {sample_size}")
+    return sample_size
 
-        except (ValueError, sqlalchemy.exc.SQLAlchemyError) as e:
-            print("Error showing results: ", e)
-            return
-    # Visualize data
-    visualize_data_result(origin_airport, destination_airport, percent_delay_per_route,
-                          visual_type='heat_map')
+
+def route_map_visual_methods(sample_size):
+    """
+    Returns VISUAL_METHODS with the route map drawing sample_size routes (None draws all of them)
+    """
+    return {**VISUAL_METHODS, 'route_map': partial(plot_route_map, sample_size=sample_size)}
 
 
 def percentage_delayed_flights_per_route_on_map(data_manager):
     """
     When selected by the user. This function gets the origin airport and origin airport coordinate as well as
     destination airport and destination airport coordinate and finally the percentage delay per route.
+    The user is asked how many randomly sampled routes to draw.
     The data is used to plot flight routes on the map and the percentage delay is shown on the line plots.
     If no exception errors, it parses the results to the visualize data result function
     to display the chart plot to the user. The visual_type is also specified.
     """
-    # Gets Flight data
-    flights_data = data_manager.get_origin_destination_latitude_longitude()
+    while True:
+        try:
+            sample_input = input(f"Enter the number of routes to draw, or 'all' "
+                                 f"(press Enter for {ROUTE_MAP_SAMPLE_SIZE}): ")
+            sample_size = route_map_sample_size(sample_input) if sample_input.strip() else ROUTE_MAP_SAMPLE_SIZE
+            break
+        except ValueError:
+            print("Try again...")
 
-    origin_airport = []
-    origin_airport_latitude = []
-    origin_airport_longitude = []
+    chart_data = route_map_chart_data(data_manager)
+    if chart_data is not None:
+        # Visulaize data result
+        plot_route_map(chart_data, sample_size=sample_size)
 
-    destination_airport = []
-    destination_airport_latitude = []
-    destination_airport_longitude = []
 
-    percent_delay_per_route = []
+def fetch_dashboard_data(data_manager):
+    """
+    Runs the queries of every dashboard chart at the same time, each one on its own thread
+    (and, with a pooled data manager, its own connection), so the total time is close to
+    the slowest query rather than the sum of all of them.
+    Returns the chart data of each chart in DASHBOARD_CHARTS (None for the ones that failed).
+    """
+    with ThreadPoolExecutor(max_workers=len(DASHBOARD_CHARTS)) as executor:
+        futures = [executor.submit(chart_data_function, data_manager)
+                   for chart_data_function, _ in DASHBOARD_CHARTS]
+        return [future.result() for future in futures]
 
-    for flight_data in flights_data:
-        try:
-            origin_airport.append(flight_data['origin_airport'])
-            origin_airport_longitude.append(float(flight_data['origin_longitude']))
-            origin_airport_latitude.append(float(flight_data['origin_latitude']))
-            destination_airport.append(flight_data['destination_airport'])
-            destination_airport_longitude.append(float(flight_data['destination_longitude']))
-            destination_airport_latitude.append(float(flight_data['destination_latitude']))
-            percent_delay_per_route.append(flight_data['percentage_delay'])
 
-        except (ValueError, sqlalchemy.exc.SQLAlchemyError) as e:
-            print("Error showing results: ", e)
-            return
+def show_dashboard(data_manager, output=None, sample_size=ROUTE_MAP_SAMPLE_SIZE):
+    """
+    When selected by the user. Fetches the data of all the charts in parallel and
+    displays them together as panels of one figure, or saves the figure to the output file.
+    sample_size is the number of routes drawn on the route map (None draws all of them).
+    """
+    visual_methods = route_map_visual_methods(sample_size)
+    start = time.perf_counter()
+    charts_data = fetch_dashboard_data(data_manager)
+    print(f"Fetched the dashboard data in {time.perf_counter() - start:.2f} seconds.")
 
-    # Visulaize data result
-    visualize_data_result(origin_airport, origin_airport_longitude, origin_airport_latitude, destination_airport,
-                          destination_airport_longitude, destination_airport_latitude, percent_delay_per_route,
-                          visual_type='route_map')
+    charts = [(visual_methods[visual_type], chart_data)
+              for (_, visual_type), chart_data in zip(DASHBOARD_CHARTS, charts_data)
+              if chart_data is not None]
+    plot_dashboard(charts, output)
 
 
-def print_results(results):
+def print_result_rows(results):
     """
-    Get a list of flight results (List of dictionary-like objects from SQLAachemy).
-    Even if there is one result, it should be provided in a list.
-    Each object *has* to contain the columns:
-    FLIGHT_ID, ORIGIN_AIRPORT, DESTINATION_AIRPORT, AIRLINE, and DELAY.
+    Prints flight results, one line each (see print_results for the required columns).
+    Returns False if a result couldn't be shown, True otherwise.
     """
-    print(f"Got {len(results)} results.")
     for result in results:
         # Check that all required columns are in place
         try:
@@ -209,13 +313,42 @@ def print_results(results):
             airline = result['AIRLINE']
         except (ValueError, sqlalchemy.exc.SQLAlchemyError) as e:
             print("Error showing results: ", e)
-            return
+            return False
 
         # Different prints for delayed and non-delayed flights
         if delay and delay > 0:
             print(f"{result['ID']}. {origin} -> {dest} by {airline}, Delay: {delay} Minutes")
         else:
             print(f"{result['ID']}. {origin} -> {dest} by {airline}")
+    return True
+
+
+def print_results(results):
+    """
+    Get a list of flight results (List of dictionary-like objects from SQLAachemy).
+    Even if there is one result, it should be provided in a list.
+    Each object *has* to contain the columns:
+    FLIGHT_ID, ORIGIN_AIRPORT, DESTINATION_AIRPORT, AIRLINE, and DELAY.
+    """
+    print(f"Got {len(results)} results.")
+    print_result_rows(results)
+
+
+def print_paged_results(pages):
+    """
+    Prints flight results page by page (see print_results for the required columns).
+    pages is an iterator of result lists, e.g. from FlightData.iter_flights_by_date_pages,
+    so the next page is only queried when the user asks for it.
+    """
+    shown = 0
+    for page in pages:
+        if shown:
+            if input("Press Enter for more results, or q to stop: ").strip().lower() == 'q':
+                return
+        if not print_result_rows(page):
+            return
+        shown += len(page)
+    print(f"Got {shown} results.")
 
 
 def visualize_data_result(*args, visual_type):
@@ -223,14 +356,7 @@ def visualize_data_result(*args, visual_type):
     This function calls the appropriate function (value) to execute a data visualization
     based on the specified visual type (key)
     """
-    visual_method = {
-        'bar_chart': plot_bar_chart,
-        'bar_chart_with_colorbar': plot_bar_chart_with_colorbar,
-        'heat_map': plot_heat_map,
-        'route_map': plot_route_map
-    }
-
-    visual_method[visual_type](args)
+    VISUAL_METHODS[visual_type](args)
 
 def quit_app(data_manager):
     """
@@ -263,6 +389,26 @@ def show_menu_and_get_input():
         print("Try again...")
 
 
+"""
+Visualization Dispatch Dictionaries
+"""
+# Plot function of each visual type
+VISUAL_METHODS = {
+    'bar_chart': plot_bar_chart,
+    'bar_chart_with_colorbar': plot_bar_chart_with_colorbar,
+    'heat_map': plot_heat_map,
+    'route_map': plot_route_map
+}
+
+# Charts shown on the dashboard: (function returning the chart data, visual type)
+DASHBOARD_CHARTS = [
+    (delayed_flights_per_airline_chart_data, 'bar_chart'),
+    (delayed_flights_by_hour_chart_data, 'bar_chart_with_colorbar'),
+    (delay_for_routes_chart_data, 'heat_map'),
+    (route_map_chart_data, 'route_map'),
+]
+
+
 """
 Function Dispatch Dictionary
 """
@@ -276,18 +422,378 @@ FUNCTIONS = {1: (flight_by_id, "Show flight by ID"),
                  'Display percentage of delayed heatmap for each route origin airport -> destination airport'),
              8: (percentage_delayed_flights_per_route_on_map,
                  'Display Map Plot of percentage of delayed flights per route'),
-             9: (quit_app, "Exit")
+             9: (show_dashboard, 'Display dashboard of all the charts above'),
+             10: (quit_app, "Exit")
              }
 
 
+def ensure_indexes(data_manager, args):
+    """
+    Runs the index advisor on the database, creating the missing indexes,
+    and prints the report of full scans and query timings before and after.
+    """
+    report = data_manager.ensure_indexes(measure=not args.no_timing)
+    # Partitioned data returns the report of every partition database
+    if isinstance(report, list):
+        for partition_uri, partition_report in zip(args.partition, report):
+            print(f"\n{partition_uri}")
+            print_index_report(partition_report)
+    else:
+        print_index_report(report)
+
+
+def parse_operation(operation):
+    """
+    Parses a batch operation written as 'kind:value', e.g. 'id:280', 'date:01/03/2015',
+    'airline:Delta Air Lines Inc.', 'airport:LAX' or 'range:01/03/2015-07/03/2015',
+    validating the value like the menu does.
+    Returns the data manager getter name and its arguments.
+    Raises ValueError if the operation is not valid.
+    """
+    kind, separator, value = operation.partition(':')
+    kind, value = kind.strip().lower(), value.strip()
+
+    if not separator or kind not in BATCH_OPERATIONS:
+        raise ValueError(f"Unknown operation '{operation}', expected one of: "
+                         f"{', '.join(kind + ':<value>' for kind in BATCH_OPERATIONS)}")
+
+    if kind == 'id':
+        arguments = (int(value),)
+    elif kind == 'date':
+        date = datetime.strptime(value, '%d/%m/%Y')
+        arguments = (date.day, date.month, date.year)
+    elif kind == 'range':
+        start, _, end = value.partition('-')
+        arguments = (datetime.strptime(start.strip(), '%d/%m/%Y').date(),
+                     datetime.strptime(end.strip(), '%d/%m/%Y').date())
+    elif kind == 'airport':
+        if not (value.isalpha() and len(value) == IATA_LENGTH):
+            raise ValueError(f"Invalid IATA code '{value}'")
+        arguments = (value,)
+    else:
+        arguments = (value,)
+
+    return BATCH_OPERATIONS[kind], arguments
+
+
+def read_operations(args):
+    """
+    Yields the batch operations given on the command line, then the ones read from
+    the operations file (one per line, '-' reads stdin). Blank lines and lines
+    starting with '#' are skipped.
+    """
+    yield from args.operations
+
+    if args.file is None:
+        return
+
+    operations_file = sys.stdin if args.file == '-' else open(args.file)
+    try:
+        for line in operations_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if operations_file is not sys.stdin:
+            operations_file.close()
+
+
+def batch_result_record(result):
+    """
+    Converts a query result record into a dictionary of the BATCH_RESULT_COLUMNS
+    """
+    return {column: result[column] for column in BATCH_RESULT_COLUMNS}
+
+
+def error_message(error):
+    """
+    Returns the message of a database error as reported by the driver, without the SQL
+    """
+    return str(getattr(error, 'orig', None) or error)
+
+
+def run_lookups(data_manager, operations):
+    """
+    Runs a list of batch operations. The lookups of the same kind that have a batch
+    getter (see BATCHED_GETTERS) run together, a few queries for all of them,
+    the others one by one.
+    Returns a list of (operation, records, error) tuples, in the order of the operations.
+    A failed batch getter sets the error of every operation it looked up.
+    """
+    parsed = []
+    batch_keys = {}
+    for operation in operations:
+        try:
+            getter, arguments = parse_operation(operation)
+        except ValueError as e:
+            parsed.append((operation, None, None, str(e)))
+            continue
+        if getter in BATCHED_GETTERS:
+            key = arguments[0] if len(arguments) == 1 else arguments
+            batch_keys.setdefault(getter, []).append(key)
+        parsed.append((operation, getter, arguments, None))
+
+    batch_results = {}
+    batch_errors = {}
+    for getter, keys in batch_keys.items():
+        try:
+            batch_results[getter] = getattr(data_manager, BATCHED_GETTERS[getter])(keys)
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            batch_errors[getter] = error_message(e)
+
+    results = []
+    for operation, getter, arguments, error in parsed:
+        records = []
+        if error is None and getter in batch_errors:
+            error = batch_errors[getter]
+        elif error is None:
+            try:
+                if getter in batch_results:
+                    key = arguments[0] if len(arguments) == 1 else arguments
+                    found = batch_results[getter].get(key, [])
+                else:
+                    found = getattr(data_manager, getter)(*arguments)
+                records = [batch_result_record(result) for result in found]
+            except (KeyError, sqlalchemy.exc.SQLAlchemyError) as e:
+                error = error_message(e)
+        results.append((operation, records, error))
+    return results
+
+
+def run_batch(data_manager, args):
+    """
+    Runs every batch operation against the one data manager and writes the results as
+    JSON lines (one object per operation) or CSV (one row per result) to the output.
+    The operations are run BATCH_WINDOW at a time (see run_lookups).
+    Invalid operations are reported in the output and don't stop the batch.
+    """
+    output = sys.stdout if args.output is None else open(args.output, 'w', newline='')
+
+    if args.format == 'csv':
+        writer = csv.DictWriter(output, ['operation'] + BATCH_RESULT_COLUMNS + ['error'])
+        writer.writeheader()
+
+    try:
+        operations = read_operations(args)
+        while True:
+            window = list(islice(operations, BATCH_WINDOW))
+            if not window:
+                break
+
+            for operation, records, error in run_lookups(data_manager, window):
+                if args.format == 'json':
+                    output.write(json.dumps({'operation': operation, 'results': records, 'error': error}) + '\n')
+                elif error is not None:
+                    writer.writerow({'operation': operation, 'error': error})
+                else:
+                    writer.writerows({'operation': operation, **record} for record in records)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def dashboard(data_manager, args):
+    """
+    Renders the dashboard of all the charts, to the output file if one was given
+    """
+    show_dashboard(data_manager, args.output, args.route_map_sample)
+
+
+def render_chart_files(data_manager, args):
+    """
+    Renders every dashboard chart off-screen to its own image file in the output directory
+    (named after its visual type), optionally in parallel worker processes.
+    """
+    os.makedirs(args.output_dir, exist_ok=True)
+    charts_data = fetch_dashboard_data(data_manager)
+
+    visual_methods = route_map_visual_methods(args.route_map_sample)
+    jobs = [(visual_methods[visual_type], chart_data,
+             os.path.join(args.output_dir, f"{visual_type}.{args.format}"))
+            for (_, visual_type), chart_data in zip(DASHBOARD_CHARTS, charts_data)
+            if chart_data is not None]
+    for output in render_charts(jobs, processes=args.processes, format=args.format):
+        print(f"Saved {output}")
+
+
+def load_flights(data_manager, args):
+    """
+    Bulk loads new flights from a CSV or Parquet file, printing the progress,
+    and prints how many rows were loaded and rejected (and why).
+    """
+    report = data_manager.load_flights(args.file, file_format=args.format, chunk_size=args.chunk_size,
+                                       defer_indexes=args.defer_indexes, reject_path=args.rejects,
+                                       progress=print_progress)
+    print()
+    if report is None:
+        return
+
+    print(f"Loaded {report['rows_loaded']:,} of {report['rows_read']:,} rows in {report['seconds']:.2f} seconds "
+          f"({report['rows_per_second']:,.0f} rows/s{', indexes rebuilt' if report['indexes_deferred'] else ''}).")
+    for reason, count in report['rejected_by_reason'].items():
+        print(f"  rejected ({reason}): {count:,}")
+
+
+def write_query_stats(data_manager, path):
+    """
+    Writes the query timing statistics and slow-query log to a file,
+    in the Prometheus text format if the file name ends with .prom, as JSON otherwise.
+    """
+    stats_format = 'prometheus' if path.endswith('.prom') else 'json'
+    try:
+        with open(path, 'w') as stats_file:
+            stats_file.write(data_manager.dump_query_stats(stats_format) or '')
+    except OSError as e:
+        print("Error:", e)
+
+
+def route_map_sample_arg(value):
+    """
+    argparse type of the --route-map-sample option (see route_map_sample_size)
+    """
+    try:
+        return route_map_sample_size(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_args():
+    """
+    Parses the command line arguments.
+    Without a subcommand the app starts the interactive menu.
+    """
+    parser = argparse.ArgumentParser(description="Flight delays explorer")
+    parser.add_argument('--db', default=SQLITE_URI, help="database URI (default: %(default)s)")
+    parser.add_argument('--pool-mode', choices=data.POOL_MODES,
+                        help="how database connections are handled (default: 'persistent' for "
+                             "batch, 'pool' otherwise)")
+    parser.add_argument('--page-size', type=int, default=data.PAGE_SIZE,
+                        help="results shown per page in the menu (default: %(default)s)")
+    parser.add_argument('--stats-output', metavar='FILE',
+                        help="write the query timings and slow-query log to FILE on exit "
+                             "(Prometheus text format for *.prom, JSON otherwise)")
+    parser.add_argument('--slow-query-threshold', type=float, default=instrumentation.SLOW_QUERY_THRESHOLD,
+                        help="seconds above which a query is logged as slow (default: %(default)s)")
+    parser.add_argument('--snapshot', choices=snapshots.SNAPSHOT_MODES,
+                        help="run on a read-only snapshot of the database: copied into memory at "
+                             "startup, or memory-mapped (default: the database file itself)")
+    parser.add_argument('--partition', metavar='URI', action='append',
+                        help="database URI of one partition of the flights, e.g. one file per month; "
+                             "repeat it for every partition (replaces --db)")
+    parser.add_argument('--workers', type=int,
+                        help="worker processes counting the flights for the charts when they run on the "
+                             "flights table, over ranges of flight IDs (default: one query in this process, "
+                             "or one worker per CPU with --partition)")
+    parser.add_argument('--sample', type=float, nargs='?', const=sampling.DEFAULT_SAMPLE_FRACTION,
+                        metavar='FRACTION',
+                        help="estimate the charts from a random sample of this fraction of the flights "
+                             f"(at most {sampling.SAMPLE_MAX_FRACTION}, default %(const)s): faster, "
+                             "with confidence intervals around the delay percentages")
+    parser.add_argument('--confidence', type=float, default=sampling.DEFAULT_CONFIDENCE,
+                        help="confidence level of the sampled intervals (default: %(default)s)")
+
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('menu', help="interactive menu (default)")
+
+    index_parser = subparsers.add_parser('ensure-indexes',
+                                         help="report full table scans and create the missing indexes")
+    index_parser.add_argument('--no-timing', action='store_true',
+                              help="skip timing the queries before and after")
+
+    batch_parser = subparsers.add_parser('batch', help="run many lookups without the menu",
+                                         description="Runs lookups given as 'kind:value' operations, "
+                                                     f"where kind is one of: {', '.join(BATCH_OPERATIONS)}.")
+    batch_parser.add_argument('operations', nargs='*', help="operations, e.g. id:280 date:01/03/2015 airport:LAX")
+    batch_parser.add_argument('-f', '--file', help="file with one operation per line ('-' reads stdin)")
+    batch_parser.add_argument('--format', choices=('json', 'csv'), default='json',
+                              help="output format (default: %(default)s)")
+    batch_parser.add_argument('-o', '--output', help="output file (default: stdout)")
+
+    dashboard_parser = subparsers.add_parser('dashboard', help="render all the charts at once")
+    dashboard_parser.add_argument('-o', '--output', help="image file to save the dashboard to "
+                                                         "(default: show it on screen)")
+    dashboard_parser.add_argument('--route-map-sample', type=route_map_sample_arg, default=ROUTE_MAP_SAMPLE_SIZE,
+                                  metavar='N', help="number of random routes drawn on the route map, "
+                                                    "or 'all' (default: %(default)s)")
+
+    charts_parser = subparsers.add_parser('charts', help="render every chart to an image file, off-screen")
+    charts_parser.add_argument('-d', '--output-dir', default='charts', help="directory (default: %(default)s)")
+    charts_parser.add_argument('--format', choices=('png', 'svg', 'pdf'), default='png',
+                               help="image format (default: %(default)s)")
+    charts_parser.add_argument('-p', '--processes', type=int,
+                               help="render in parallel with this many worker processes")
+    charts_parser.add_argument('--route-map-sample', type=route_map_sample_arg, default=ROUTE_MAP_SAMPLE_SIZE,
+                               metavar='N', help="number of random routes drawn on the route map, "
+                                                 "or 'all' (default: %(default)s)")
+
+    load_parser = subparsers.add_parser('load', help="bulk load new flights from a CSV or Parquet file")
+    load_parser.add_argument('file', help="CSV or Parquet file with the flights table columns")
+    load_parser.add_argument('--format', choices=('csv', 'parquet'),
+                             help="file format (default: from the file extension)")
+    load_parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                             help="rows read and inserted at a time (default: %(default)s)")
+    indexes_group = load_parser.add_mutually_exclusive_group()
+    indexes_group.add_argument('--defer-indexes', action='store_true', default=None,
+                               help="drop the indexes and rebuild them after the load (default: only "
+                                    "if the file has about as many rows as the flights table or more)")
+    indexes_group.add_argument('--keep-indexes', action='store_false', dest='defer_indexes',
+                               help="update the indexes row by row, however large the file")
+    load_parser.add_argument('--rejects', metavar='FILE', help="write the rejected rows to this CSV file")
+    return parser.parse_args()
+
+
+"""
+Subcommand Dispatch Dictionary
+"""
+COMMANDS = {'ensure-indexes': ensure_indexes,
+            'batch': run_batch,
+            'dashboard': dashboard,
+            'charts': render_chart_files,
+            'load': load_flights}
+
+# Connection handling of each subcommand when --pool-mode isn't given.
+# Batch lookups and bulk loads run one after the other on a single long-lived connection,
+# the menu and the dashboard need a pool to run their queries in parallel.
+DEFAULT_POOL_MODES = {'batch': 'persistent', 'load': 'persistent'}
+
+# Subcommands writing their results to stdout. The data manager raises query errors to them,
+# to be reported with the failed operations, instead of printing them in the middle of the output
+HEADLESS_COMMANDS = {'batch'}
+
+
 def main():
+    args = parse_args()
+
     # Create an instance of the Data Object using our SQLite URI
-    data_manager = data.FlightData(SQLITE_URI)
+    pool_mode = args.pool_mode or DEFAULT_POOL_MODES.get(args.command, 'pool')
+    raise_errors = args.command in HEADLESS_COMMANDS
+    if args.partition:
+        data_manager = partitions.PartitionedFlightData(args.partition, workers=args.workers, pool_mode=pool_mode,
+                                                        slow_query_threshold=args.slow_query_threshold,
+                                                        page_size=args.page_size, snapshot=args.snapshot,
+                                                        sample_fraction=args.sample,
+                                                        sample_confidence=args.confidence,
+                                                        raise_errors=raise_errors)
+    else:
+        data_manager = data.FlightData(args.db, pool_mode=pool_mode, slow_query_threshold=args.slow_query_threshold,
+                                       page_size=args.page_size, snapshot=args.snapshot,
+                                       parallel_workers=args.workers, sample_fraction=args.sample,
+                                       sample_confidence=args.confidence, raise_errors=raise_errors)
+    if args.snapshot:
+        snapshots.print_snapshot_report(data_manager.snapshot_info())
+
+    try:
+        if args.command in COMMANDS:
+            COMMANDS[args.command](data_manager, args)
+            return
 
-    # The Main Menu loop
-    while True:
-        choice_func = show_menu_and_get_input()
-        choice_func(data_manager)
+        # The Main Menu loop
+        while True:
+            choice_func = show_menu_and_get_input()
+            choice_func(data_manager)
+    finally:
+        if args.stats_output:
+            write_query_stats(data_manager, args.stats_output)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+"""
+Map background loader for the route map.
+
+The map image is looked up next to this module (not in the current working
+directory) and decoded only once. The decoded pixels are kept in memory and
+saved as a .npy sidecar file as 8-bit RGBA (a quarter of the size of the
+float array imread returns), which later runs memory-map instead of
+decoding the PNG again. Sidecars go to CACHE_DIR (the SKY_SQL_CACHE_DIR
+environment variable, or a directory in the system temp directory), so an
+installed or read-only copy of the app never writes next to its modules.
+Downsampled copies for smaller figures are cached too.
+"""
+import hashlib
+import math
+import os
+import tempfile
+
+import numpy as np
+from matplotlib import pyplot as plt
+
+MAP_IMAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'map.png')
+
+# Directory of the decoded image sidecar files
+CACHE_DIR = os.environ.get('SKY_SQL_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'sky_sql')
+
+# Decoded images by path, and downsampled images by (path, step)
+_images = {}
+_downsampled_images = {}
+
+
+def _sidecar_path(path):
+    """
+    Returns the path of the .npy sidecar file of an image in CACHE_DIR.
+    The name includes a hash of the image's full path, so images with the same
+    file name in different directories don't share a sidecar.
+    """
+    path = os.path.abspath(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    digest = hashlib.sha1(path.encode()).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"{name}-{digest}.npy")
+
+
+def _decode(path):
+    """
+    Decodes an image file into an 8-bit RGBA array, and saves it as a .npy sidecar
+    file (if CACHE_DIR is writable) so the next run can skip decoding it.
+    """
+    image = plt.imread(path)
+    if image.dtype != np.uint8:
+        # imread returns PNGs as floats in [0, 1]
+        image = np.round(image * 255).astype(np.uint8)
+
+    sidecar = _sidecar_path(path)
+    # Written under a temporary name first, so another process never maps a partial file
+    partial_path = f"{sidecar}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(partial_path, 'wb') as sidecar_file:
+            np.save(sidecar_file, image)
+        os.replace(partial_path, sidecar)
+    except OSError:
+        # e.g. a full disk: don't leave the partial file behind
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+    return image
+
+
+def _load_sidecar(sidecar):
+    """
+    Memory-maps a .npy sidecar file. Returns None if it can't be read or doesn't hold
+    an 8-bit RGBA image (e.g. truncated or corrupt), so the image is decoded again.
+    """
+    try:
+        image = np.load(sidecar, mmap_mode='r')
+    except (OSError, ValueError, EOFError):
+        return None
+    if image.dtype != np.uint8 or image.ndim != 3:
+        return None
+    return image
+
+
+def load_map_image(path=MAP_IMAGE_PATH):
+    """
+    Returns the map image as a read-only 8-bit RGBA array, decoding the PNG only if
+    there is no up-to-date, readable .npy sidecar file (a bad one is rewritten).
+    The array is cached for the process.
+    """
+    image = _images.get(path)
+    if image is not None:
+        return image
+
+    sidecar = _sidecar_path(path)
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(path):
+        image = _load_sidecar(sidecar)
+    if image is None:
+        image = _decode(path)
+        image.setflags(write=False)
+
+    _images[path] = image
+    return image
+
+
+def load_map_tile(max_width=None, max_height=None, path=MAP_IMAGE_PATH):
+    """
+    Returns the map image downsampled (by keeping every n-th pixel) so it's no larger
+    than max_width x max_height pixels, e.g. the size of the axes it's drawn on.
+    Downsampled images are cached, so repeated renders at the same size reuse them.
+    """
+    image = load_map_image(path)
+    height, width = image.shape[:2]
+
+    step = max(1,
+               math.ceil(width / max_width) if max_width else 1,
+               math.ceil(height / max_height) if max_height else 1)
+    if step == 1:
+        return image
+
+    key = (path, step)
+    if key not in _downsampled_images:
+        tile = np.ascontiguousarray(image[::step, ::step])
+        tile.setflags(write=False)
+        _downsampled_images[key] = tile
+    return _downsampled_images[key]
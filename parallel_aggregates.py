@@ -0,0 +1,208 @@
+"""
+Chart queries counted in parallel worker processes.
+
+Each chart query has a partial-count version (sql_queries.PARTIAL_COUNT_QUERIES)
+that counts the delayed and all flights per group over the flights with ID in
+(:after_id, :last_id]. ParallelAggregator runs it in a process pool, one task
+per ID range of a database file, each worker reading on its own read-only
+connection, and sums the partial counts per group. The records are then built
+from the summed counts: percentages are computed from the totals the way
+SQLite computes them, and groups come out in the serial query's GROUP BY
+order, so the result is the same as running the serial query at once.
+"""
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from types import MappingProxyType
+
+from snapshots import read_only_uri
+from sql_queries import *
+
+# PRAGMAs applied to the read-only connections of the worker processes
+WORKER_PRAGMAS = {
+    'mmap_size': 268435456,  # 256 MB
+    'cache_size': -65536,  # negative value is in KiB -> 64 MB
+    'temp_store': 'MEMORY',
+}
+
+# Read-only connection of this process to each database file, opened on first use
+_connections = {}
+
+
+def fetch_rows(path, query, params=None):
+    """
+    Runs a query on this process's read-only connection to a database file and returns
+    the rows as tuples. Runs in the worker processes
+    """
+    connection = _connections.get(path)
+    if connection is None:
+        connection = sqlite3.connect(read_only_uri(path), uri=True)
+        for name, value in WORKER_PRAGMAS.items():
+            connection.execute(f"PRAGMA {name}={value}")
+        _connections[path] = connection
+    return connection.execute(query, params or {}).fetchall()
+
+
+def split_id_range(first_id, last_id, num_ranges):
+    """
+    Splits the flight IDs from first_id to last_id into up to num_ranges ranges of
+    (about) the same width, as (after_id, last_id) tuples: each range holds the IDs
+    in (after_id, last_id]
+    """
+    step = max(1, -(-(last_id - first_id + 1) // num_ranges))
+    return [(after_id, min(after_id + step, last_id)) for after_id in range(first_id - 1, last_id, step)]
+
+
+def merge_counts(partials):
+    """
+    Sums partial counts given as lists of (group..., delayed, total) rows.
+    :return: dictionary of group tuple -> [delayed, total]
+    """
+    counts = {}
+    for rows in partials:
+        for row in rows:
+            group_counts = counts.setdefault(tuple(row[:-2]), [0, 0])
+            group_counts[0] += row[-2]
+            group_counts[1] += row[-1]
+    return counts
+
+
+def _sort_key(group):
+    """
+    Orders groups the way SQLite sorts values: NULL, then numbers, text and blobs
+    """
+    return tuple((0, 0) if value is None else
+                 (1, value) if isinstance(value, (int, float)) else
+                 (2, value) if isinstance(value, str) else (3, value)
+                 for value in group)
+
+
+def _percentage(delayed, total):
+    """
+    Percentage of delayed flights, as CAST(delayed * 100.0 / total AS INTEGER) in SQLite
+    """
+    return int(delayed * 100.0 / total)
+
+
+def _count_records(columns):
+    """
+    Returns a function building records of the group columns and both counts
+    """
+    return lambda group, delayed, total: dict(zip(columns, (*group, delayed, total)))
+
+
+def _route_records(group, delayed, total):
+    """
+    Record of QUERY_BY_ORIGIN_DESTINATION_DELAY
+    """
+    origin, destination = group
+    return {'ORIGIN_AIRPORT': origin, 'DESTINATION_AIRPORT': destination,
+            'percentage_delay': _percentage(delayed, total), 'num_of_flights': total}
+
+
+def _route_lat_long_records(group, delayed, total):
+    """
+    Record of QUERY_AIRPORT_ORIGIN_DESTINATION_LAT_LONG
+    """
+    columns = ('origin_airport', 'origin_latitude', 'origin_longitude',
+               'destination_airport', 'destination_latitude', 'destination_longitude')
+    return {**dict(zip(columns, group)), 'percentage_delay': _percentage(delayed, total)}
+
+
+# For every chart query that can be counted in parallel: the name of its partial-count
+# query and the function building a record from a group and its summed counts
+PARALLEL_QUERIES = {
+    QUERY_BY_DELAYED_AND_DEPARTED_FLIGHTS:
+        ('airline_delay', _count_records(('AIRLINE', 'num_of_delayed_flights', 'num_of_flights'))),
+    QUERY_BY_ORIGIN_DESTINATION_DELAY: ('route_delay', _route_records),
+    QUERY_AIRPORT_ORIGIN_DESTINATION_LAT_LONG: ('route_lat_long_delay', _route_lat_long_records),
+    QUERY_DELAYED_FLIGHTS_BY_HOUR:
+        ('hourly_delay', _count_records(('HOUR_OF_DAY', 'num_of_delayed_flights', 'num_of_flights'))),
+    QUERY_DELAYED_FLIGHTS_BY_DAY:
+        ('daily_delay', _count_records(('FLIGHT_DATE', 'num_of_delayed_flights', 'num_of_flights'))),
+}
+
+# Group columns of the lat/long partial counts: the coordinates follow the airport codes
+_GROUP_ORDER = {'route_lat_long_delay': lambda group: (group[0], group[3])}
+
+
+def sorted_counts(query, counts):
+    """
+    Returns the (group, [delayed, total]) items of summed partial counts (see merge_counts)
+    in the GROUP BY order of a chart query (a key of PARALLEL_QUERIES)
+    """
+    order = _GROUP_ORDER.get(PARALLEL_QUERIES[query][0], lambda group: group)
+    try:
+        # Without NULLs or mixed types Python sorts the groups like SQLite
+        # (text by code point, the same order as SQLite's UTF-8 bytes)
+        return sorted(counts.items(), key=lambda item: order(item[0]))
+    except TypeError:
+        return sorted(counts.items(), key=lambda item: _sort_key(order(item[0])))
+
+
+def build_records(query, counts):
+    """
+    Builds the records of a chart query (a key of PARALLEL_QUERIES) from its summed
+    partial counts (see merge_counts), in the query's GROUP BY order. Records are
+    read-only mappings, like the rows of the serial query, so a cached result can't
+    be changed by a caller
+    """
+    make_record = PARALLEL_QUERIES[query][1]
+    return [MappingProxyType(make_record(group, delayed, total))
+            for group, (delayed, total) in sorted_counts(query, counts)]
+
+
+class ParallelAggregator:
+    """
+    Runs partial-count queries over ID ranges of database files in a process pool.
+    """
+
+    def __init__(self, workers=None):
+        """
+        :param workers: number of worker processes (None: one per CPU)
+        """
+        self.workers = workers or os.cpu_count()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """
+        Returns the process pool, starting it on first use
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def count(self, name, tasks, params=None):
+        """
+        Runs a partial-count query (see sql_queries.PARTIAL_COUNT_QUERIES) once per task
+        in the worker processes, and sums the counts.
+        :param tasks: list of (database file, after_id, last_id) tuples: each counts the
+                      flights with ID in (after_id, last_id] of a database
+        :param params: other params of the query (e.g. the dates of the daily counts)
+        :return: dictionary of group tuple -> [delayed, total]
+        """
+        executor = self._get_executor()
+        futures = [executor.submit(fetch_rows, path, PARTIAL_COUNT_QUERIES[name],
+                                   {**(params or {}), 'after_id': after_id, 'last_id': last_id})
+                   for path, after_id, last_id in tasks]
+        return merge_counts(future.result() for future in futures)
+
+    def aggregate(self, query, tasks, params=None):
+        """
+        Runs a chart query (a key of PARALLEL_QUERIES) as partial counts in the worker
+        processes (see count) and returns its records: dictionaries with the columns
+        of the serial query, in its order
+        """
+        return build_records(query, self.count(PARALLEL_QUERIES[query][0], tasks, params))
+
+    def close(self):
+        """
+        Stops the worker processes
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
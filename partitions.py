@@ -0,0 +1,566 @@
+"""
+Flights spread over several SQLite databases (partitions), e.g. one file per year or month.
+
+PartitionedFlightData keeps one data.FlightData per partition database and
+offers the same getters. It reads the flight ID and date range of every
+partition at startup (see refresh_ranges), so the date and ID getters only
+query the partitions that can hold matching flights; the other getters query
+every partition and concatenate their records. The chart queries add up the
+delayed and total counts of the partitions they touch: read from each
+partition's aggregate tables when they can be used, otherwise (or with
+force_raw) counted in parallel worker processes, one task per partition
+(see parallel_aggregates). In the sampled mode (see FlightData's sample_fraction)
+the counts of the partitions' samples are added up instead, and estimated as
+for a single database (see sampling).
+Every partition is a complete flights database (with the airlines and airports
+tables), and flight IDs are unique across the partitions.
+"""
+import heapq
+import time
+from itertools import chain, islice
+
+from sqlalchemy.exc import SQLAlchemyError
+
+import data
+import instrumentation
+import parallel_aggregates
+import sampling
+import snapshots
+from query_cache import QueryCache, MISS, DEFAULT_MAX_BYTES, make_key
+from sql_queries import *
+
+# ID range counted for a partition whose flight ranges couldn't be read: every flight
+ALL_FLIGHT_IDS = (-2 ** 63, 2 ** 63 - 1)
+
+
+def day_key(day, month, year):
+    """
+    Returns the integer date key (see sql_queries.FLIGHT_DATE_KEY) of a day, month and year
+    """
+    return year * 10000 + month * 100 + day
+
+
+class PartitionedFlightData:
+    """
+    Data Access Layer over several partition databases, with the getters of data.FlightData.
+    """
+
+    def __init__(self, db_uris, workers=None, instrument=True,
+                 slow_query_threshold=instrumentation.SLOW_QUERY_THRESHOLD, cache_size=256, cache_ttl=60,
+                 cache_bytes=DEFAULT_MAX_BYTES, page_size=data.PAGE_SIZE, **kwargs):
+        """
+        Opens every partition database.
+        db_uris are the URIs of the partition databases.
+        workers is the number of worker processes counting the flights of the partitions
+        when the chart queries can't use the aggregate tables (None: one per CPU).
+        The other arguments are the ones of data.FlightData, applied to every partition;
+        the query statistics of all the partitions go to one instrumentation.QueryStats.
+        """
+        if not db_uris:
+            raise ValueError("At least one partition database is needed")
+
+        self._stats = instrumentation.QueryStats(slow_query_threshold) if instrument else None
+        self._partitions = [data.FlightData(uri, instrument=instrument, query_stats=self._stats,
+                                            cache_size=cache_size, cache_ttl=cache_ttl, cache_bytes=cache_bytes,
+                                            page_size=page_size,
+                                            **kwargs)
+                            for uri in db_uris]
+        self._paths = [snapshots.database_path(uri) for uri in db_uris]
+        self._page_size = page_size
+        self._cache = QueryCache(cache_size, cache_ttl, data.CACHE_TTLS, cache_bytes) if cache_size else None
+        self._aggregator = parallel_aggregates.ParallelAggregator(workers)
+        self._sample_fraction = self._sample_z = None
+        if kwargs.get('sample_fraction') is not None:
+            self._sample_fraction = sampling.sample_key_limit(kwargs['sample_fraction'])[1]
+            self._sample_z = sampling.confidence_z(kwargs.get('sample_confidence', sampling.DEFAULT_CONFIDENCE))
+        self._ranges = []
+        self.refresh_ranges()
+
+    def refresh_ranges(self):
+        """
+        Reads the flight ID and date range of every partition (see FlightData.get_flight_ranges).
+        Call it after flights were added to a partition database.
+        A partition whose ranges can't be read is queried for every date and ID.
+        """
+        self._ranges = [self._read_ranges(partition) for partition in self._partitions]
+
+    @staticmethod
+    def _read_ranges(partition):
+        """
+        Returns the flight ranges of a partition, or None if they can't be read
+        (also when the partition raises its query errors, see FlightData's raise_errors)
+        """
+        try:
+            return partition.get_flight_ranges()
+        except SQLAlchemyError:
+            return None
+
+    def _holding(self, dates=None, ids=None):
+        """
+        Returns the indexes of the partitions that can hold flights in the given date key
+        range and ID range ((first, last) tuples, None for any). Empty partitions hold none.
+        """
+        indexes = []
+        for index, ranges in enumerate(self._ranges):
+            if ranges is None:
+                indexes.append(index)
+            elif ranges['first_id'] is None:
+                continue
+            elif ((dates is None or (ranges['first_date'] <= dates[1] and dates[0] <= ranges['last_date']))
+                  and (ids is None or (ranges['first_id'] <= ids[1] and ids[0] <= ranges['last_id']))):
+                indexes.append(index)
+        return indexes
+
+    @staticmethod
+    def _concat(results):
+        """
+        Concatenates the records of several partitions, or returns {} if a query failed
+        """
+        records = []
+        for result in results:
+            if isinstance(result, dict):
+                return {}
+            records.extend(result)
+        return records
+
+    def _call(self, indexes, getter, *args, **kwargs):
+        """
+        Calls a FlightData getter on the given partitions, one after the other, and concatenates the records
+        """
+        return self._concat(getattr(self._partitions[index], getter)(*args, **kwargs) for index in indexes)
+
+    def _chain(self, indexes, getter, *args, **kwargs):
+        """
+        Chains the streams of a FlightData iter_ getter over the given partitions
+        """
+        return chain.from_iterable(getattr(self._partitions[index], getter)(*args, **kwargs) for index in indexes)
+
+    def _all(self):
+        return range(len(self._partitions))
+
+    def get_flight_by_id(self, flight_id):
+        """
+        Searches for flight details using flight ID, in the partition holding the ID.
+        If the flight was found, returns a list with a single record.
+        """
+        return self._call(self._holding(ids=(flight_id, flight_id)), 'get_flight_by_id', flight_id)
+
+    def get_delayed_flights_by_airport(self, airport_short_code):
+        """
+        Searches for flight details using airport IATA (3-letter) code, in every partition.
+        """
+        return self._call(self._all(), 'get_delayed_flights_by_airport', airport_short_code)
+
+    def get_delayed_flights_by_airline(self, airline_name):
+        """
+        Searches for flight details using airline name, in every partition.
+        """
+        return self._call(self._all(), 'get_delayed_flights_by_airline', airline_name)
+
+    def get_flights_by_date(self, day, month, year):
+        """
+        Searches for flight details using date (day, month and year), in the partitions holding the date.
+        """
+        key = day_key(day, month, year)
+        return self._call(self._holding(dates=(key, key)), 'get_flights_by_date', day, month, year)
+
+    def _merge_batches(self, keys, lookups):
+        """
+        Merges batch lookups of several partitions, given as (getter, keys of the partition)
+        for each partition: returns a dictionary of key -> list of records with every key,
+        or an empty dictionary if a lookup failed.
+        """
+        grouped = {key: [] for key in keys}
+        for getter, partition_keys in lookups:
+            if not partition_keys:
+                continue
+            results = getter(partition_keys)
+            if not results:
+                return {}
+            for key, records in results.items():
+                grouped[key].extend(records)
+        return grouped
+
+    def get_flights_by_ids(self, flight_ids):
+        """
+        Searches for the flight details of many flight IDs at once, each in the partition holding it.
+        Returns a dictionary of flight ID -> list with the flight's record (empty if not found).
+        """
+        lookups = []
+        for index in self._holding():
+            ranges = self._ranges[index]
+            lookups.append((self._partitions[index].get_flights_by_ids,
+                            [flight_id for flight_id in flight_ids
+                             if ranges is None or ranges['first_id'] <= flight_id <= ranges['last_id']]))
+        return self._merge_batches(flight_ids, lookups)
+
+    def get_delayed_flights_by_airports(self, airport_short_codes):
+        """
+        Searches for the flight details of many airport IATA (3-letter) codes at once, in every partition.
+        Returns a dictionary of IATA code -> list of records.
+        """
+        return self._merge_batches(airport_short_codes, [(partition.get_delayed_flights_by_airports,
+                                                          list(airport_short_codes))
+                                                         for partition in self._partitions])
+
+    def get_flights_by_dates(self, dates):
+        """
+        Searches for the flight details of many dates at once, each in the partitions holding it.
+        :param dates: list of (day, month, year) tuples
+        Returns a dictionary of (day, month, year) -> list of records.
+        """
+        dates = [tuple(date) for date in dates]
+        lookups = []
+        for index in self._holding():
+            ranges = self._ranges[index]
+            lookups.append((self._partitions[index].get_flights_by_dates,
+                            [date for date in dates
+                             if ranges is None or ranges['first_date'] <= day_key(*date) <= ranges['last_date']]))
+        return self._merge_batches(dates, lookups)
+
+    def _execute_page_query(self, indexes, getter, args, after_id, page_size):
+        """
+        Runs a keyset-paginated getter on the given partitions (those with flights above after_id)
+        and merges their pages: returns the next page_size records in flight ID order.
+        """
+        page_size = page_size or self._page_size
+        pages = []
+        for index in indexes:
+            ranges = self._ranges[index]
+            if ranges is not None and ranges['last_id'] <= after_id:
+                continue
+            page = getattr(self._partitions[index], getter)(*args, after_id=after_id, page_size=page_size)
+            if isinstance(page, dict):
+                return {}
+            pages.append(page)
+        return list(islice(heapq.merge(*pages, key=lambda record: record['FLIGHT_ID']), page_size))
+
+    def _iter_pages(self, indexes, getter, args, page_size):
+        """
+        Yields the merged pages of a keyset-paginated getter one at a time (see FlightData._iter_pages)
+        """
+        page_size = page_size or self._page_size
+        after_id = 0
+        while True:
+            page = self._execute_page_query(indexes, getter, args, after_id, page_size)
+            # An error ({}) or no more flights
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            after_id = page[-1]['FLIGHT_ID']
+
+    def get_delayed_flights_by_airport_page(self, airport_short_code, after_id=0, page_size=None):
+        """
+        Searches for one page of flight details using airport IATA (3-letter) code, over every partition
+        (see FlightData.get_delayed_flights_by_airport_page).
+        """
+        return self._execute_page_query(self._all(), 'get_delayed_flights_by_airport_page',
+                                        (airport_short_code,), after_id, page_size)
+
+    def get_flights_by_date_page(self, day, month, year, after_id=0, page_size=None):
+        """
+        Searches for one page of flight details using date (day, month and year), over the partitions
+        holding the date (see FlightData.get_flights_by_date_page).
+        """
+        key = day_key(day, month, year)
+        return self._execute_page_query(self._holding(dates=(key, key)), 'get_flights_by_date_page',
+                                        (day, month, year), after_id, page_size)
+
+    def iter_delayed_flights_by_airport_pages(self, airport_short_code, page_size=None):
+        """
+        Yields the flight details for an airport IATA (3-letter) code page by page,
+        each page fetched only when it's requested.
+        """
+        return self._iter_pages(self._all(), 'get_delayed_flights_by_airport_page', (airport_short_code,),
+                                page_size)
+
+    def iter_flights_by_date_pages(self, day, month, year, page_size=None):
+        """
+        Yields the flight details for a date (day, month and year) page by page,
+        each page fetched only when it's requested.
+        """
+        key = day_key(day, month, year)
+        return self._iter_pages(self._holding(dates=(key, key)), 'get_flights_by_date_page', (day, month, year),
+                                page_size)
+
+    def get_delay_and_departure_time(self):
+        """
+        Searches for flight delay and departure time, in every partition.
+        """
+        return self._call(self._all(), 'get_delay_and_departure_time')
+
+    def get_flights_by_date_range(self, start, end):
+        """
+        Searches for flight details from the start date to the end date (datetime.date,
+        both included), in the partitions holding those dates.
+        """
+        dates = (data.date_key(start), data.date_key(end))
+        return self._call(self._holding(dates=dates), 'get_flights_by_date_range', start, end)
+
+    def iter_query(self, query, params=None, batch_size=None):
+        """
+        Streams the records of an SQL query run on every partition, one partition after the other
+        (see FlightData.iter_query).
+        """
+        return self._chain(self._all(), 'iter_query', query, params, batch_size)
+
+    def iter_flights_by_date_range(self, start, end, batch_size=None):
+        """
+        Streams the flight details from the start date to the end date (both included),
+        from the partitions holding those dates.
+        """
+        dates = (data.date_key(start), data.date_key(end))
+        return self._chain(self._holding(dates=dates), 'iter_flights_by_date_range', start, end, batch_size)
+
+    def iter_flights_by_date(self, day, month, year, batch_size=None):
+        """
+        Streams the flight details for a date (day, month and year), from the partitions holding the date.
+        """
+        key = day_key(day, month, year)
+        return self._chain(self._holding(dates=(key, key)), 'iter_flights_by_date', day, month, year, batch_size)
+
+    def iter_delay_and_departure_time(self, batch_size=None):
+        """
+        Streams the flight delay and departure time of every flight of every partition.
+        """
+        return self._chain(self._all(), 'iter_delay_and_departure_time', batch_size)
+
+    def _aggregate_counts(self, name, params, indexes):
+        """
+        Sums the counts of the partitions' aggregate tables, or returns None if
+        a partition can't use its aggregate tables
+        """
+        partials = []
+        for index in indexes:
+            counts = self._partitions[index].get_delay_counts(name, params)
+            if counts is None:
+                return None
+            partials.append(counts)
+        return parallel_aggregates.merge_counts(partials)
+
+    def _sample_counts(self, name, params, indexes):
+        """
+        Sums the counts of the partitions' samples, or returns None if a partition
+        can't use its sample
+        """
+        partials = []
+        for index in indexes:
+            counts = self._partitions[index].get_sample_counts(name, params)
+            if counts is None:
+                return None
+            partials.append(counts)
+        return parallel_aggregates.merge_counts(partials)
+
+    def _count_in_workers(self, name, params, indexes):
+        """
+        Counts the flights of the partitions in the worker processes, one task per partition
+        """
+        tasks = []
+        for index in indexes:
+            ranges = self._ranges[index]
+            after_id, last_id = ALL_FLIGHT_IDS if ranges is None else (ranges['first_id'] - 1, ranges['last_id'])
+            tasks.append((self._paths[index], after_id, last_id))
+
+        start = time.perf_counter()
+        counts = self._aggregator.count(name, tasks, params)
+        if self._stats is not None:
+            self._stats.record_execute(f'parallel_{name}', time.perf_counter() - start)
+        return counts
+
+    def _execute_chart_query(self, query, force_raw, columnar, params=None, indexes=None):
+        """
+        Runs a chart query (see parallel_aggregates.PARALLEL_QUERIES) over the given partitions
+        (all of them if None), adding up their counts. The counts come from the aggregate tables,
+        or from the flights tables if force_raw is set or the aggregate tables can't be used.
+        In the sampled mode they come from the samples, and the result is an estimate.
+        A forced raw recompute bypasses the result cache.
+        """
+        indexes = self._all() if indexes is None else indexes
+        sampled = not force_raw and self._sample_fraction is not None
+        key = make_key(query, params, ('sampled' if sampled else None, 'columnar' if columnar else None))
+        if not force_raw and self._cache is not None:
+            result = self._cache.get(key)
+            if result is not MISS:
+                return result
+
+        name = parallel_aggregates.PARALLEL_QUERIES[query][0]
+        try:
+            counts = self._sample_counts(name, params, indexes) if sampled else None
+            if sampled and counts is None:
+                # A partition can't use its sample: answer exactly from now on
+                self._sample_fraction = None
+                sampled = False
+            if counts is None and not force_raw:
+                counts = self._aggregate_counts(name, params, indexes)
+            if counts is None:
+                counts = self._count_in_workers(name, params, indexes)
+        except Exception as e:
+            print("Error:", e)
+            return {}
+
+        if sampled:
+            records = sampling.estimate_records(query, counts, self._sample_fraction, self._sample_z)
+            dtypes = {**data.QUERY_DTYPES[query], **data.ESTIMATE_DTYPES}
+        else:
+            records = parallel_aggregates.build_records(query, counts)
+            dtypes = data.QUERY_DTYPES[query]
+        result = data.records_to_columns(records, dtypes) if columnar else records
+        if force_raw or self._cache is None:
+            return result
+        return self._cache.set(key, result)
+
+    def get_delayed_and_departed_flights_by_airline(self, force_raw=False, columnar=False):
+        """
+        Counts the delayed and departed flights of each airline over every partition.
+        force_raw counts them from the flights tables instead of the aggregate tables.
+        columnar returns a dictionary of NumPy arrays (one per column) instead of records.
+        """
+        return self._execute_chart_query(QUERY_BY_DELAYED_AND_DEPARTED_FLIGHTS, force_raw, columnar)
+
+    def get_delayed_flights_by_hour(self, force_raw=False, columnar=False):
+        """
+        Counts the delayed flights and all flights for each hour of the day over every partition.
+        force_raw counts them from the flights tables instead of the aggregate tables.
+        columnar returns a dictionary of NumPy arrays (one per column) instead of records.
+        """
+        return self._execute_chart_query(QUERY_DELAYED_FLIGHTS_BY_HOUR, force_raw, columnar)
+
+    def get_delayed_flights_by_day(self, start, end, force_raw=False, columnar=False):
+        """
+        Counts the delayed flights and all flights of each day from the start date to the
+        end date (both included), over the partitions holding those dates.
+        force_raw counts them from the flights tables instead of the aggregate tables.
+        columnar returns a dictionary of NumPy arrays (one per column) instead of records.
+        """
+        params = {'start': data.date_key(start), 'end': data.date_key(end)}
+        return self._execute_chart_query(QUERY_DELAYED_FLIGHTS_BY_DAY, force_raw, columnar, params,
+                                         self._holding(dates=(params['start'], params['end'])))
+
+    def get_origin_destination_airport_delay(self, force_raw=False, columnar=False):
+        """
+        Counts the flights and the percentage of delayed flights of each route over every partition.
+        force_raw counts them from the flights tables instead of the aggregate tables.
+        columnar returns a dictionary of NumPy arrays (one per column) instead of records.
+        """
+        return self._execute_chart_query(QUERY_BY_ORIGIN_DESTINATION_DELAY, force_raw, columnar)
+
+    def get_origin_destination_latitude_longitude(self, force_raw=False, columnar=False):
+        """
+        Returns the airport coordinates and the percentage of delayed flights of each route over
+        every partition.
+        force_raw counts them from the flights tables instead of the aggregate tables.
+        columnar returns a dictionary of NumPy arrays (one per column) instead of records.
+        """
+        return self._execute_chart_query(QUERY_AIRPORT_ORIGIN_DESTINATION_LAT_LONG, force_raw, columnar)
+
+    def ensure_indexes(self, measure=True):
+        """
+        Runs the index advisor on every partition and returns the list of their reports
+        (see FlightData.ensure_indexes)
+        """
+        return [partition.ensure_indexes(measure) for partition in self._partitions]
+
+    def refresh_aggregates(self, rebuild=False):
+        """
+        Brings the aggregate tables of every partition up to date. Returns the number of
+        flight IDs aggregated, or None if a refresh failed.
+        """
+        total = 0
+        for partition in self._partitions:
+            count = partition.refresh_aggregates(rebuild)
+            if count is None:
+                return None
+            total += count
+        return total
+
+    def refresh_sample(self, rebuild=False):
+        """
+        Brings the sample of every partition up to date. Returns the number of
+        flight IDs covered, or None if a refresh failed.
+        """
+        total = 0
+        for partition in self._partitions:
+            count = partition.refresh_sample(rebuild)
+            if count is None:
+                return None
+            total += count
+        return total
+
+    def load_flights(self, path, *args, **kwargs):
+        """
+        Flights are loaded into one partition database at a time, with its own FlightData
+        (followed by refresh_ranges), so this only prints an error and returns None.
+        """
+        print("Error: load flights into a partition database, not into the partitioned data")
+        return None
+
+    def invalidate_cache(self, query=None):
+        """
+        Drops the cached results of a query, or every cached result if query is None,
+        in the merged results and in every partition
+        """
+        if self._cache is not None:
+            self._cache.invalidate(query)
+        for partition in self._partitions:
+            partition.invalidate_cache(query)
+
+    def cache_stats(self):
+        """
+        Returns the result cache counters of the merged results and of every partition, added up,
+        or None if disabled
+        """
+        if self._cache is None:
+            return None
+        stats = self._cache.stats()
+        for partition in self._partitions:
+            for name, value in partition.cache_stats().items():
+                stats[name] += value
+        return stats
+
+    def query_stats(self):
+        """
+        Returns the per-query timing statistics of all the partitions, or None if instrumentation is disabled
+        """
+        return self._stats.snapshot() if self._stats is not None else None
+
+    def slow_queries(self):
+        """
+        Returns the slow-query log of all the partitions
+        """
+        return self._stats.slow_queries() if self._stats is not None else []
+
+    def dump_query_stats(self, format='json'):
+        """
+        Returns the query statistics as a JSON document or, with format='prometheus',
+        in the Prometheus text format. Returns None if instrumentation is disabled.
+        """
+        if self._stats is None:
+            return None
+        if format == 'prometheus':
+            return self._stats.to_prometheus()
+        return self._stats.to_json()
+
+    def snapshot_info(self):
+        """
+        Returns the snapshot report of all the partitions (load seconds and bytes added up),
+        or None if the queries run on the databases themselves
+        """
+        reports = [partition.snapshot_info() for partition in self._partitions]
+        if reports[0] is None:
+            return None
+        return {'mode': reports[0]['mode'], 'seconds': sum(report['seconds'] for report in reports),
+                'bytes': sum(report['bytes'] for report in reports)}
+
+    def close(self):
+        """
+        Closes every partition and stops the worker processes
+        """
+        for partition in self._partitions:
+            partition.close()
+        self._aggregator.close()
+
+    def __del__(self):
+        if hasattr(self, '_aggregator'):
+            self.close()
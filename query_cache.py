@@ -0,0 +1,173 @@
+"""
+In-process result cache for FlightData queries.
+
+Results are keyed on (query, params), evicted least-recently-used once the
+cache holds too many results or too many (estimated) bytes, and expire after
+a per-query time to live. A result larger than the whole byte budget is
+returned without being cached, so one big row-returning lookup can't push
+out every other result or pin its rows in memory. Cached results are
+made immutable before they are stored (see freeze_result), so a caller can't
+change the result another caller gets back.
+"""
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+
+from instrumentation import estimate_bytes, estimate_column_bytes
+
+# Time to live (seconds) of a cached result, unless overridden per query
+DEFAULT_TTL = 60
+
+# Estimated bytes of the results held by a cache (see result_bytes), unless told otherwise
+DEFAULT_MAX_BYTES = 64 * 2 ** 20
+
+# Python object overhead (bytes) of a cached record (its row object and value tuple), of each
+# value of a record (the value object and its slot), and of each value of an object column,
+# on top of the value bytes estimated by instrumentation. Measured with tracemalloc on the
+# flights queries, the estimates stay within ~15% of the memory held
+RECORD_OVERHEAD = 100
+VALUE_OVERHEAD = 24
+OBJECT_VALUE_OVERHEAD = 57
+
+# Returned by QueryCache.get when there is no (live) entry for the key
+MISS = object()
+
+
+def _freeze(value):
+    """
+    Converts a query parameter into a hashable value (lists become tuples)
+    """
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+def make_key(query, params, variant=None):
+    """
+    Returns the cache key for a query and its params dictionary (or None).
+    variant tells apart different result formats of the same query (e.g. columnar).
+    """
+    return query, _freeze(params) if params is not None else None, variant
+
+
+def freeze_result(result):
+    """
+    Returns an immutable version of a query result: a list of SQLAlchemy rows
+    (which are read-only themselves) becomes a tuple, records built as plain
+    dictionaries (e.g. merged from several databases) become read-only mappings,
+    and a dictionary of NumPy columns becomes a read-only mapping of read-only arrays.
+    """
+    if isinstance(result, dict):
+        for column in result.values():
+            column.setflags(write=False)
+        return MappingProxyType(result)
+    return tuple(MappingProxyType(record) if isinstance(record, dict) else record for record in result)
+
+
+def result_bytes(result):
+    """
+    Returns the estimated memory (bytes) held by a query result: records or a dictionary
+    of NumPy columns
+    """
+    if isinstance(result, (dict, MappingProxyType)):
+        return estimate_column_bytes(result) + sum(len(values) * OBJECT_VALUE_OVERHEAD
+                                                   for values in result.values() if values.dtype == object)
+    if not result:
+        return 0
+    return estimate_bytes(result) + len(result) * (RECORD_OVERHEAD + len(result[0]) * VALUE_OVERHEAD)
+
+
+class QueryCache:
+    """
+    A size-bounded LRU cache with per-query TTLs and hit/miss/eviction counters.
+    """
+
+    def __init__(self, max_entries=256, default_ttl=DEFAULT_TTL, ttls=None, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param max_entries: maximum number of cached results
+        :param default_ttl: time to live (seconds) of a cached result
+        :param ttls: dictionary of query -> time to live, overriding default_ttl
+        :param max_bytes: maximum estimated bytes of the cached results (see result_bytes)
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._default_ttl = default_ttl
+        self._ttls = dict(ttls or {})
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.uncached = 0
+
+    def get(self, key):
+        """
+        Returns the cached result for the key, or MISS if it's not cached or has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                    self._bytes -= entry[2]
+                self.misses += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, result):
+        """
+        Caches a result and returns its immutable version (see freeze_result).
+        A result larger than max_bytes is only frozen, not cached.
+        """
+        result = freeze_result(result)
+        num_bytes = result_bytes(result)
+        ttl = self._ttls.get(key[0], self._default_ttl)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            if num_bytes > self._max_bytes:
+                self.uncached += 1
+                return result
+
+            self._entries[key] = (time.monotonic() + ttl, result, num_bytes)
+            self._bytes += num_bytes
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self.evictions += 1
+        return result
+
+    def invalidate(self, query=None):
+        """
+        Drops every cached result of the given query, or the whole cache if query is None
+        """
+        with self._lock:
+            if query is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for key in [key for key in self._entries if key[0] == query]:
+                self._bytes -= self._entries.pop(key)[2]
+
+    def stats(self):
+        """
+        Returns the cache counters as a dictionary
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self._max_entries,
+                'bytes': self._bytes,
+                'max_bytes': self._max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'uncached': self.uncached,
+            }
@@ -0,0 +1,153 @@
+"""
+Registry of compiled SQL queries.
+
+Every query of sql_queries (REGISTERED_QUERIES, AGGREGATE_QUERIES and SAMPLE_QUERIES) is
+wrapped once into a SQLAlchemy text() construct with typed bind params (see
+BIND_TYPES), available by name and by SQL string. Executing the same construct
+every time skips re-parsing the string, and lets SQLAlchemy find its compiled
+form in the engine's compiled cache; SQLAlchemy 2.x only executes such
+constructs anyway. Other statements (batch and ad-hoc queries) are compiled on
+first use and kept in a bounded LRU cache.
+The first run of a query declares its result columns (text().columns()), after
+which SQLAlchemy also caches the result metadata instead of rebuilding it from
+the cursor description on every execution. Queries returning the same column
+name twice (e.g. flights.* with airlines.airline) aren't declared: declared
+duplicates are ambiguous, where the cursor description lets the last one win.
+On the SQLite side, each DBAPI connection keeps the prepared statements of
+the last STATEMENT_CACHE_SIZE SQL strings (see FlightData's connect_args),
+sized so the registered queries stay prepared next to the batch queries.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import Integer, String, bindparam, column, text
+from sqlalchemy.sql.elements import TextClause
+
+from sql_queries import REGISTERED_QUERIES, AGGREGATE_QUERIES, SAMPLE_QUERIES
+
+# Type of each bind param used in the queries. Params that are not listed are left untyped
+BIND_TYPES = {
+    'id': Integer(),
+    'IATA': String(),
+    'airline': String(),
+    'day': Integer(),
+    'month': Integer(),
+    'year': Integer(),
+    'after_id': Integer(),
+    'page_size': Integer(),
+    'start': Integer(),
+    'end': Integer(),
+    'last_id': Integer(),
+    'max_id': Integer(),
+    'key_range': Integer(),
+    'keep': Integer(),
+    'key_limit': Integer(),
+}
+
+# Number of statements prepared and kept by each SQLite connection (sqlite3's cached_statements)
+STATEMENT_CACHE_SIZE = 256
+
+# Number of unregistered statements kept compiled
+ADHOC_CACHE_SIZE = 256
+
+# Bind params in an SQL string (:name), the same way text() finds them
+BIND_PARAM = re.compile(r'(?<![:\w\x5c]):(\w+)(?!:)')
+
+
+def compile_query(query):
+    """
+    Returns the text() construct of an SQL string, with the known bind params typed
+    """
+    names = dict.fromkeys(BIND_PARAM.findall(query))
+    return text(query).bindparams(*(bindparam(name, type_=BIND_TYPES[name])
+                                    for name in names if name in BIND_TYPES))
+
+
+class QueryRegistry:
+    """
+    Compiled queries by name and by SQL string.
+    """
+
+    def __init__(self, queries=None, adhoc_cache_size=ADHOC_CACHE_SIZE):
+        """
+        :param queries: dictionary of name -> SQL string (None registers every sql_queries query)
+        :param adhoc_cache_size: number of unregistered statements kept compiled
+        """
+        if queries is None:
+            queries = {**REGISTERED_QUERIES, **AGGREGATE_QUERIES, **SAMPLE_QUERIES}
+        self._by_name = {name: compile_query(query) for name, query in queries.items()}
+        self._by_query = {query: self._by_name[name] for name, query in queries.items()}
+        self._adhoc = OrderedDict()
+        self._adhoc_cache_size = adhoc_cache_size
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        """
+        Returns the compiled query registered under a name
+        """
+        return self._by_name[name]
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def names(self):
+        """
+        Returns the names of the registered queries
+        """
+        return list(self._by_name)
+
+    def statement(self, query):
+        """
+        Returns the compiled version of an SQL string: the registered one,
+        or one compiled now and kept for the next calls
+        """
+        compiled = self._by_query.get(query)
+        if compiled is not None:
+            return compiled
+
+        with self._lock:
+            compiled = self._adhoc.get(query)
+            if compiled is not None:
+                self._adhoc.move_to_end(query)
+                return compiled
+
+        compiled = compile_query(query)
+        with self._lock:
+            self._adhoc[query] = compiled
+            while len(self._adhoc) > self._adhoc_cache_size:
+                self._adhoc.popitem(last=False)
+        return compiled
+
+    def execute(self, connection, query, params=None, **execution_options):
+        """
+        Executes the compiled version of an SQL string on a connection and returns the result.
+        The first result of a query declares its columns, for the next executions.
+        :param execution_options: statement execution options, e.g. stream_results=True
+        """
+        statement = self.statement(query)
+        result = connection.execute(statement.execution_options(**execution_options) if execution_options
+                                    else statement, params or {})
+        if isinstance(statement, TextClause) and result.returns_rows:
+            columns = list(result.keys())
+            if len(set(columns)) == len(columns):
+                self._declare_columns(query, statement, columns)
+        return result
+
+    def _declare_columns(self, query, statement, columns):
+        """
+        Replaces a compiled query with one that declares its result columns (in order)
+        """
+        described = statement.columns(*(column(name) for name in columns))
+        with self._lock:
+            if self._by_query.get(query) is statement:
+                self._by_query[query] = described
+                for name, compiled in self._by_name.items():
+                    if compiled is statement:
+                        self._by_name[name] = described
+            elif self._adhoc.get(query) is statement:
+                self._adhoc[query] = described
+
+
+# The registry of the sql_queries queries, shared by every FlightData
+QUERIES = QueryRegistry()
@@ -0,0 +1,91 @@
+"""
+Sparse origin x destination route matrix.
+
+Airports are integer-encoded and every route is stored as one
+(origin index, destination index, value) coordinate, so memory grows with
+the number of routes rather than with the square of the number of airports.
+A dense grid is only built for the airports that are actually drawn.
+"""
+import numpy as np
+
+
+class RouteMatrix:
+    """
+    Route values (e.g. percentage delay) in coordinate form.
+    airports holds the airport codes, sorted, and origin_index / destination_index
+    are positions in airports, one per route.
+    """
+
+    def __init__(self, airports, origin_index, destination_index, values, flights=None):
+        self.airports = airports
+        self.origin_index = origin_index
+        self.destination_index = destination_index
+        self.values = values
+        self.flights = flights
+
+    @classmethod
+    def from_routes(cls, origin, destination, values, flights=None):
+        """
+        Builds the matrix from per-route columns.
+        :param origin: origin airport code of each route
+        :param destination: destination airport code of each route
+        :param values: value of each route
+        :param flights: number of flights of each route (optional, used to rank airports by traffic)
+        """
+        origin = np.asarray(origin)
+        airports, codes = np.unique(np.concatenate([origin, np.asarray(destination)]), return_inverse=True)
+        return cls(airports, codes[:len(origin)], codes[len(origin):], np.asarray(values),
+                   None if flights is None else np.asarray(flights))
+
+    def __len__(self):
+        """
+        Returns the number of routes
+        """
+        return len(self.values)
+
+    def airport_traffic(self):
+        """
+        Returns the traffic of each airport: its number of departing and arriving flights,
+        or its number of routes if the flight counts are not known.
+        """
+        weights = self.flights
+        size = len(self.airports)
+        return (np.bincount(self.origin_index, weights=weights, minlength=size) +
+                np.bincount(self.destination_index, weights=weights, minlength=size))
+
+    def top_airports(self, k):
+        """
+        Returns a new matrix with only the routes between the k busiest airports
+        (see airport_traffic). The airports stay in code order.
+        """
+        if k is None or k >= len(self.airports):
+            return self
+
+        keep = np.zeros(len(self.airports), dtype=bool)
+        keep[np.argsort(self.airport_traffic(), kind='stable')[::-1][:k]] = True
+        routes = keep[self.origin_index] & keep[self.destination_index]
+
+        # Re-number the kept airports 0..k-1
+        new_index = np.cumsum(keep) - 1
+        return RouteMatrix(self.airports[keep], new_index[self.origin_index[routes]],
+                           new_index[self.destination_index[routes]], self.values[routes],
+                           None if self.flights is None else self.flights[routes])
+
+    def to_dense(self, fill=0.0):
+        """
+        Returns the origin x destination grid as a dense float array,
+        with fill where there is no route
+        """
+        size = len(self.airports)
+        grid = np.full((size, size), fill, dtype=float)
+        grid[self.origin_index, self.destination_index] = self.values
+        return grid
+
+    def to_sparse(self):
+        """
+        Returns the matrix as a scipy.sparse COO matrix (needs scipy)
+        """
+        from scipy.sparse import coo_matrix
+
+        size = len(self.airports)
+        return coo_matrix((self.values, (self.origin_index, self.destination_index)), shape=(size, size))
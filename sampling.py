@@ -0,0 +1,154 @@
+"""
+Approximate chart queries over a stored random sample of the flights.
+
+flight_sample (see sql_queries.SAMPLE_TABLES) keeps a Bernoulli sample of the
+flights: every flight is kept with probability SAMPLE_MAX_FRACTION, along with
+the columns the chart queries count and a random SAMPLE_KEY in
+[0, SAMPLE_KEY_RANGE). The sampled flights whose key is below a limit are a
+Bernoulli sample of any smaller fraction of the flights, and since the table
+is ordered by SAMPLE_KEY a query only reads those rows: the fraction trades
+accuracy for latency. Like the aggregate tables, the sample is refreshed
+incrementally with the flights inserted since the last refresh.
+
+The counts of a sample are scaled up by its fraction to estimate the counts of
+all flights, and every delay percentage comes with a Wilson score confidence
+interval computed from the sampled flights of its group (the finite population
+correction is left out, which only widens the interval).
+"""
+import math
+from statistics import NormalDist
+from types import MappingProxyType
+
+from sqlalchemy import text
+
+from aggregates import table_names
+from parallel_aggregates import PARALLEL_QUERIES, sorted_counts
+from query_registry import QUERIES
+from sql_queries import (SAMPLE_TABLES, QUERY_MAX_FLIGHT_ID, QUERY_SAMPLE_STATE, QUERY_SAMPLE_SET_STATE,
+                         QUERY_SAMPLE_REFRESH)
+
+# Fraction of the flights kept in the sample table: the largest fraction a sampled query can use
+SAMPLE_MAX_FRACTION = 0.05
+
+# Sampled flights get a random SAMPLE_KEY below this, so a query can use any fraction of the sample
+SAMPLE_KEY_RANGE = 1000000
+
+# Fraction of the flights used by the sampled queries unless told otherwise
+DEFAULT_SAMPLE_FRACTION = 0.01
+
+# Confidence level of the intervals unless told otherwise
+DEFAULT_CONFIDENCE = 0.95
+
+
+def sample_key_limit(fraction):
+    """
+    Returns the SAMPLE_KEY limit selecting a fraction of the flights, and the fraction
+    it actually selects (rounded to a whole key).
+    Raises ValueError if the fraction is not in (0, SAMPLE_MAX_FRACTION].
+    """
+    if not 0 < fraction <= SAMPLE_MAX_FRACTION:
+        raise ValueError(f"The sample fraction has to be above 0 and at most {SAMPLE_MAX_FRACTION}, not {fraction}")
+    key_limit = max(1, round(fraction / SAMPLE_MAX_FRACTION * SAMPLE_KEY_RANGE))
+    return key_limit, SAMPLE_MAX_FRACTION * key_limit / SAMPLE_KEY_RANGE
+
+
+def confidence_z(confidence):
+    """
+    Returns the standard normal quantile of a two-sided confidence level, e.g. 1.96 for 0.95.
+    Raises ValueError if the level is not in (0, 1).
+    """
+    if not 0 < confidence < 1:
+        raise ValueError(f"The confidence level has to be between 0 and 1, not {confidence}")
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def create_sample_tables(connection):
+    """
+    Creates the sample tables if they don't exist yet
+    """
+    for ddl in SAMPLE_TABLES.values():
+        connection.execute(text(ddl))
+
+
+def sample_up_to_date(connection):
+    """
+    Returns whether the sample tables exist and hold a sample of every flight taken at
+    SAMPLE_MAX_FRACTION, without writing anything. A read-only database can't create
+    or refresh the sample, so its stored sample is only used when it passes this check.
+    """
+    if not set(SAMPLE_TABLES) <= table_names(connection):
+        return False
+    state = QUERIES.execute(connection, QUERY_SAMPLE_STATE).mappings().first()
+    if state is None or state['keep_per_million'] != round(SAMPLE_MAX_FRACTION * 1000000):
+        return False
+    max_id = connection.execute(QUERIES.statement(QUERY_MAX_FLIGHT_ID)).scalar() or 0
+    return state['last_flight_id'] >= max_id
+
+
+def refresh_sample(connection):
+    """
+    Samples the flights inserted since the last refresh into the sample table.
+    The connection has to be inside a transaction (e.g. from engine.begin()),
+    so the sample and the refresh state are updated atomically.
+    A sample kept at another rate than SAMPLE_MAX_FRACTION is rebuilt.
+    :param connection: SQLAlchemy connection
+    :return: the number of flight IDs covered by this refresh (0 if already up to date)
+    """
+    create_sample_tables(connection)
+
+    keep = round(SAMPLE_MAX_FRACTION * 1000000)
+    state = QUERIES.execute(connection, QUERY_SAMPLE_STATE).mappings().first()
+    if state is not None and state['keep_per_million'] != keep:
+        return rebuild_sample(connection)
+    last_id = state['last_flight_id'] if state is not None else 0
+    max_id = connection.execute(QUERIES.statement(QUERY_MAX_FLIGHT_ID)).scalar() or 0
+    if max_id <= last_id:
+        return 0
+
+    params = {'last_id': last_id, 'max_id': max_id, 'keep': keep, 'key_range': SAMPLE_KEY_RANGE}
+    connection.execute(QUERIES.statement(QUERY_SAMPLE_REFRESH), params)
+    connection.execute(QUERIES.statement(QUERY_SAMPLE_SET_STATE), params)
+    return max_id - last_id
+
+
+def rebuild_sample(connection):
+    """
+    Drops the sample tables and draws a new sample of the whole flights table
+    """
+    for name in SAMPLE_TABLES:
+        connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+    return refresh_sample(connection)
+
+
+def wilson_interval(delayed, total, z):
+    """
+    Returns the Wilson score interval of the percentage of delayed flights, given
+    the delayed and total sampled flights of a group: (low, high) percentages
+    """
+    if not total:
+        return 0.0, 100.0
+    # Capped, since the airline counts take the total from the departed flights only
+    share = min(delayed / total, 1.0)
+    center = share + z * z / (2 * total)
+    spread = z * math.sqrt(share * (1 - share) / total + z * z / (4 * total * total))
+    scale = 1 + z * z / total
+    return max(0.0, (center - spread) / scale * 100), min(100.0, (center + spread) / scale * 100)
+
+
+def estimate_records(query, counts, fraction, z):
+    """
+    Builds the records of a chart query (a key of parallel_aggregates.PARALLEL_QUERIES)
+    from the summed counts of a sample taken at the given fraction. Counts are scaled up
+    to estimates for all flights, and every record gets the confidence interval of its
+    delay percentage (percentage_delay_low, percentage_delay_high) and its number of
+    sampled flights (sampled_flights). Records are read-only mappings, so a cached
+    estimate can't be changed by a caller.
+    """
+    make_record = PARALLEL_QUERIES[query][1]
+    records = []
+    for group, (delayed, total) in sorted_counts(query, counts):
+        record = make_record(group, round(delayed / fraction), round(total / fraction))
+        record['percentage_delay_low'], record['percentage_delay_high'] = wilson_interval(delayed, total, z)
+        record['sampled_flights'] = total
+        records.append(MappingProxyType(record))
+    return records
@@ -0,0 +1,108 @@
+"""
+Read-only snapshots of the flights database for analytics sessions.
+
+'memory' opens the database file read-only and copies it into an in-memory
+database with SQLite's backup API, so once loaded no query touches the disk.
+'mmap' opens the file itself read-only and immutable (SQLite skips locking
+and change detection) with an mmap_size covering the whole file, and reads
+the file through once so its pages are in the OS page cache before the
+first query. An immutable database is read without its -wal file, so the
+'mmap' mode only sees changes that were checkpointed into the file.
+Neither mode writes to the file, and neither sees its later changes.
+"""
+import os
+import sqlite3
+import sys
+import time
+from urllib.parse import quote
+
+from sqlalchemy.engine import make_url
+
+# Snapshot modes supported by FlightData
+SNAPSHOT_MODES = ('memory', 'mmap')
+
+# Bytes read at a time when warming up the page cache for an 'mmap' snapshot
+WARM_UP_CHUNK_SIZE = 1 << 20
+
+
+def database_path(db_uri):
+    """
+    Returns the file of an SQLite database URI
+    """
+    url = make_url(db_uri)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        raise ValueError(f"A snapshot needs an SQLite database file, not '{db_uri}'")
+    return url.database
+
+
+def read_only_uri(path, **options):
+    """
+    Returns the SQLite URI filename that opens a database file read-only
+    """
+    query = '&'.join(f"{name}={value}" for name, value in {'mode': 'ro', **options}.items())
+    return f"file:{quote(os.path.abspath(path))}?{query}"
+
+
+def is_read_only_uri(db_uri):
+    """
+    Returns whether an SQLite database URI opens its file read-only
+    (an SQLite URI filename with mode=ro or immutable=1)
+    """
+    url = make_url(db_uri)
+    if url.get_backend_name() != 'sqlite':
+        return False
+    return url.query.get('mode') == 'ro' or url.query.get('immutable') == '1'
+
+
+def load_memory_snapshot(path, **connect_args):
+    """
+    Copies a database file into a new in-memory database.
+    :param connect_args: arguments of the in-memory sqlite3 connection
+    :return: (sqlite3 connection to the in-memory database, report dictionary:
+             mode, seconds to load and bytes held in memory)
+    """
+    start = time.perf_counter()
+    source = sqlite3.connect(read_only_uri(path), uri=True)
+    connection = sqlite3.connect(':memory:', **connect_args)
+    try:
+        source.backup(connection)
+    finally:
+        source.close()
+
+    page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+    page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+    return connection, {'mode': 'memory', 'seconds': time.perf_counter() - start,
+                        'bytes': page_count * page_size}
+
+
+def mmap_snapshot_uri(path):
+    """
+    Returns the SQLAlchemy URI opening a database file read-only and immutable
+    """
+    return f"sqlite:///{read_only_uri(path, immutable=1)}&uri=true"
+
+
+def warm_up(path):
+    """
+    Reads a database file through once, so the memory map finds every page in the
+    OS page cache. Returns the report dictionary: mode, seconds to load and bytes mapped.
+    """
+    start = time.perf_counter()
+    num_bytes = 0
+    with open(path, 'rb', buffering=0) as database_file:
+        while True:
+            chunk = database_file.read(WARM_UP_CHUNK_SIZE)
+            if not chunk:
+                break
+            num_bytes += len(chunk)
+    return {'mode': 'mmap', 'seconds': time.perf_counter() - start, 'bytes': num_bytes}
+
+
+def print_snapshot_report(report):
+    """
+    Prints how long a snapshot took to load and the memory it uses.
+    Goes to stderr, so it doesn't mix with results written to stdout
+    """
+    held = 'in memory' if report['mode'] == 'memory' else 'memory-mapped'
+    print(f"Loaded a {report['mode']} snapshot in {report['seconds']:.2f} seconds "
+          f"({report['bytes'] / 2 ** 20:,.1f} MB {held}).", file=sys.stderr)
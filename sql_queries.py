@@ -69,7 +69,8 @@ QUERY_BY_ORIGIN_DESTINATION_DELAY = """
 SELECT
     flights.ORIGIN_AIRPORT,
     flights.DESTINATION_AIRPORT,
-    CAST(COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END) * 100.0 / COUNT(*) AS INTEGER) AS percentage_delay
+    CAST(COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END) * 100.0 / COUNT(*) AS INTEGER) AS percentage_delay,
+    COUNT(*) AS num_of_flights
 FROM
     flights
 GROUP BY
@@ -110,6 +111,668 @@ WHERE
 """
 
 
+QUERY_DELAYED_FLIGHTS_BY_HOUR = """
+SELECT
+    CAST(SUBSTR(flights.DEPARTURE_TIME, 1, 2) AS INTEGER) AS HOUR_OF_DAY,
+    COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END) AS num_of_delayed_flights,
+    COUNT(*) AS num_of_flights
+FROM
+    flights
+WHERE
+    flights.DEPARTURE_TIME IS NOT NULL AND flights.DEPARTURE_TIME != ''
+    AND flights.DEPARTURE_DELAY IS NOT NULL AND flights.DEPARTURE_DELAY != ''
+GROUP BY HOUR_OF_DAY
+ORDER BY HOUR_OF_DAY;
+"""
+
+# Integer date key of a flight, e.g. 20150301 for 1 March 2015, so date ranges are one
+# BETWEEN. idx_flights_date_key indexes this expression: queries have to spell it the same way
+FLIGHT_DATE_KEY = "flights.YEAR * 10000 + flights.MONTH * 100 + flights.DAY"
+
+# CROSS JOIN keeps flights as the outer loop, searched by date key: with airlines outside,
+# SQLite can pick idx_flights_airline_delay and read every flight once per airline
+QUERY_FLIGHTS_BY_DATE_RANGE = f"""
+SELECT
+    flights.*,
+    airlines.airline,
+    flights.ID AS FLIGHT_ID,
+    flights.DEPARTURE_DELAY AS DELAY
+FROM
+    flights
+    CROSS JOIN airlines ON flights.airline = airlines.id
+WHERE
+    {FLIGHT_DATE_KEY} BETWEEN :start AND :end;
+"""
+
+QUERY_DELAYED_FLIGHTS_BY_DAY = f"""
+SELECT
+    {FLIGHT_DATE_KEY} AS FLIGHT_DATE,
+    COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END) AS num_of_delayed_flights,
+    COUNT(*) AS num_of_flights
+FROM
+    flights
+WHERE
+    {FLIGHT_DATE_KEY} BETWEEN :start AND :end
+GROUP BY FLIGHT_DATE
+ORDER BY FLIGHT_DATE;
+"""
+
+# Keyset-paginated versions of QUERY_FLIGHT_BY_AIRPORT and QUERY_FLIGHT_BY_DATE.
+# Each page is the next :page_size flights with an ID above :after_id (the last ID of the
+# previous page), read straight from the index in ID order, so every page costs the same
+QUERY_FLIGHT_BY_AIRPORT_PAGE = """
+SELECT
+    flights.*,
+    airlines.airline,
+    flights.ID AS FLIGHT_ID,
+    flights.DEPARTURE_DELAY AS DELAY
+FROM
+    flights
+    JOIN airlines ON flights.airline = airlines.id
+WHERE
+    flights.ORIGIN_AIRPORT = :IATA
+    AND flights.ID > :after_id
+ORDER BY flights.ID
+LIMIT :page_size;
+"""
+
+QUERY_FLIGHT_BY_DATE_PAGE = """
+SELECT
+    flights.*,
+    airlines.airline,
+    flights.ID AS FLIGHT_ID,
+    flights.DEPARTURE_DELAY AS DELAY
+FROM
+    flights
+    JOIN airlines ON flights.airline = airlines.id
+WHERE
+    flights.DAY = :day
+    AND flights.MONTH = :month
+    AND flights.YEAR = :year
+    AND flights.ID > :after_id
+ORDER BY flights.ID
+LIMIT :page_size;
+"""
+
+# Lowest and highest flight ID and date key, e.g. to tell which flights a partition database holds.
+# One MIN/MAX per subquery, so each is a single index lookup
+QUERY_FLIGHT_RANGES = f"""
+SELECT
+    (SELECT MIN(flights.ID) FROM flights) AS first_id,
+    (SELECT MAX(flights.ID) FROM flights) AS last_id,
+    (SELECT MIN({FLIGHT_DATE_KEY}) FROM flights) AS first_date,
+    (SELECT MAX({FLIGHT_DATE_KEY}) FROM flights) AS last_date;
+"""
+
+# Batch lookup queries. {keys} is replaced with one placeholder (or placeholder tuple)
+# per key, e.g. ":k0, :k1, :k2", so each query looks up a whole chunk of keys
+QUERY_FLIGHTS_BY_IDS = """
+SELECT
+    flights.*,
+    airlines.airline,
+    flights.ID AS FLIGHT_ID,
+    flights.DEPARTURE_DELAY AS DELAY
+FROM
+    flights
+    JOIN airlines ON flights.airline = airlines.id
+WHERE
+    flights.ID IN ({keys});
+"""
+
+QUERY_FLIGHTS_BY_AIRPORTS = """
+SELECT
+    flights.*,
+    airlines.airline,
+    flights.ID AS FLIGHT_ID,
+    flights.DEPARTURE_DELAY AS DELAY
+FROM
+    flights
+    JOIN airlines ON flights.airline = airlines.id
+WHERE
+    flights.ORIGIN_AIRPORT IN ({keys});
+"""
+
+# The dates are joined as an inline table rather than matched with IN, since SQLite
+# only searches idx_flights_date for them this way. CROSS JOIN keeps lookup_dates as the outer loop
+QUERY_FLIGHTS_BY_DATES = """
+WITH lookup_dates (DAY, MONTH, YEAR) AS (VALUES {keys})
+SELECT
+    flights.*,
+    airlines.airline,
+    flights.ID AS FLIGHT_ID,
+    flights.DEPARTURE_DELAY AS DELAY
+FROM
+    lookup_dates
+    CROSS JOIN flights ON flights.YEAR = lookup_dates.YEAR
+        AND flights.MONTH = lookup_dates.MONTH
+        AND flights.DAY = lookup_dates.DAY
+    JOIN airlines ON flights.airline = airlines.id;
+"""
+
+# Batch lookup query templates, by name
+BATCH_QUERIES = {
+    'flights_by_ids': QUERY_FLIGHTS_BY_IDS,
+    'flights_by_airports': QUERY_FLIGHTS_BY_AIRPORTS,
+    'flights_by_dates': QUERY_FLIGHTS_BY_DATES,
+}
+
+# Materialized aggregate (summary) tables for the chart queries.
+# Each one is refreshed incrementally from the flights with ID in (:last_id, :max_id]
+AGGREGATE_TABLES = {
+    'agg_airline_delay': """
+CREATE TABLE IF NOT EXISTS agg_airline_delay (
+    AIRLINE INTEGER PRIMARY KEY,
+    num_of_delayed_flights INTEGER NOT NULL,
+    num_of_flights INTEGER NOT NULL
+);
+""",
+    'agg_route_delay': """
+CREATE TABLE IF NOT EXISTS agg_route_delay (
+    ORIGIN_AIRPORT TEXT,
+    DESTINATION_AIRPORT TEXT,
+    num_of_delayed_flights INTEGER NOT NULL,
+    num_of_flights INTEGER NOT NULL,
+    PRIMARY KEY (ORIGIN_AIRPORT, DESTINATION_AIRPORT)
+);
+""",
+    'agg_hourly_delay': """
+CREATE TABLE IF NOT EXISTS agg_hourly_delay (
+    HOUR_OF_DAY INTEGER PRIMARY KEY,
+    num_of_delayed_flights INTEGER NOT NULL,
+    num_of_flights INTEGER NOT NULL
+);
+""",
+    'agg_daily_delay': """
+CREATE TABLE IF NOT EXISTS agg_daily_delay (
+    FLIGHT_DATE INTEGER PRIMARY KEY,
+    num_of_delayed_flights INTEGER NOT NULL,
+    num_of_flights INTEGER NOT NULL
+);
+""",
+    'agg_refresh_state': """
+CREATE TABLE IF NOT EXISTS agg_refresh_state (
+    name TEXT PRIMARY KEY,
+    last_flight_id INTEGER NOT NULL
+);
+""",
+}
+
+QUERY_MAX_FLIGHT_ID = """
+SELECT MAX(flights.ID) AS max_id FROM flights;
+"""
+
+QUERY_AGG_LAST_FLIGHT_ID = """
+SELECT last_flight_id FROM agg_refresh_state WHERE name = 'aggregates';
+"""
+
+QUERY_AGG_SET_LAST_FLIGHT_ID = """
+INSERT INTO agg_refresh_state (name, last_flight_id) VALUES ('aggregates', :max_id)
+ON CONFLICT (name) DO UPDATE SET last_flight_id = excluded.last_flight_id;
+"""
+
+AGGREGATE_REFRESH_QUERIES = {
+    'agg_airline_delay': """
+INSERT INTO agg_airline_delay (AIRLINE, num_of_delayed_flights, num_of_flights)
+SELECT
+    flights.AIRLINE,
+    COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(flights.DEPARTURE_TIME)
+FROM
+    flights
+WHERE
+    flights.ID > :last_id AND flights.ID <= :max_id
+GROUP BY flights.AIRLINE
+ON CONFLICT (AIRLINE) DO UPDATE SET
+    num_of_delayed_flights = num_of_delayed_flights + excluded.num_of_delayed_flights,
+    num_of_flights = num_of_flights + excluded.num_of_flights;
+""",
+    'agg_route_delay': """
+INSERT INTO agg_route_delay (ORIGIN_AIRPORT, DESTINATION_AIRPORT, num_of_delayed_flights, num_of_flights)
+SELECT
+    flights.ORIGIN_AIRPORT,
+    flights.DESTINATION_AIRPORT,
+    COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(*)
+FROM
+    flights
+WHERE
+    flights.ID > :last_id AND flights.ID <= :max_id
+GROUP BY
+    flights.ORIGIN_AIRPORT,
+    flights.DESTINATION_AIRPORT
+ON CONFLICT (ORIGIN_AIRPORT, DESTINATION_AIRPORT) DO UPDATE SET
+    num_of_delayed_flights = num_of_delayed_flights + excluded.num_of_delayed_flights,
+    num_of_flights = num_of_flights + excluded.num_of_flights;
+""",
+    'agg_hourly_delay': """
+INSERT INTO agg_hourly_delay (HOUR_OF_DAY, num_of_delayed_flights, num_of_flights)
+SELECT
+    CAST(SUBSTR(flights.DEPARTURE_TIME, 1, 2) AS INTEGER) AS HOUR_OF_DAY,
+    COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(*)
+FROM
+    flights
+WHERE
+    flights.ID > :last_id AND flights.ID <= :max_id
+    AND flights.DEPARTURE_TIME IS NOT NULL AND flights.DEPARTURE_TIME != ''
+    AND flights.DEPARTURE_DELAY IS NOT NULL AND flights.DEPARTURE_DELAY != ''
+GROUP BY HOUR_OF_DAY
+ON CONFLICT (HOUR_OF_DAY) DO UPDATE SET
+    num_of_delayed_flights = num_of_delayed_flights + excluded.num_of_delayed_flights,
+    num_of_flights = num_of_flights + excluded.num_of_flights;
+""",
+    'agg_daily_delay': f"""
+INSERT INTO agg_daily_delay (FLIGHT_DATE, num_of_delayed_flights, num_of_flights)
+SELECT
+    {FLIGHT_DATE_KEY} AS FLIGHT_DATE,
+    COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(*)
+FROM
+    flights
+WHERE
+    flights.ID > :last_id AND flights.ID <= :max_id
+GROUP BY FLIGHT_DATE
+ON CONFLICT (FLIGHT_DATE) DO UPDATE SET
+    num_of_delayed_flights = num_of_delayed_flights + excluded.num_of_delayed_flights,
+    num_of_flights = num_of_flights + excluded.num_of_flights;
+""",
+}
+
+# Chart queries answered from the aggregate tables.
+# They return the same columns, in the same order, as their raw counterparts above
+QUERY_AGG_DELAYED_AND_DEPARTED_FLIGHTS = """
+SELECT
+    airlines.AIRLINE,
+    SUM(agg_airline_delay.num_of_delayed_flights) AS num_of_delayed_flights,
+    SUM(agg_airline_delay.num_of_flights) AS num_of_flights
+FROM
+    agg_airline_delay
+    JOIN airlines ON agg_airline_delay.AIRLINE = airlines.ID
+GROUP BY airlines.airline
+"""
+
+QUERY_AGG_ORIGIN_DESTINATION_DELAY = """
+SELECT
+    agg_route_delay.ORIGIN_AIRPORT,
+    agg_route_delay.DESTINATION_AIRPORT,
+    CAST(agg_route_delay.num_of_delayed_flights * 100.0 / agg_route_delay.num_of_flights AS INTEGER) AS percentage_delay,
+    agg_route_delay.num_of_flights
+FROM
+    agg_route_delay
+ORDER BY agg_route_delay.ORIGIN_AIRPORT, agg_route_delay.DESTINATION_AIRPORT;
+"""
+
+QUERY_AGG_DELAYED_FLIGHTS_BY_HOUR = """
+SELECT
+    agg_hourly_delay.HOUR_OF_DAY,
+    agg_hourly_delay.num_of_delayed_flights,
+    agg_hourly_delay.num_of_flights
+FROM
+    agg_hourly_delay
+ORDER BY agg_hourly_delay.HOUR_OF_DAY;
+"""
+
+QUERY_AGG_DELAYED_FLIGHTS_BY_DAY = """
+SELECT
+    agg_daily_delay.FLIGHT_DATE,
+    agg_daily_delay.num_of_delayed_flights,
+    agg_daily_delay.num_of_flights
+FROM
+    agg_daily_delay
+WHERE
+    agg_daily_delay.FLIGHT_DATE BETWEEN :start AND :end
+ORDER BY agg_daily_delay.FLIGHT_DATE;
+"""
+
+QUERY_AGG_AIRPORT_ORIGIN_DESTINATION_LAT_LONG = """
+SELECT
+    agg_route_delay.ORIGIN_AIRPORT AS origin_airport,
+    origin_airports.LATITUDE AS origin_latitude,
+    origin_airports.LONGITUDE AS origin_longitude,
+    agg_route_delay.DESTINATION_AIRPORT AS destination_airport,
+    dest_airports.LATITUDE AS destination_latitude,
+    dest_airports.LONGITUDE AS destination_longitude,
+    CAST(agg_route_delay.num_of_delayed_flights * 100.0 / agg_route_delay.num_of_flights AS INTEGER) AS percentage_delay
+FROM
+    agg_route_delay
+JOIN airports AS origin_airports ON agg_route_delay.ORIGIN_AIRPORT = origin_airports.IATA_CODE
+JOIN airports AS dest_airports ON agg_route_delay.DESTINATION_AIRPORT = dest_airports.IATA_CODE
+ORDER BY agg_route_delay.ORIGIN_AIRPORT, agg_route_delay.DESTINATION_AIRPORT;
+"""
+
+# Delayed and total flight counts per group of the chart queries, by name: over the flights with
+# ID in (:after_id, :last_id], or as stored in the aggregate tables. Each row is
+# (group..., delayed, total), so the counts of separate ID ranges or databases add up
+# (see parallel_aggregates). They read the ID range from the table itself, so each range
+# costs a share of the rows. CROSS JOIN keeps flights as the outer loop: with airlines
+# outside, SQLite would search the whole ID range once per airline
+PARTIAL_COUNT_QUERIES = {
+    'airline_delay': """
+SELECT
+    airlines.AIRLINE,
+    COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(flights.DEPARTURE_TIME)
+FROM
+    flights
+    CROSS JOIN airlines ON flights.AIRLINE = airlines.ID
+WHERE
+    flights.ID > :after_id AND flights.ID <= :last_id
+GROUP BY airlines.AIRLINE;
+""",
+    'route_delay': """
+SELECT
+    flights.ORIGIN_AIRPORT,
+    flights.DESTINATION_AIRPORT,
+    COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(*)
+FROM
+    flights
+WHERE
+    flights.ID > :after_id AND flights.ID <= :last_id
+GROUP BY
+    flights.ORIGIN_AIRPORT,
+    flights.DESTINATION_AIRPORT;
+""",
+    'route_lat_long_delay': """
+SELECT
+    flights.ORIGIN_AIRPORT,
+    origin_airports.LATITUDE,
+    origin_airports.LONGITUDE,
+    flights.DESTINATION_AIRPORT,
+    dest_airports.LATITUDE,
+    dest_airports.LONGITUDE,
+    COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(*)
+FROM
+    flights
+JOIN airports AS origin_airports ON flights.ORIGIN_AIRPORT = origin_airports.IATA_CODE
+JOIN airports AS dest_airports ON flights.DESTINATION_AIRPORT = dest_airports.IATA_CODE
+WHERE
+    flights.ID > :after_id AND flights.ID <= :last_id
+GROUP BY
+    flights.ORIGIN_AIRPORT,
+    flights.DESTINATION_AIRPORT;
+""",
+    'hourly_delay': """
+SELECT
+    CAST(SUBSTR(flights.DEPARTURE_TIME, 1, 2) AS INTEGER) AS HOUR_OF_DAY,
+    COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(*)
+FROM
+    flights
+WHERE
+    flights.ID > :after_id AND flights.ID <= :last_id
+    AND flights.DEPARTURE_TIME IS NOT NULL AND flights.DEPARTURE_TIME != ''
+    AND flights.DEPARTURE_DELAY IS NOT NULL AND flights.DEPARTURE_DELAY != ''
+GROUP BY HOUR_OF_DAY;
+""",
+    'daily_delay': f"""
+SELECT
+    {FLIGHT_DATE_KEY} AS FLIGHT_DATE,
+    COUNT(CASE WHEN flights.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(*)
+FROM
+    flights
+WHERE
+    flights.ID > :after_id AND flights.ID <= :last_id
+    AND {FLIGHT_DATE_KEY} BETWEEN :start AND :end
+GROUP BY FLIGHT_DATE;
+""",
+}
+
+AGGREGATE_COUNT_QUERIES = {
+    'airline_delay': QUERY_AGG_DELAYED_AND_DEPARTED_FLIGHTS,
+    'route_delay': """
+SELECT
+    agg_route_delay.ORIGIN_AIRPORT,
+    agg_route_delay.DESTINATION_AIRPORT,
+    agg_route_delay.num_of_delayed_flights,
+    agg_route_delay.num_of_flights
+FROM
+    agg_route_delay
+ORDER BY agg_route_delay.ORIGIN_AIRPORT, agg_route_delay.DESTINATION_AIRPORT;
+""",
+    'route_lat_long_delay': """
+SELECT
+    agg_route_delay.ORIGIN_AIRPORT,
+    origin_airports.LATITUDE,
+    origin_airports.LONGITUDE,
+    agg_route_delay.DESTINATION_AIRPORT,
+    dest_airports.LATITUDE,
+    dest_airports.LONGITUDE,
+    agg_route_delay.num_of_delayed_flights,
+    agg_route_delay.num_of_flights
+FROM
+    agg_route_delay
+JOIN airports AS origin_airports ON agg_route_delay.ORIGIN_AIRPORT = origin_airports.IATA_CODE
+JOIN airports AS dest_airports ON agg_route_delay.DESTINATION_AIRPORT = dest_airports.IATA_CODE
+ORDER BY agg_route_delay.ORIGIN_AIRPORT, agg_route_delay.DESTINATION_AIRPORT;
+""",
+    'hourly_delay': QUERY_AGG_DELAYED_FLIGHTS_BY_HOUR,
+    'daily_delay': QUERY_AGG_DELAYED_FLIGHTS_BY_DAY,
+}
+
+# Random sample of the flights for the sampled chart queries (see sampling). Columns are copied
+# without a declared type, so they keep the values (and comparisons) of the flights table.
+# Ordered by SAMPLE_KEY, so the flights below a key limit are read as one range
+SAMPLE_TABLES = {
+    'flight_sample': """
+CREATE TABLE IF NOT EXISTS flight_sample (
+    SAMPLE_KEY INTEGER NOT NULL,
+    ID INTEGER NOT NULL,
+    AIRLINE,
+    ORIGIN_AIRPORT,
+    DESTINATION_AIRPORT,
+    DEPARTURE_TIME,
+    DEPARTURE_DELAY,
+    FLIGHT_DATE INTEGER,
+    PRIMARY KEY (SAMPLE_KEY, ID)
+) WITHOUT ROWID;
+""",
+    'sample_refresh_state': """
+CREATE TABLE IF NOT EXISTS sample_refresh_state (
+    name TEXT PRIMARY KEY,
+    last_flight_id INTEGER NOT NULL,
+    keep_per_million INTEGER NOT NULL
+);
+""",
+}
+
+QUERY_SAMPLE_STATE = """
+SELECT last_flight_id, keep_per_million FROM sample_refresh_state WHERE name = 'sample';
+"""
+
+QUERY_SAMPLE_SET_STATE = """
+INSERT INTO sample_refresh_state (name, last_flight_id, keep_per_million) VALUES ('sample', :max_id, :keep)
+ON CONFLICT (name) DO UPDATE SET
+    last_flight_id = excluded.last_flight_id,
+    keep_per_million = excluded.keep_per_million;
+"""
+
+# Keeps each flight with ID in (:last_id, :max_id] with probability :keep per million,
+# under a random SAMPLE_KEY in [0, :key_range)
+QUERY_SAMPLE_REFRESH = f"""
+INSERT INTO flight_sample (SAMPLE_KEY, ID, AIRLINE, ORIGIN_AIRPORT, DESTINATION_AIRPORT,
+                           DEPARTURE_TIME, DEPARTURE_DELAY, FLIGHT_DATE)
+SELECT
+    ABS(RANDOM() % :key_range),
+    flights.ID,
+    flights.AIRLINE,
+    flights.ORIGIN_AIRPORT,
+    flights.DESTINATION_AIRPORT,
+    flights.DEPARTURE_TIME,
+    flights.DEPARTURE_DELAY,
+    {FLIGHT_DATE_KEY}
+FROM
+    flights
+WHERE
+    flights.ID > :last_id AND flights.ID <= :max_id
+    AND ABS(RANDOM() % 1000000) < :keep;
+"""
+
+# Delayed and total flight counts per group of the chart queries, by name, over the sampled
+# flights with SAMPLE_KEY below :key_limit. Same rows as PARTIAL_COUNT_QUERIES
+SAMPLE_COUNT_QUERIES = {
+    'airline_delay': """
+SELECT
+    airlines.AIRLINE,
+    COUNT(CASE WHEN flight_sample.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(flight_sample.DEPARTURE_TIME)
+FROM
+    flight_sample
+    CROSS JOIN airlines ON flight_sample.AIRLINE = airlines.ID
+WHERE
+    flight_sample.SAMPLE_KEY < :key_limit
+GROUP BY airlines.AIRLINE;
+""",
+    'route_delay': """
+SELECT
+    flight_sample.ORIGIN_AIRPORT,
+    flight_sample.DESTINATION_AIRPORT,
+    COUNT(CASE WHEN flight_sample.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(*)
+FROM
+    flight_sample
+WHERE
+    flight_sample.SAMPLE_KEY < :key_limit
+GROUP BY
+    flight_sample.ORIGIN_AIRPORT,
+    flight_sample.DESTINATION_AIRPORT;
+""",
+    'route_lat_long_delay': """
+SELECT
+    flight_sample.ORIGIN_AIRPORT,
+    origin_airports.LATITUDE,
+    origin_airports.LONGITUDE,
+    flight_sample.DESTINATION_AIRPORT,
+    dest_airports.LATITUDE,
+    dest_airports.LONGITUDE,
+    COUNT(CASE WHEN flight_sample.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(*)
+FROM
+    flight_sample
+CROSS JOIN airports AS origin_airports ON flight_sample.ORIGIN_AIRPORT = origin_airports.IATA_CODE
+JOIN airports AS dest_airports ON flight_sample.DESTINATION_AIRPORT = dest_airports.IATA_CODE
+WHERE
+    flight_sample.SAMPLE_KEY < :key_limit
+GROUP BY
+    flight_sample.ORIGIN_AIRPORT,
+    flight_sample.DESTINATION_AIRPORT;
+""",
+    'hourly_delay': """
+SELECT
+    CAST(SUBSTR(flight_sample.DEPARTURE_TIME, 1, 2) AS INTEGER) AS HOUR_OF_DAY,
+    COUNT(CASE WHEN flight_sample.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(*)
+FROM
+    flight_sample
+WHERE
+    flight_sample.SAMPLE_KEY < :key_limit
+    AND flight_sample.DEPARTURE_TIME IS NOT NULL AND flight_sample.DEPARTURE_TIME != ''
+    AND flight_sample.DEPARTURE_DELAY IS NOT NULL AND flight_sample.DEPARTURE_DELAY != ''
+GROUP BY HOUR_OF_DAY;
+""",
+    'daily_delay': """
+SELECT
+    flight_sample.FLIGHT_DATE,
+    COUNT(CASE WHEN flight_sample.DEPARTURE_DELAY > 0 THEN 1 END),
+    COUNT(*)
+FROM
+    flight_sample
+WHERE
+    flight_sample.SAMPLE_KEY < :key_limit
+    AND flight_sample.FLIGHT_DATE BETWEEN :start AND :end
+GROUP BY flight_sample.FLIGHT_DATE;
+""",
+}
+
+# Queries over the sample tables (and their refresh), by name.
+# Kept apart from REGISTERED_QUERIES since the tables only exist once created
+SAMPLE_QUERIES = {
+    'sample_state': QUERY_SAMPLE_STATE,
+    'sample_set_state': QUERY_SAMPLE_SET_STATE,
+    'sample_refresh': QUERY_SAMPLE_REFRESH,
+    **{f'sample_counts_{name}': query for name, query in SAMPLE_COUNT_QUERIES.items()},
+}
+
+# Registered queries, by name. Used by tools that need to walk every query the app runs
+REGISTERED_QUERIES = {
+    'flight_by_id': QUERY_FLIGHT_BY_ID,
+    'flight_by_airport': QUERY_FLIGHT_BY_AIRPORT,
+    'flight_by_date': QUERY_FLIGHT_BY_DATE,
+    'flight_by_airline': QUERY_FLIGHT_BY_AIRLINE,
+    'delayed_and_departed_flights': QUERY_BY_DELAYED_AND_DEPARTED_FLIGHTS,
+    'origin_destination_delay': QUERY_BY_ORIGIN_DESTINATION_DELAY,
+    'airport_origin_destination_lat_long': QUERY_AIRPORT_ORIGIN_DESTINATION_LAT_LONG,
+    'flight_by_delay_and_departure_time': QUERY_FLIGHT_BY_DELAY_AND_DEPARTURE_TIME,
+    'delayed_flights_by_hour': QUERY_DELAYED_FLIGHTS_BY_HOUR,
+    'flight_by_airport_page': QUERY_FLIGHT_BY_AIRPORT_PAGE,
+    'flight_by_date_page': QUERY_FLIGHT_BY_DATE_PAGE,
+    'flights_by_date_range': QUERY_FLIGHTS_BY_DATE_RANGE,
+    'delayed_flights_by_day': QUERY_DELAYED_FLIGHTS_BY_DAY,
+    'flight_ranges': QUERY_FLIGHT_RANGES,
+}
+
+# Queries over the aggregate tables (and their refresh), by name.
+# Kept apart from REGISTERED_QUERIES since the tables only exist once created
+AGGREGATE_QUERIES = {
+    'agg_delayed_and_departed_flights': QUERY_AGG_DELAYED_AND_DEPARTED_FLIGHTS,
+    'agg_origin_destination_delay': QUERY_AGG_ORIGIN_DESTINATION_DELAY,
+    'agg_delayed_flights_by_hour': QUERY_AGG_DELAYED_FLIGHTS_BY_HOUR,
+    'agg_delayed_flights_by_day': QUERY_AGG_DELAYED_FLIGHTS_BY_DAY,
+    'agg_airport_origin_destination_lat_long': QUERY_AGG_AIRPORT_ORIGIN_DESTINATION_LAT_LONG,
+    'agg_max_flight_id': QUERY_MAX_FLIGHT_ID,
+    'agg_last_flight_id': QUERY_AGG_LAST_FLIGHT_ID,
+    'agg_set_last_flight_id': QUERY_AGG_SET_LAST_FLIGHT_ID,
+    **{f'refresh_{table}': query for table, query in AGGREGATE_REFRESH_QUERIES.items()},
+    'agg_counts_route_delay': AGGREGATE_COUNT_QUERIES['route_delay'],
+    'agg_counts_route_lat_long_delay': AGGREGATE_COUNT_QUERIES['route_lat_long_delay'],
+}
+
+
+# Indexes for the flights, airlines and airports tables, by name
+FLIGHT_INDEXES = {
+    # QUERY_FLIGHT_BY_DATE, and QUERY_FLIGHT_BY_DATE_PAGE in ID order
+    'idx_flights_date': """
+CREATE INDEX IF NOT EXISTS idx_flights_date
+ON flights (YEAR, MONTH, DAY);
+""",
+    # Date ranges over FLIGHT_DATE_KEY (QUERY_FLIGHTS_BY_DATE_RANGE, QUERY_DELAYED_FLIGHTS_BY_DAY)
+    'idx_flights_date_key': """
+CREATE INDEX IF NOT EXISTS idx_flights_date_key
+ON flights ((YEAR * 10000 + MONTH * 100 + DAY));
+""",
+    # QUERY_FLIGHT_BY_AIRPORT_PAGE: the flights of an airport in ID order
+    'idx_flights_origin': """
+CREATE INDEX IF NOT EXISTS idx_flights_origin
+ON flights (ORIGIN_AIRPORT);
+""",
+    # QUERY_FLIGHT_BY_AIRPORT, and covering for the route GROUP BY queries
+    'idx_flights_route_delay': """
+CREATE INDEX IF NOT EXISTS idx_flights_route_delay
+ON flights (ORIGIN_AIRPORT, DESTINATION_AIRPORT, DEPARTURE_DELAY);
+""",
+    # QUERY_FLIGHT_BY_AIRLINE, and covering for QUERY_BY_DELAYED_AND_DEPARTED_FLIGHTS
+    'idx_flights_airline_delay': """
+CREATE INDEX IF NOT EXISTS idx_flights_airline_delay
+ON flights (AIRLINE, DEPARTURE_DELAY, DEPARTURE_TIME);
+""",
+    # Covering for QUERY_FLIGHT_BY_DELAY_AND_DEPARTURE_TIME
+    'idx_flights_departure_time_delay': """
+CREATE INDEX IF NOT EXISTS idx_flights_departure_time_delay
+ON flights (DEPARTURE_TIME, DEPARTURE_DELAY);
+""",
+    'idx_airlines_airline': """
+CREATE INDEX IF NOT EXISTS idx_airlines_airline
+ON airlines (AIRLINE);
+""",
+    'idx_airports_iata_code': """
+CREATE INDEX IF NOT EXISTS idx_airports_iata_code
+ON airports (IATA_CODE, LATITUDE, LONGITUDE);
+""",
+}
+
+
 # Other Queries.
 "----------------------****************---------------*******************----------------************************"
 """